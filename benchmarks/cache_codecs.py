@@ -0,0 +1,109 @@
+"""
+Compares the cache codecs of `calendar_ipynb.cache_codecs` on caches of
+increasing size: time to save & load the whole cache, and size on disk.
+Events look like the ones the Calendar API returns, recurring instances share
+their summary, attendees etc.
+
+Usage: python -m benchmarks.cache_codecs
+"""
+
+import os
+import random
+import tempfile
+import timeit
+from datetime import datetime, timedelta
+
+from calendar_ipynb.cache_codecs import CACHE_CODECS
+from calendar_ipynb.slim_events import SlimEventIndex
+
+CACHE_SIZES = [1_000, 10_000, 100_000]
+RECURRING_EVENTS = 200
+
+SUMMARIES = ["Standup", "1:1", "Focus time", "Lunch", "Planning", "Gym", "Review"]
+
+
+def make_event(i: int, rng: random.Random) -> dict:
+    series = rng.randrange(RECURRING_EVENTS)
+    start = datetime(2020, 1, 1, 8) + timedelta(
+        days=rng.randrange(6 * 365), minutes=15 * rng.randrange(40)
+    )
+    end = start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90]))
+    eid = rng.getrandbits(120)
+    return {
+        "kind": "calendar#event",
+        "etag": f'"{rng.getrandbits(60)}"',
+        "id": f"series{series}_{start:%Y%m%dT%H%M%SZ}_{i}",
+        "status": "confirmed",
+        "htmlLink": f"https://www.google.com/calendar/event?eid={eid:x}",
+        "created": "2019-11-04T09:12:40.000Z",
+        "updated": f"{start:%Y-%m-%d}T07:00:00.000Z",
+        "summary": SUMMARIES[series % len(SUMMARIES)],
+        "creator": {"email": "me@example.com", "self": True},
+        "organizer": {"email": f"team{series % 7}@example.com"},
+        "start": {
+            "dateTime": f"{start:%Y-%m-%dT%H:%M:%S}+01:00",
+            "timeZone": "Europe/Berlin",
+        },
+        "end": {
+            "dateTime": f"{end:%Y-%m-%dT%H:%M:%S}+01:00",
+            "timeZone": "Europe/Berlin",
+        },
+        "recurringEventId": f"series{series}",
+        "originalStartTime": {"dateTime": f"{start:%Y-%m-%dT%H:%M:%S}+01:00"},
+        "iCalUID": f"series{series}@google.com",
+        "sequence": 0,
+        "attendees": [
+            {
+                "email": f"person{(series + j) % 50}@example.com",
+                "responseStatus": "accepted",
+            }
+            for j in range(series % 5)
+        ],
+        "reminders": {"useDefault": True},
+        "eventType": "default",
+    }
+
+
+def make_cache(cache_size: int) -> dict:
+    rng = random.Random(cache_size)
+    events = SlimEventIndex(make_event(i, rng) for i in range(cache_size))
+    # Saved the way JsonEventStore.save does, from the slim in-memory form
+    return {
+        "sync_token": "CPDAlvWDx70CEPDAlvWDx70CGAU=",
+        "page_token": "",
+        "history_start": "",
+        "events": events.values(),
+        "calendarId": "primary",
+        "email": "me@example.com",
+        "last_sync": datetime.now().isoformat(),
+    }
+
+
+def main():
+    print(
+        f"{'cache size':>12} {'codec':>12} {'save (ms)':>10} "
+        f"{'load (ms)':>10} {'size (KiB)':>11}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        stem = os.path.join(directory, "cache")
+        for cache_size in CACHE_SIZES:
+            cache = make_cache(cache_size)
+            repeat = 5 if cache_size < 100_000 else 1
+            for name, codec in CACHE_CODECS.items():
+                save = min(
+                    timeit.repeat(
+                        lambda: codec.write(stem, cache), number=1, repeat=repeat
+                    )
+                )
+                load = min(
+                    timeit.repeat(lambda: codec.read(stem), number=1, repeat=repeat)
+                )
+                size = os.path.getsize(codec.get_path(stem))
+                print(
+                    f"{cache_size:>12} {name:>12} {save * 1000:>10.1f} "
+                    f"{load * 1000:>10.1f} {size / 1024:>11.0f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Times `events.handle_overlapping_event_durations` on days of realistically
+overlapping events, against the time-slice scan it replaced. The sweep should
+scale with n log n, the scan with boundaries x events.
+
+Usage: python -m benchmarks.overlapping_events
+"""
+
+import random
+import timeit
+from datetime import datetime, timedelta, timezone
+
+from calendar_ipynb.event_views import Event
+from calendar_ipynb.events import handle_overlapping_event_durations
+
+EVENT_COUNTS = [1_000, 10_000, 100_000]
+EVENTS_PER_DAY = 25
+# The scan takes minutes beyond this
+MAX_SCAN_EVENTS = 10_000
+
+
+def make_events(count: int) -> list:
+    rng = random.Random(count)
+    first_day = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    events = []
+    for i in range(count):
+        start = first_day + timedelta(
+            days=i // EVENTS_PER_DAY, minutes=rng.randrange(7 * 60, 22 * 60, 15)
+        )
+        end = start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120]))
+        events.append(
+            {
+                "start": {"dateTime": start.isoformat(), "timeZone": "UTC"},
+                "end": {"dateTime": end.isoformat(), "timeZone": "UTC"},
+            }
+        )
+    return [Event(event) for event in events]
+
+
+def scan_overlapping_event_durations(events: list) -> list:
+    # The previous implementation, rescanning every event for every slice
+    boundaries = sorted({e.start_ts for e in events} | {e.end_ts for e in events})
+    for event in events:
+        event["duration_min"] = 0
+
+    for i in range(len(boundaries) - 1):
+        slice_start = boundaries[i]
+        slice_end = boundaries[i + 1]
+        active_events = [
+            event
+            for event in events
+            if event.start_ts <= slice_start and event.end_ts >= slice_end
+        ]
+        if active_events:
+            duration_per_event = (slice_end - slice_start) / 60 / len(active_events)
+            for event in active_events:
+                event["duration_min"] += duration_per_event
+
+    return events
+
+
+def main():
+    print(f"{'events':>10} {'sweep (ms)':>12} {'scan (ms)':>12}")
+    for count in EVENT_COUNTS:
+        events = make_events(count)
+        sweep = min(
+            timeit.repeat(
+                lambda: handle_overlapping_event_durations(events), number=1, repeat=3
+            )
+        )
+        scan = "skipped"
+        if count <= MAX_SCAN_EVENTS:
+            elapsed = timeit.timeit(
+                lambda: scan_overlapping_event_durations(events), number=1
+            )
+            scan = f"{elapsed * 1000:.1f}"
+        print(f"{count:>10} {sweep * 1000:>12.1f} {scan:>12}")
+
+
+if __name__ == "__main__":
+    main()
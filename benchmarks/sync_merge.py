@@ -0,0 +1,66 @@
+"""
+Times `events_incremental._merge_events` for a single 500 item delta page
+against caches of increasing size. The per-page cost should stay flat.
+
+Usage: python -m benchmarks.sync_merge
+"""
+
+import random
+import timeit
+
+from calendar_ipynb.events_incremental import _merge_events
+
+PAGE_SIZE = 500
+CACHE_SIZES = [1_000, 10_000, 100_000]
+
+
+def make_event(i: int) -> dict:
+    return {
+        "id": f"event_{i}",
+        "status": "confirmed",
+        "summary": f"Event {i}",
+        "start": {"dateTime": "2025-01-01T10:00:00+00:00"},
+        "end": {"dateTime": "2025-01-01T11:00:00+00:00"},
+    }
+
+
+def make_page(cache_size: int) -> list:
+    # A realistic delta: mostly updates, some cancellations and new events
+    rng = random.Random(cache_size)
+    page = []
+    for _ in range(PAGE_SIZE):
+        roll = rng.random()
+        if roll < 0.6:
+            page.append(make_event(rng.randrange(cache_size)))
+        elif roll < 0.8:
+            event_id = f"event_{rng.randrange(cache_size)}"
+            page.append({"id": event_id, "status": "cancelled"})
+        else:
+            page.append(make_event(cache_size + rng.randrange(cache_size)))
+    return page
+
+
+def main():
+    print(f"{'cache size':>12} {'merge (ms)':>12} {'per change (us)':>16}")
+    for cache_size in CACHE_SIZES:
+        cache = {e["id"]: e for e in map(make_event, range(cache_size))}
+        page = make_page(cache_size)
+
+        # Each run merges into a fresh copy so every run sees the same cache
+        elapsed = min(
+            timeit.repeat(
+                "_merge_events(events, page)",
+                setup="events = dict(cache)",
+                globals={"_merge_events": _merge_events, "cache": cache, "page": page},
+                number=1,
+                repeat=20,
+            )
+        )
+        print(
+            f"{cache_size:>12} {elapsed * 1000:>12.3f} "
+            f"{elapsed * 1_000_000 / PAGE_SIZE:>16.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
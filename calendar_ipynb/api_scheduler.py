@@ -0,0 +1,290 @@
+"""
+Every Calendar API request goes through execute_request, which:
+- Spends a token from the account's bucket, so one account cannot burn through
+  its per-user quota however many calendars are synced at once
+- Waits for a slot under an adaptive concurrency limit. The limit grows while
+  requests succeed, and is halved whenever one is rate limited. Latency is not
+  a signal: requests range from 1 event lookups to 2500 event pages & batches.
+- Serves waiting requests by priority, so interactive syncs of the calendars in
+  view are not stuck behind a history backfill
+- Retries throttled & transient failures with exponential backoff and jitter
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Union
+
+from googleapiclient.errors import HttpError
+from httplib2 import HttpLib2Error
+
+logger = logging.getLogger(__name__)
+
+# Lower runs first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKFILL = 1
+PRIORITY_BACKGROUND = 2
+
+# Calendar API allows ~600 requests per minute per user by default
+ACCOUNT_REQUESTS_PER_SECOND = 8
+ACCOUNT_BURST = 20
+
+INITIAL_CONCURRENT_REQUESTS = 10
+MIN_CONCURRENT_REQUESTS = 1
+MAX_CONCURRENT_REQUESTS = 32
+
+MAX_RETRIES = 5
+
+
+class TokenBucket:
+    """
+    `rate` tokens per second, up to `capacity`. Tokens can be reserved ahead,
+    the caller then waits for the returned delay before sending.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, cost: float = 1) -> float:
+        """
+        Takes `cost` tokens and returns how many seconds to wait before using them
+        """
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            self.tokens -= cost
+            return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds: float):
+        """
+        Holds back every request of the account, after it was throttled
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class ConcurrencyLimiter:
+    """
+    Limits requests in flight, with waiters served by (priority, arrival).
+    The limit grows additively on every response that is not rate limited, and
+    is halved whenever one is. Threads wait in acquire(), coroutines of
+    events_async in acquire_async(), in the same queue.
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.waiting = []
+        self.counter = itertools.count()
+        self.condition = threading.Condition()
+        # (loop, future) of the coroutines waiting in acquire_async
+        self.async_waiters = []
+
+    def acquire(self, priority: int):
+        with self.condition:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+            while not self._try_acquire(ticket):
+                self.condition.wait()
+
+    async def acquire_async(self, priority: int):
+        loop = asyncio.get_running_loop()
+        with self.condition:
+            ticket = (priority, next(self.counter))
+            heapq.heappush(self.waiting, ticket)
+
+        try:
+            while True:
+                with self.condition:
+                    if self._try_acquire(ticket):
+                        return
+                    future = loop.create_future()
+                    self.async_waiters.append((loop, future))
+                await future
+        except asyncio.CancelledError:
+            with self.condition:
+                if ticket in self.waiting:
+                    self.waiting.remove(ticket)
+                    heapq.heapify(self.waiting)
+                    self._notify()
+            raise
+
+    def _try_acquire(self, ticket: tuple) -> bool:
+        if self.waiting[0] != ticket or self.in_flight >= int(self.limit):
+            return False
+        heapq.heappop(self.waiting)
+        self.in_flight += 1
+        # The next waiter may fit under the limit as well
+        self._notify()
+        return True
+
+    def _notify(self):
+        self.condition.notify_all()
+        for loop, future in self.async_waiters:
+            loop.call_soon_threadsafe(_set_future_result, future)
+        self.async_waiters.clear()
+
+    def release(self, throttled: bool):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+                logger.debug(f"Throttled, concurrency limit down to {self.limit:.1f}")
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._notify()
+
+
+def _set_future_result(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class ApiScheduler:
+    def __init__(self):
+        self.limiter = ConcurrencyLimiter(
+            INITIAL_CONCURRENT_REQUESTS,
+            MIN_CONCURRENT_REQUESTS,
+            MAX_CONCURRENT_REQUESTS,
+        )
+        self.buckets = dict()
+        self.buckets_lock = threading.Lock()
+
+    def get_bucket(self, email: str) -> TokenBucket:
+        with self.buckets_lock:
+            if email not in self.buckets:
+                self.buckets[email] = TokenBucket(
+                    ACCOUNT_REQUESTS_PER_SECOND, ACCOUNT_BURST
+                )
+            return self.buckets[email]
+
+    def execute(
+        self,
+        email: str,
+        request,
+        priority: int = PRIORITY_INTERACTIVE,
+        cost: Union[int, Dict[str, int]] = 1,
+        max_retries: int = MAX_RETRIES,
+    ):
+        costs = cost if isinstance(cost, dict) else {email: cost}
+        buckets = {account: self.get_bucket(account) for account in costs}
+        for attempt in range(max_retries + 1):
+            time.sleep(max(buckets[account].reserve(c) for account, c in costs.items()))
+
+            self.limiter.acquire(priority)
+            throttled = False
+            try:
+                return request.execute()
+            except Exception as e:
+                throttled = is_rate_limit_error(e)
+                if not is_retryable_error(e) or attempt == max_retries:
+                    raise e
+                error = e
+            finally:
+                self.limiter.release(throttled)
+
+            delay = get_backoff_delay(attempt + 1)
+            logger.warning(
+                f"Request of {email} failed, retrying in {delay:.1f}s: {error}"
+            )
+            for bucket in buckets.values():
+                bucket.pause(delay)
+            time.sleep(delay)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Holds the default priority of each thread, see request_priority
+_thread_state = threading.local()
+
+
+def get_scheduler() -> ApiScheduler:
+    global _scheduler
+
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ApiScheduler()
+        return _scheduler
+
+
+def execute_request(
+    email: str,
+    request,
+    priority: int = None,
+    cost: Union[int, Dict[str, int]] = 1,
+    max_retries: int = MAX_RETRIES,
+):
+    """
+    Executes a googleapiclient request (or batch request) of the account.
+    `cost` is the number of API calls it makes, e.g. the size of a batch. A batch
+    spanning several accounts passes the calls of each, keyed by email.
+    `priority` defaults to the one set by request_priority, else interactive.
+    """
+    if priority is None:
+        priority = getattr(_thread_state, "priority", PRIORITY_INTERACTIVE)
+    return get_scheduler().execute(email, request, priority, cost, max_retries)
+
+
+@contextmanager
+def request_priority(priority: int):
+    """
+    Default priority of the requests made by the current thread
+    """
+    previous = getattr(_thread_state, "priority", PRIORITY_INTERACTIVE)
+    _thread_state.priority = priority
+    try:
+        yield
+    finally:
+        _thread_state.priority = previous
+
+
+def get_backoff_delay(attempt: int) -> float:
+    # Exponential backoff with jitter
+    return min(2**attempt, 32) + random.random()
+
+
+def is_retryable_status(status: int, content) -> bool:
+    return status >= 500 or is_rate_limit_status(status, content)
+
+
+def is_rate_limit_status(status: int, content) -> bool:
+    if status == 429:
+        return True
+
+    # Calendar API reports rate limits as 403s
+    return status == 403 and any(
+        reason in str(content)
+        for reason in ("rateLimitExceeded", "userRateLimitExceeded")
+    )
+
+
+def is_rate_limit_error(exception: Exception) -> bool:
+    return isinstance(exception, HttpError) and is_rate_limit_status(
+        exception.resp.status, exception.content
+    )
+
+
+def is_retryable_error(exception: Exception) -> bool:
+    if isinstance(exception, HttpError):
+        return is_retryable_status(exception.resp.status, exception.content)
+    # Transport failures. Other OSErrors, e.g. a missing credentials file, are not
+    # network trouble. httplib2 raises its own, e.g. ServerNotFoundError offline.
+    return isinstance(
+        exception, (ConnectionError, TimeoutError, socket.gaierror, HttpLib2Error)
+    )
@@ -0,0 +1,146 @@
+"""
+File encodings of the event caches, see event_store.py.
+A cache file is addressed by its path without extension, the codec picks the
+extension. Files written with another codec, e.g. the indented JSON caches of
+older versions, are read and rewritten with the current codec the first time
+they are opened.
+
+- json: indented JSON, human readable but the slowest to load and the largest
+- binary: marshal, about half the size of JSON and faster to load. Strings
+  shared between events (see slim_events.py) are only stored once. Unlike
+  pickle, loading a tampered file can't run code. Caches must hold plain JSON
+  types (plus tuples & bytes).
+- -gzip / -lzma: the same, compressed. lzma is the smallest and the slowest.
+
+Compare them on your machine with `python -m benchmarks.cache_codecs`.
+"""
+
+import os
+import gzip
+import json
+import lzma
+import marshal
+import logging
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+CACHE_CODEC = "binary"
+
+
+class CorruptCacheError(ValueError):
+    pass
+
+
+class CacheCodec:
+    def __init__(
+        self,
+        extension: str,
+        encode: Callable[[object], bytes],
+        decode: Callable[[bytes], object],
+        compression=None,
+    ):
+        self.extension = extension
+        self.encode = encode
+        self.decode = decode
+        # A module with compress() & decompress(), e.g. gzip
+        self.compression = compression
+
+    def get_path(self, stem: str) -> str:
+        return f"{stem}.{self.extension}"
+
+    def read(self, stem: str):
+        with open(self.get_path(stem), "rb") as f:
+            content = f.read()
+        try:
+            if self.compression is not None:
+                content = self.compression.decompress(content)
+            return self.decode(content)
+        except Exception as e:
+            # Whatever the file holds, it is resynced rather than raised
+            raise CorruptCacheError(f"{self.get_path(stem)}: {e}") from e
+
+    def write(self, stem: str, data):
+        content = self.encode(data)
+        if self.compression is not None:
+            content = self.compression.compress(content)
+
+        # Write to a temporary file first so a crash never leaves a torn cache
+        path = self.get_path(stem)
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(content)
+        os.replace(f"{path}.tmp", path)
+
+
+def _encode_json(data) -> bytes:
+    return json.dumps(data, separators=(",", ":")).encode()
+
+
+def _encode_marshal(data) -> bytes:
+    return marshal.dumps(data)
+
+
+CACHE_CODECS = {
+    "json": CacheCodec(
+        "json", lambda data: json.dumps(data, indent=2).encode(), json.loads
+    ),
+    "json-gzip": CacheCodec("json.gz", _encode_json, json.loads, gzip),
+    "json-lzma": CacheCodec("json.xz", _encode_json, json.loads, lzma),
+    "binary": CacheCodec("bin", _encode_marshal, marshal.loads),
+    "binary-gzip": CacheCodec("bin.gz", _encode_marshal, marshal.loads, gzip),
+    "binary-lzma": CacheCodec("bin.xz", _encode_marshal, marshal.loads, lzma),
+}
+
+
+def get_cache_codec(name: str = None) -> CacheCodec:
+    name = name or CACHE_CODEC
+    if name not in CACHE_CODECS:
+        raise ValueError(f"Unknown cache codec {name}. Available: {list(CACHE_CODECS)}")
+    return CACHE_CODECS[name]
+
+
+def get_cache_file_path(stem: str) -> str:
+    return get_cache_codec().get_path(stem)
+
+
+def read_cache_file(stem: str):
+    """
+    Reads the cache file, migrating it to the current codec if it was written
+    with another one. Raises FileNotFoundError if there is none.
+    """
+    codec = get_cache_codec()
+    try:
+        return codec.read(stem)
+    except FileNotFoundError:
+        pass
+
+    for other in CACHE_CODECS.values():
+        if other is codec or not os.path.exists(other.get_path(stem)):
+            continue
+
+        data = other.read(stem)
+        logger.info(f"Migrating {other.get_path(stem)} to {CACHE_CODEC}")
+        codec.write(stem, data)
+        os.remove(other.get_path(stem))
+        return data
+
+    raise FileNotFoundError(codec.get_path(stem))
+
+
+def write_cache_file(stem: str, data):
+    get_cache_codec().write(stem, data)
+
+
+def remove_cache_file(stem: str):
+    """
+    Removes the cache file, whichever codec it was written with
+    """
+    for codec in CACHE_CODECS.values():
+        try:
+            os.remove(codec.get_path(stem))
+        except FileNotFoundError:
+            pass
+
+
+def cache_file_exists(stem: str) -> bool:
+    return any(os.path.exists(codec.get_path(stem)) for codec in CACHE_CODECS.values())
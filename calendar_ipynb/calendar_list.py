@@ -0,0 +1,123 @@
+"""
+Calendar metadata (summary, timeZone, ...) of every account, as returned by
+calendarList().list(). It is persisted next to the event cache and refreshed
+on a TTL, with every stale account refreshed in a single batch request.
+"""
+
+import os
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytz
+
+from . import events_incremental
+from .api_scheduler import execute_request
+from .events import get_calendar_service
+from .utils import get_temp_path
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_LIST_MAX_AGE = timedelta(hours=12)
+
+
+def get_calendar_lists(
+    emails: List[str], max_age: timedelta = None
+) -> Dict[str, List[dict]]:
+    """
+    Returns the calendars of every account, keyed by email.
+    Only accounts whose cached list is older than `max_age` are refreshed.
+    """
+    if max_age is None:
+        max_age = CALENDAR_LIST_MAX_AGE
+
+    now = datetime.now(tz=pytz.UTC)
+    cached = {email: _load_calendar_list(email) for email in emails}
+    stale = [
+        email
+        for email, data in cached.items()
+        if data is None or now - datetime.fromisoformat(data["last_refresh"]) >= max_age
+    ]
+
+    if stale and events_incremental.OFFLINE:
+        logger.warning(f"Offline: Using cached calendar lists of {stale}")
+    elif stale:
+        cached.update(refresh_calendar_lists(stale))
+
+    calendar_lists = dict()
+    for email, data in cached.items():
+        if data is None:
+            raise ValueError(f"No calendar list found for {email}")
+        calendar_lists[email] = data["items"]
+    return calendar_lists
+
+
+def refresh_calendar_lists(emails: List[str]) -> Dict[str, dict]:
+    """
+    Fetches the calendar lists of all the accounts in one batch request and
+    persists them. Accounts that failed to refresh are left out of the result.
+    """
+    if not emails:
+        return {}
+
+    results = dict()
+
+    def callback(email, response, exception):
+        if exception is not None:
+            logger.warning(f"Failed to refresh calendar list of {email}: {exception}")
+            return
+        results[email] = response
+
+    # Each sub-request carries the credentials of its own account
+    batch = get_calendar_service(emails[0]).new_batch_http_request(callback=callback)
+    for email in emails:
+        batch.add(
+            get_calendar_service(email).calendarList().list(maxResults=250),
+            request_id=email,
+        )
+    # Quota is per user, each account is charged its own sub-request
+    execute_request(emails[0], batch, cost={email: 1 for email in emails})
+
+    refreshed = dict()
+    for email, response in results.items():
+        calendars = response.get("items", [])
+
+        # More than 250 calendars, page through the rest one by one
+        page_token = response.get("nextPageToken")
+        while page_token:
+            response = execute_request(
+                email,
+                get_calendar_service(email)
+                .calendarList()
+                .list(maxResults=250, pageToken=page_token),
+            )
+            calendars.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+
+        refreshed[email] = {
+            "last_refresh": datetime.now(tz=pytz.UTC).isoformat(),
+            "items": calendars,
+        }
+        _update_calendar_list(email, refreshed[email])
+
+    return refreshed
+
+
+def _load_calendar_list(email: str):
+    try:
+        with open(_get_calendar_list_path(email), "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _update_calendar_list(email: str, data: dict):
+    with open(_get_calendar_list_path(email), "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def _get_calendar_list_path(email: str) -> str:
+    os.makedirs(get_temp_path("all_events"), exist_ok=True)
+
+    return get_temp_path(f"all_events/{email}.calendars.json")
@@ -0,0 +1,270 @@
+"""
+Bulk insert / update / patch / delete of events, plus bulk get to load complete
+events that were synced with events_incremental.SYNC_EVENT_FIELDS.
+Mutations are grouped per account into batch requests of up to 50 sub-requests,
+accounts are processed in parallel, and failed sub-requests are retried on their own.
+Inserts get a client generated event id, so an insert retried after its response
+was lost fails with 409 instead of creating a duplicate, and counts as done.
+"""
+
+import logging
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Literal, Optional, TypedDict
+
+from googleapiclient.errors import HttpError
+
+from .api_scheduler import (
+    MAX_RETRIES,
+    execute_request,
+    get_backoff_delay,
+    is_retryable_error,
+)
+from .events import get_calendar_service, get_standalone_event_copy
+
+logger = logging.getLogger(__name__)
+
+# Google recommends staying at or below 50 sub-requests per batch
+BATCH_SIZE = 50
+
+
+class EventMutation(TypedDict, total=False):
+    op: Literal["insert", "update", "patch", "delete", "get"]
+    email: str
+    calendar_id: str
+    # Required for all but insert
+    event_id: str
+    # Required for insert, update & patch
+    body: dict
+
+
+class MutationResult(TypedDict):
+    mutation: EventMutation
+    # The API response, None for deletes and failures. The inserted body for
+    # inserts whose earlier attempt turned out to have succeeded.
+    response: Optional[dict]
+    error: Optional[Exception]
+
+
+def execute_mutations(
+    mutations: List[EventMutation],
+    batch_size: int = BATCH_SIZE,
+    max_retries: int = MAX_RETRIES,
+) -> List[MutationResult]:
+    """
+    Executes all the mutations and returns one result per mutation, in order.
+    Failures are reported in the results rather than raised.
+    """
+    results: List[MutationResult] = [
+        MutationResult(mutation=_with_event_id(mutation), response=None, error=None)
+        for mutation in mutations
+    ]
+
+    by_email: Dict[str, List[int]] = dict()
+    for i, mutation in enumerate(mutations):
+        by_email.setdefault(mutation["email"], []).append(i)
+
+    def execute_account(indexes: List[int]):
+        _execute_account_mutations(results, indexes, batch_size, max_retries)
+
+    with ThreadPoolExecutor(max_workers=max(len(by_email), 1)) as executor:
+        list(executor.map(execute_account, by_email.values()))
+
+    failed = [x for x in results if x["error"] is not None]
+    logger.info(
+        f"Executed {len(mutations)} mutations: "
+        f"{len(mutations) - len(failed)} succeeded, {len(failed)} failed"
+    )
+    return results
+
+
+def duplicate_recurring_event_instances(instances: List[dict]) -> List[MutationResult]:
+    """
+    Bulk version of events.delete_and_duplicate_recurring_event_instance.
+    Instances are expected to carry `email` & `calendar_id`, as returned by
+    fetch_events. Copies are inserted first, and only the instances whose copy
+    was created get cancelled. Returns the results of the instances that could
+    not be loaded, then of the inserts, then of the cancellations.
+    """
+    # Copies need the fields left out while syncing (description, attendees, ...)
+    fetched = fetch_full_events(instances)
+    failed = [result for result in fetched if result["error"] is not None]
+    instances = [result["response"] for result in fetched if result["error"] is None]
+
+    inserts = execute_mutations(
+        [
+            EventMutation(
+                op="insert",
+                email=instance["email"],
+                calendar_id=instance["calendar_id"],
+                body=get_standalone_event_copy(instance),
+            )
+            for instance in instances
+        ]
+    )
+
+    cancellations = execute_mutations(
+        [
+            EventMutation(
+                op="patch",
+                email=instance["email"],
+                calendar_id=instance["calendar_id"],
+                event_id=instance["id"],
+                body={"status": "cancelled"},
+            )
+            for instance, result in zip(instances, inserts)
+            if result["error"] is None
+        ]
+    )
+    for result in cancellations:
+        if result["error"] is not None:
+            logger.error(
+                f"Duplicated but failed to cancel {result['mutation']['event_id']}: "
+                f"{result['error']}"
+            )
+
+    return failed + inserts + cancellations
+
+
+def fetch_full_events(events: List[dict]) -> List[MutationResult]:
+    """
+    Complete resources of events returned by fetch_events, which only carry
+    events_incremental.SYNC_EVENT_FIELDS, as the `response` of each result.
+    `email` & `calendar_id` are kept. Failures are reported in the results.
+    """
+    results = execute_mutations(
+        [
+            EventMutation(
+                op="get",
+                email=event["email"],
+                calendar_id=event["calendar_id"],
+                event_id=event["id"],
+            )
+            for event in events
+        ]
+    )
+
+    for event, result in zip(events, results):
+        if result["error"] is not None:
+            logger.error(f"Failed to load {event['id']}: {result['error']}")
+            continue
+        result["response"] = {
+            **result["response"],
+            "calendar_id": event["calendar_id"],
+            "email": event["email"],
+        }
+    return results
+
+
+def _with_event_id(mutation: EventMutation) -> EventMutation:
+    if mutation["op"] != "insert" or "id" in mutation["body"]:
+        return mutation
+
+    # Event ids are base32hex, lowercase hex digits are a subset of it
+    return EventMutation(mutation, body={**mutation["body"], "id": uuid.uuid4().hex})
+
+
+def _execute_account_mutations(
+    results: List[MutationResult],
+    indexes: List[int],
+    batch_size: int,
+    max_retries: int,
+):
+    """
+    All the mutations of a single account. Sub-requests that fail with a
+    retryable error are sent again in later batches, with exponential backoff.
+    """
+    pending = indexes
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            logger.warning(f"Retrying {len(pending)} failed mutations")
+            time.sleep(get_backoff_delay(attempt))
+
+        retry = []
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start : start + batch_size]
+            retry.extend(_execute_batch(results, chunk, retried=attempt > 0))
+
+        pending = retry
+        if not pending:
+            return
+
+
+def _execute_batch(
+    results: List[MutationResult], indexes: List[int], retried: bool
+) -> List[int]:
+    """
+    Sends the mutations as one batch request.
+    Returns the indexes that should be retried.
+    """
+    retry = []
+
+    def callback(request_id, response, exception):
+        i = int(request_id)
+        mutation = results[i]["mutation"]
+        if retried and _is_duplicate_insert(mutation, exception):
+            # An earlier attempt created it, but its response was lost
+            exception = None
+            response = mutation["body"]
+
+        results[i]["error"] = exception
+        results[i]["response"] = response if exception is None else None
+        if exception is not None and is_retryable_error(exception):
+            retry.append(i)
+
+    email = results[indexes[0]]["mutation"]["email"]
+    service = get_calendar_service(email)
+    batch = service.new_batch_http_request(callback=callback)
+    for i in indexes:
+        batch.add(_build_request(service, results[i]["mutation"]), request_id=str(i))
+
+    try:
+        # Failed sub-requests are retried by the caller, only the quota & the
+        # concurrency limit of the scheduler apply here
+        execute_request(email, batch, cost=len(indexes), max_retries=0)
+    except Exception as e:
+        logger.warning(f"Batch of {len(indexes)} mutations failed: {e}")
+        for i in indexes:
+            results[i]["error"] = e
+        # Retry all of it after e.g. a network error, not after a permanent one
+        # such as a revoked token
+        return indexes if is_retryable_error(e) else []
+
+    return retry
+
+
+def _is_duplicate_insert(mutation: EventMutation, exception: Exception) -> bool:
+    return (
+        mutation["op"] == "insert"
+        and isinstance(exception, HttpError)
+        and exception.resp.status == 409
+    )
+
+
+def _build_request(service, mutation: EventMutation):
+    events = service.events()
+    if mutation["op"] == "insert":
+        return events.insert(calendarId=mutation["calendar_id"], body=mutation["body"])
+    elif mutation["op"] == "update":
+        return events.update(
+            calendarId=mutation["calendar_id"],
+            eventId=mutation["event_id"],
+            body=mutation["body"],
+        )
+    elif mutation["op"] == "patch":
+        return events.patch(
+            calendarId=mutation["calendar_id"],
+            eventId=mutation["event_id"],
+            body=mutation["body"],
+        )
+    elif mutation["op"] == "get":
+        return events.get(
+            calendarId=mutation["calendar_id"], eventId=mutation["event_id"]
+        )
+    elif mutation["op"] == "delete":
+        return events.delete(
+            calendarId=mutation["calendar_id"], eventId=mutation["event_id"]
+        )
+
+    raise ValueError(f"Unknown mutation op: {mutation['op']}")
@@ -0,0 +1,734 @@
+"""
+Storage backends for the incremental sync cache (see events_incremental.py).
+Every backend stores one CalendarDataCache per (email, calendarId) and exposes
+`CalendarDataCache.events` as an id-keyed mapping that sync_events merges into.
+Events read from a store are always fresh dicts, callers may mutate them.
+"""
+
+import os
+import json
+import sqlite3
+import logging
+import threading
+from collections.abc import MutableMapping
+from datetime import datetime, date, timedelta, timezone
+from typing import Dict, Iterable
+
+from .cache_codecs import (
+    CorruptCacheError,
+    cache_file_exists,
+    get_cache_file_path,
+    read_cache_file,
+    remove_cache_file,
+    write_cache_file,
+)
+from .slim_events import SlimEventIndex
+from .utils import get_temp_path
+
+logger = logging.getLogger(__name__)
+
+
+class CalendarDataCache:
+    calendarId: str
+    email: str
+    sync_token: str
+    # Where an interrupted full sync resumes from, empty once it completes
+    page_token: str
+    # Events starting before this ISO datetime may not be cached yet, see
+    # events_incremental.HISTORY_HORIZON. Empty when the whole history is cached.
+    history_start: str
+    # Keyed by event id, kept in insertion order
+    events: MutableMapping
+    last_sync: datetime
+    # Events changed by the last sync in this process, not persisted
+    last_change_count: int = 0
+
+
+def get_data_cache_path(email: str, calendarId: str, extension: str) -> str:
+    return f"{get_data_cache_stem(email, calendarId)}.{extension}"
+
+
+def get_data_cache_stem(email: str, calendarId: str) -> str:
+    """
+    Path of the calendar's cache without extension, see cache_codecs.py
+    """
+    os.makedirs(get_temp_path("all_events"), exist_ok=True)
+
+    return get_temp_path(f"all_events/{email}_{calendarId}")
+
+
+def empty_data_cache(email: str, calendarId: str) -> CalendarDataCache:
+    cache = CalendarDataCache()
+    cache.sync_token = ""
+    cache.page_token = ""
+    cache.history_start = ""
+    cache.events = SlimEventIndex()
+    cache.calendarId = calendarId
+    cache.email = email
+    cache.last_sync = datetime.now()
+    return cache
+
+
+def get_file_stamp(*paths: str) -> tuple:
+    """
+    (mtime, size) of every path, used to tell whether a cache changed on disk
+    """
+    stamp = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+            stamp.append((stat.st_mtime_ns, stat.st_size))
+        except FileNotFoundError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
+def _dump_json(path: str, data, **kwargs):
+    # Write to a temporary file first so a crash never leaves a torn cache
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(data, f, **kwargs)
+    os.replace(f"{path}.tmp", path)
+
+
+def is_event_in_range(event: dict, from_datetime: datetime, to_datetime: datetime):
+    if "start" in event and "dateTime" in event["start"]:
+        start_time = datetime.fromisoformat(event["start"]["dateTime"])
+        return from_datetime <= start_time <= to_datetime
+    elif "start" in event and "date" in event["start"]:
+        # Handle all-day events
+        start_date = date.fromisoformat(event["start"]["date"])
+        end_date = date.fromisoformat(event["end"]["date"])
+        return (from_datetime.date() <= start_date <= to_datetime.date()) or (
+            from_datetime.date() <= end_date <= to_datetime.date()
+        )
+
+    return False
+
+
+class JsonEventStore:
+    """
+    The whole calendar is kept in a single file, encoded with the codec set in
+    cache_codecs.CACHE_CODEC, which is read on load and rewritten on every save.
+    In memory, events are held as a SlimEventIndex.
+    """
+
+    index_class = SlimEventIndex
+
+    def load(self, email: str, calendarId: str) -> CalendarDataCache:
+        try:
+            data = read_cache_file(get_data_cache_stem(email, calendarId))
+        except (FileNotFoundError, CorruptCacheError):
+            # Return empty cache if file doesn't exist or is invalid
+            cache = empty_data_cache(email, calendarId)
+            cache.events = self.index_class()
+            return cache
+
+        cache = CalendarDataCache()
+        cache.sync_token = data.get("sync_token", "")
+        cache.page_token = data.get("page_token", "")
+        cache.history_start = data.get("history_start", "")
+        cache.events = self.index_class(data.get("events", []))
+        cache.calendarId = data.get("calendarId", calendarId)
+        cache.email = data.get("email", email)
+        cache.last_sync = datetime.fromisoformat(
+            data.get("last_sync", datetime.now().isoformat())
+        )
+        return cache
+
+    def save(self, data: CalendarDataCache):
+        cache_data = {
+            "sync_token": data.sync_token,
+            "page_token": data.page_token,
+            "history_start": data.history_start,
+            "events": list(data.events.values()),
+            "calendarId": data.calendarId,
+            "email": data.email,
+            "last_sync": data.last_sync.isoformat(),
+        }
+        write_cache_file(get_data_cache_stem(data.email, data.calendarId), cache_data)
+
+    def discard(self, data: CalendarDataCache):
+        # Nothing is written before save(), dropping the object is enough
+        pass
+
+    def get_stamp(self, email: str, calendarId: str) -> tuple:
+        return get_file_stamp(
+            get_cache_file_path(get_data_cache_stem(email, calendarId))
+        )
+
+    def delete(self, email: str, calendarId: str):
+        remove_cache_file(get_data_cache_stem(email, calendarId))
+
+    def query(
+        self, data: CalendarDataCache, from_datetime: datetime, to_datetime: datetime
+    ) -> Iterable[dict]:
+        return data.events.select(
+            lambda event: is_event_in_range(event, from_datetime, to_datetime)
+        )
+
+
+class JournalEventIndex(SlimEventIndex):
+    """
+    Id-keyed events that remember which ids were written or deleted since the
+    last save. Deleted ids are recorded as None.
+    """
+
+    def __init__(self, events: Iterable[dict] = ()):
+        self.changes = dict()
+        super().__init__(events)
+        # Events of the base snapshot are not changes
+        self.changes.clear()
+        self.journal_length = 0
+
+    def __setitem__(self, event_id: str, event: dict):
+        super().__setitem__(event_id, event)
+        self.changes[event_id] = event
+
+    def __delitem__(self, event_id: str):
+        super().__delitem__(event_id)
+        self.changes[event_id] = None
+
+
+class JournalEventStore(JsonEventStore):
+    """
+    The single file cache is used as a base snapshot and every save appends only the
+    delta of that sync to `{email}_{calendarId}.journal`, one JSON line per sync.
+    Loading replays the journal on top of the base. The journal is folded back
+    into the base every `checkpoint_every` syncs, or when a delta touches more
+    than half of the calendar (e.g. an initial full sync).
+    """
+
+    index_class = JournalEventIndex
+
+    def __init__(self, checkpoint_every: int = 50):
+        self.checkpoint_every = checkpoint_every
+
+    def load(self, email: str, calendarId: str) -> CalendarDataCache:
+        cache = super().load(email, calendarId)
+        events = cache.events
+
+        try:
+            with open(get_data_cache_path(email, calendarId, "journal"), "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn write from an interrupted sync. Entries are only
+                        # ever appended, so nothing valid can follow it. Force a
+                        # checkpoint so the torn line is dropped on the next save.
+                        logger.warning(f"Ignoring torn journal entry for {email}")
+                        events.journal_length = self.checkpoint_every
+                        break
+
+                    for event in entry["upserts"]:
+                        SlimEventIndex.__setitem__(events, event["id"], event)
+                    for event_id in entry["deletes"]:
+                        if event_id in events:
+                            SlimEventIndex.__delitem__(events, event_id)
+                    cache.sync_token = entry["sync_token"]
+                    cache.page_token = entry.get("page_token", "")
+                    cache.history_start = entry.get("history_start", "")
+                    cache.last_sync = datetime.fromisoformat(entry["last_sync"])
+                    events.journal_length += 1
+        except FileNotFoundError:
+            pass
+
+        return cache
+
+    def save(self, data: CalendarDataCache):
+        events = data.events
+        changes = events.changes
+
+        if (
+            not cache_file_exists(get_data_cache_stem(data.email, data.calendarId))
+            or events.journal_length >= self.checkpoint_every
+            or len(changes) > len(events) // 2
+        ):
+            self.checkpoint(data)
+            return
+
+        entry = {
+            "sync_token": data.sync_token,
+            "page_token": data.page_token,
+            "history_start": data.history_start,
+            "last_sync": data.last_sync.isoformat(),
+            "upserts": [event for event in changes.values() if event is not None],
+            "deletes": [
+                event_id for event_id, event in changes.items() if event is None
+            ],
+        }
+        journal_path = get_data_cache_path(data.email, data.calendarId, "journal")
+        with open(journal_path, "a") as f:
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+        changes.clear()
+        events.journal_length += 1
+
+    def checkpoint(self, data: CalendarDataCache):
+        """
+        Folds the journal into the base snapshot. If we crash before the journal
+        is removed, replaying it over the new base only rolls the sync token back
+        to an older one, which the next sync catches up from.
+        """
+        super().save(data)
+        try:
+            os.remove(get_data_cache_path(data.email, data.calendarId, "journal"))
+        except FileNotFoundError:
+            pass
+
+        data.events.changes.clear()
+        data.events.journal_length = 0
+
+    def discard(self, data: CalendarDataCache):
+        data.events.changes.clear()
+
+    def get_stamp(self, email: str, calendarId: str) -> tuple:
+        return get_file_stamp(
+            get_cache_file_path(get_data_cache_stem(email, calendarId)),
+            get_data_cache_path(email, calendarId, "journal"),
+        )
+
+    def delete(self, email: str, calendarId: str):
+        super().delete(email, calendarId)
+        try:
+            os.remove(get_data_cache_path(email, calendarId, "journal"))
+        except FileNotFoundError:
+            pass
+
+
+def _get_event_month(event: dict) -> str:
+    start = event.get("start", {})
+    return (start.get("dateTime") or start.get("date") or "undated")[:7]
+
+
+def _get_event_end_date(event: dict) -> str:
+    end = event.get("end", {})
+    return (end.get("dateTime") or end.get("date") or "")[:10]
+
+
+class SegmentedEventIndex(MutableMapping):
+    """
+    Id-keyed view over per-month segments. The id -> month index and the
+    segments themselves are only read when first needed, and writes mark the
+    touched months as dirty for SegmentedEventStore.save(). A corrupt index or
+    segment raises CorruptCacheError then, events_incremental resyncs the
+    calendar.
+    """
+
+    def __init__(self, segments_dir: str, segment_ends: Dict[str, str]):
+        self.segments_dir = segments_dir
+        # month -> latest end date of the events in that segment
+        self.segment_ends = segment_ends
+        self.segments = dict()
+        self.dirty = set()
+        self.index_changed = False
+        self._index = None
+
+    @property
+    def index(self) -> Dict[str, str]:
+        if self._index is None:
+            try:
+                self._index = read_cache_file(os.path.join(self.segments_dir, "index"))
+            except FileNotFoundError:
+                self._index = dict()
+        return self._index
+
+    def get_segment(self, month: str) -> SlimEventIndex:
+        if month not in self.segments:
+            try:
+                self.segments[month] = SlimEventIndex(
+                    read_cache_file(os.path.join(self.segments_dir, month))
+                )
+            except FileNotFoundError:
+                self.segments[month] = SlimEventIndex()
+        return self.segments[month]
+
+    def __getitem__(self, event_id: str) -> dict:
+        return self.get_segment(self.index[event_id])[event_id]
+
+    def __setitem__(self, event_id: str, event: dict):
+        month = _get_event_month(event)
+        previous_month = self.index.get(event_id)
+        if previous_month != month:
+            if previous_month is not None:
+                # The event was moved to another month
+                del self.get_segment(previous_month)[event_id]
+                self.dirty.add(previous_month)
+            self.index[event_id] = month
+            self.index_changed = True
+
+        self.get_segment(month)[event_id] = event
+        self.dirty.add(month)
+
+    def __delitem__(self, event_id: str):
+        month = self.index.pop(event_id)
+        del self.get_segment(month)[event_id]
+        self.dirty.add(month)
+        self.index_changed = True
+
+    def __contains__(self, event_id) -> bool:
+        return event_id in self.index
+
+    def __iter__(self):
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+class SegmentedEventStore:
+    """
+    Events are split into one segment file per month of their start, under
+    `{email}_{calendarId}.segments/`, next to a small manifest holding the sync
+    state and the latest end date of every segment. Range queries only open
+    the segments that can overlap the range, and a save only rewrites the
+    segments touched by that sync. Existing single file caches are imported
+    the first time a calendar is opened.
+    """
+
+    def load(self, email: str, calendarId: str) -> CalendarDataCache:
+        segments_dir = get_data_cache_path(email, calendarId, "segments")
+        manifest_path = os.path.join(segments_dir, "manifest.json")
+
+        cache = CalendarDataCache()
+        cache.calendarId = calendarId
+        cache.email = email
+
+        if not os.path.exists(manifest_path):
+            os.makedirs(segments_dir, exist_ok=True)
+            legacy = JsonEventStore().load(email, calendarId)
+            cache.events = SegmentedEventIndex(segments_dir, dict())
+            if legacy.events:
+                logger.info(f"Splitting cache of {email}/{calendarId} by month")
+            for event_id, event in legacy.events.items():
+                cache.events[event_id] = event
+            cache.sync_token = legacy.sync_token
+            cache.page_token = legacy.page_token
+            cache.history_start = legacy.history_start
+            cache.last_sync = legacy.last_sync
+            self.save(cache)
+            return cache
+
+        try:
+            with open(manifest_path, "r") as f:
+                manifest = json.load(f)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Corrupt manifest of {email}/{calendarId}: {e}")
+            # Start over from an empty manifest, like the single file stores
+            self.delete(email, calendarId)
+            return self.load(email, calendarId)
+        cache.sync_token = manifest.get("sync_token", "")
+        cache.page_token = manifest.get("page_token", "")
+        cache.history_start = manifest.get("history_start", "")
+        cache.last_sync = datetime.fromisoformat(
+            manifest.get("last_sync", datetime.now().isoformat())
+        )
+        cache.events = SegmentedEventIndex(segments_dir, manifest.get("segments", {}))
+        return cache
+
+    def save(self, data: CalendarDataCache):
+        events = data.events
+        for month in events.dirty:
+            segment = events.get_segment(month)
+            segment_stem = os.path.join(events.segments_dir, month)
+            if segment:
+                segment_events = segment.values()
+                write_cache_file(segment_stem, segment_events)
+                events.segment_ends[month] = max(
+                    _get_event_end_date(e) for e in segment_events
+                )
+            else:
+                events.segment_ends.pop(month, None)
+                remove_cache_file(segment_stem)
+
+        if events.index_changed:
+            write_cache_file(os.path.join(events.segments_dir, "index"), events.index)
+
+        manifest = {
+            "sync_token": data.sync_token,
+            "page_token": data.page_token,
+            "history_start": data.history_start,
+            "calendarId": data.calendarId,
+            "email": data.email,
+            "last_sync": data.last_sync.isoformat(),
+            "segments": events.segment_ends,
+        }
+        _dump_json(os.path.join(events.segments_dir, "manifest.json"), manifest)
+
+        events.dirty.clear()
+        events.index_changed = False
+
+    def discard(self, data: CalendarDataCache):
+        # Drop the in-memory edits, the files on disk are still intact
+        data.events = SegmentedEventIndex(
+            data.events.segments_dir, data.events.segment_ends
+        )
+
+    def get_stamp(self, email: str, calendarId: str) -> tuple:
+        # Every save rewrites the manifest, it is enough to watch that
+        segments_dir = get_data_cache_path(email, calendarId, "segments")
+        return get_file_stamp(os.path.join(segments_dir, "manifest.json"))
+
+    def delete(self, email: str, calendarId: str):
+        segments_dir = get_data_cache_path(email, calendarId, "segments")
+        if not os.path.exists(segments_dir):
+            return
+
+        # Keep an empty manifest around, so the legacy JSON cache is not
+        # imported again
+        for filename in os.listdir(segments_dir):
+            os.remove(os.path.join(segments_dir, filename))
+
+        cache = empty_data_cache(email, calendarId)
+        cache.events = SegmentedEventIndex(segments_dir, dict())
+        self.save(cache)
+
+    def query(
+        self, data: CalendarDataCache, from_datetime: datetime, to_datetime: datetime
+    ) -> Iterable[dict]:
+        # Events are bucketed by the local date in their own timezone, so pad
+        # the range by a day on both sides
+        from_date = (from_datetime - timedelta(days=1)).date().isoformat()
+        to_month = (to_datetime + timedelta(days=1)).date().isoformat()[:7]
+
+        events = []
+        for month, max_end_date in sorted(data.events.segment_ends.items()):
+            if month > to_month or max_end_date < from_date:
+                continue
+
+            events.extend(
+                data.events.get_segment(month).select(
+                    lambda event: is_event_in_range(event, from_datetime, to_datetime)
+                )
+            )
+
+        return events
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id TEXT PRIMARY KEY,
+    all_day INTEGER NOT NULL DEFAULT 0,
+    start_ts REAL,
+    end_ts REAL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_start ON events (all_day, start_ts);
+CREATE INDEX IF NOT EXISTS events_end ON events (all_day, end_ts);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _get_event_epochs(event: dict):
+    """
+    Returns (all_day, start_ts, end_ts) for the indexed columns.
+    All-day events are stored at midnight UTC of their dates.
+    """
+    start = event.get("start", {})
+    end = event.get("end", {})
+    if "dateTime" in start:
+        return (
+            0,
+            datetime.fromisoformat(start["dateTime"]).timestamp(),
+            datetime.fromisoformat(end["dateTime"]).timestamp(),
+        )
+    elif "date" in start:
+        return (
+            1,
+            _get_date_epoch(date.fromisoformat(start["date"])),
+            _get_date_epoch(date.fromisoformat(end["date"])),
+        )
+
+    return 0, None, None
+
+
+def _get_date_epoch(value: date) -> float:
+    return datetime(value.year, value.month, value.day, tzinfo=timezone.utc).timestamp()
+
+
+class SqliteEventIndex(MutableMapping):
+    """
+    Id-keyed view over the `events` table. Writes happen inside the connection's
+    open transaction and are committed by SqliteEventStore.save().
+    """
+
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __getitem__(self, event_id: str) -> dict:
+        row = self.connection.execute(
+            "SELECT payload FROM events WHERE id = ?", (event_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(event_id)
+        return json.loads(row[0])
+
+    def __setitem__(self, event_id: str, event: dict):
+        self.connection.execute(
+            """
+            INSERT INTO events (id, all_day, start_ts, end_ts, payload)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (id) DO UPDATE SET
+                all_day = excluded.all_day,
+                start_ts = excluded.start_ts,
+                end_ts = excluded.end_ts,
+                payload = excluded.payload
+            """,
+            (event_id, *_get_event_epochs(event), json.dumps(event)),
+        )
+
+    def __delitem__(self, event_id: str):
+        cursor = self.connection.execute("DELETE FROM events WHERE id = ?", (event_id,))
+        if cursor.rowcount == 0:
+            raise KeyError(event_id)
+
+    def __contains__(self, event_id) -> bool:
+        row = self.connection.execute(
+            "SELECT 1 FROM events WHERE id = ?", (event_id,)
+        ).fetchone()
+        return row is not None
+
+    def __iter__(self):
+        for (event_id,) in self.connection.execute(
+            "SELECT id FROM events ORDER BY rowid"
+        ):
+            yield event_id
+
+    def __len__(self) -> int:
+        return self.connection.execute("SELECT COUNT(*) FROM events").fetchone()[0]
+
+    def values(self):
+        # Decode rows in a single scan instead of one lookup per id
+        return [
+            json.loads(payload)
+            for (payload,) in self.connection.execute(
+                "SELECT payload FROM events ORDER BY rowid"
+            )
+        ]
+
+
+class SqliteEventStore:
+    """
+    One SQLite database per calendar. Events are upserted row by row and range
+    queries are answered from the (all_day, start_ts) / (all_day, end_ts) indexes.
+    Existing single file caches are imported the first time a calendar is
+    opened.
+    """
+
+    def __init__(self):
+        # One connection per database, reused by every load of the calendar
+        self.connections: Dict[str, sqlite3.Connection] = dict()
+        self.connections_lock = threading.Lock()
+
+    def get_connection(self, db_path: str) -> sqlite3.Connection:
+        with self.connections_lock:
+            connection = self.connections.get(db_path)
+            if connection is None:
+                # Loaded caches are shared between the fetch_events_parallel
+                # workers, events_incremental serialises access per calendar
+                connection = sqlite3.connect(db_path, check_same_thread=False)
+                connection.executescript(SQLITE_SCHEMA)
+                self.connections[db_path] = connection
+            return connection
+
+    def load(self, email: str, calendarId: str) -> CalendarDataCache:
+        db_path = get_data_cache_path(email, calendarId, "sqlite3")
+        is_new = not os.path.exists(db_path)
+        connection = self.get_connection(db_path)
+
+        cache = CalendarDataCache()
+        cache.calendarId = calendarId
+        cache.email = email
+        cache.events = SqliteEventIndex(connection)
+
+        if is_new and cache_file_exists(get_data_cache_stem(email, calendarId)):
+            logger.info(f"Importing cache of {email}/{calendarId} into SQLite")
+            legacy = JsonEventStore().load(email, calendarId)
+            cache.sync_token = legacy.sync_token
+            cache.page_token = legacy.page_token
+            cache.history_start = legacy.history_start
+            cache.last_sync = legacy.last_sync
+            for event_id, event in legacy.events.items():
+                cache.events[event_id] = event
+            self.save(cache)
+            return cache
+
+        meta = dict(connection.execute("SELECT key, value FROM meta"))
+        cache.sync_token = meta.get("sync_token", "")
+        cache.page_token = meta.get("page_token", "")
+        cache.history_start = meta.get("history_start", "")
+        cache.last_sync = datetime.fromisoformat(
+            meta.get("last_sync", datetime.now().isoformat())
+        )
+        return cache
+
+    def save(self, data: CalendarDataCache):
+        connection = data.events.connection
+        connection.executemany(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            [
+                ("sync_token", data.sync_token),
+                ("page_token", data.page_token),
+                ("history_start", data.history_start),
+                ("last_sync", data.last_sync.isoformat()),
+            ],
+        )
+        connection.commit()
+
+    def discard(self, data: CalendarDataCache):
+        data.events.connection.rollback()
+
+    def get_stamp(self, email: str, calendarId: str) -> tuple:
+        return get_file_stamp(get_data_cache_path(email, calendarId, "sqlite3"))
+
+    def delete(self, email: str, calendarId: str):
+        db_path = get_data_cache_path(email, calendarId, "sqlite3")
+        if not os.path.exists(db_path):
+            return
+
+        # Clear the tables instead of removing the file, so the legacy JSON
+        # cache is not imported again
+        with self.get_connection(db_path) as connection:
+            connection.execute("DELETE FROM events")
+            connection.execute("DELETE FROM meta")
+
+    def query(
+        self, data: CalendarDataCache, from_datetime: datetime, to_datetime: datetime
+    ) -> Iterable[dict]:
+        from_day = _get_date_epoch(from_datetime.date())
+        to_day = _get_date_epoch(to_datetime.date())
+        rows = data.events.connection.execute(
+            """
+            SELECT payload FROM events
+            WHERE (all_day = 0 AND start_ts BETWEEN :from_ts AND :to_ts)
+                OR (all_day = 1 AND start_ts BETWEEN :from_day AND :to_day)
+                OR (all_day = 1 AND end_ts BETWEEN :from_day AND :to_day)
+            ORDER BY rowid
+            """,
+            dict(
+                from_ts=from_datetime.timestamp(),
+                to_ts=to_datetime.timestamp(),
+                from_day=from_day,
+                to_day=to_day,
+            ),
+        )
+        return [json.loads(payload) for (payload,) in rows]
+
+
+EVENT_STORES = {
+    "json": JsonEventStore(),
+    "journal": JournalEventStore(),
+    "segments": SegmentedEventStore(),
+    "sqlite": SqliteEventStore(),
+}
+
+
+def get_event_store(backend: str):
+    if backend not in EVENT_STORES:
+        raise ValueError(
+            f"Unknown cache backend {backend}. Available: {list(EVENT_STORES)}"
+        )
+    return EVENT_STORES[backend]
@@ -0,0 +1,137 @@
+"""
+Events as seen by the processing pipeline (see events.ingest_events).
+An Event reads through to the fetched event and keeps whatever the pipeline
+writes, e.g. duration_min, categories or a clipped start, in an overlay of its
+own, so the fetched events are never modified and can be reused, e.g. by
+another notebook cell.
+
+Start & end are parsed once, into epoch seconds and the UTC offset they were
+written with, and the event's timeZone is resolved once per zone (or is the
+start's UTC offset, for events without one). Stages compare
+`event.start_ts` / `event.end_ts` instead of parsing the ISO strings again.
+process_event_stream hands plain dicts to the widgets. The stages of events.py
+also take plain event dicts, see as_events.
+
+Nested values such as event["start"] are shared with the fetched event. Stages
+replace them instead of mutating them:
+    event["start"] = {**event["start"], "dateTime": ...}
+"""
+
+from collections.abc import MutableMapping
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+# Marks keys deleted from an event
+_DELETED = object()
+
+
+@lru_cache(maxsize=None)
+def get_zoneinfo(key: str) -> ZoneInfo:
+    return ZoneInfo(key)
+
+
+class Event(MutableMapping):
+    __slots__ = (
+        "event",
+        "overlay",
+        "start_ts",
+        "end_ts",
+        "start_offset",
+        "end_offset",
+        "tz",
+    )
+
+    def __init__(self, event: dict, overlay: dict = None):
+        self.event = event
+        self.overlay = overlay if overlay is not None else dict()
+        self.start_ts, self.start_offset = _parse_time(self.get("start"))
+        self.end_ts, self.end_offset = _parse_time(self.get("end"))
+        self.tz = get_event_tz(self.get("start"), self.start_offset)
+
+    @property
+    def start(self) -> datetime:
+        """
+        The start as written in the event, i.e. in its original UTC offset
+        """
+        return datetime.fromtimestamp(self.start_ts, self.start_offset)
+
+    @property
+    def end(self) -> datetime:
+        return datetime.fromtimestamp(self.end_ts, self.end_offset)
+
+    def replace(self, **changes) -> "Event":
+        """
+        A new event over the same fetched event, with `changes` on top of this
+        one's overlay
+        """
+        return Event(self.event, {**self.overlay, **changes})
+
+    def __getitem__(self, key: str):
+        value = self.overlay.get(key, self.event.get(key, _DELETED))
+        if value is _DELETED:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key: str, value):
+        self.overlay[key] = value
+        if key == "start":
+            self.start_ts, self.start_offset = _parse_time(value)
+            self.tz = get_event_tz(value, self.start_offset)
+        elif key == "end":
+            self.end_ts, self.end_offset = _parse_time(value)
+
+    def __delitem__(self, key: str):
+        if key not in self:
+            raise KeyError(key)
+        self.overlay[key] = _DELETED
+
+    def __contains__(self, key) -> bool:
+        return self.overlay.get(key, self.event.get(key, _DELETED)) is not _DELETED
+
+    def __iter__(self):
+        for key in self.event:
+            if self.overlay.get(key) is not _DELETED:
+                yield key
+        for key, value in self.overlay.items():
+            if key not in self.event and value is not _DELETED:
+                yield key
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __repr__(self) -> str:
+        return f"Event({dict(self)!r})"
+
+    def to_dict(self) -> dict:
+        """
+        A plain dict of the event as seen through the overlay
+        """
+        return dict(self)
+
+
+def _parse_time(value: dict) -> tuple:
+    """
+    (epoch seconds, UTC offset) of a start / end, (None, None) for all-day events
+    """
+    if not value or "dateTime" not in value:
+        return None, None
+
+    parsed = datetime.fromisoformat(value["dateTime"])
+    return parsed.timestamp(), parsed.tzinfo
+
+
+def get_event_tz(value: dict, offset: tzinfo) -> tzinfo:
+    """
+    Zone of a start, its timeZone or else the fixed UTC offset it was written with
+    """
+    if value and value.get("timeZone"):
+        return get_zoneinfo(value["timeZone"])
+    return offset
+
+
+def as_events(events: list) -> list:
+    """
+    `events` as Events, plain event dicts are wrapped and left unmodified
+    """
+    return [event if isinstance(event, Event) else Event(event) for event in events]
@@ -1,30 +1,93 @@
+import json
 import logging
-from typing import Dict, List
+import threading
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List
 from datetime import datetime, date, timedelta
 import pytz
 from zoneinfo import ZoneInfo
 
-from googleapiclient.discovery import build
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build_from_document
+from googleapiclient.discovery_cache import get_static_doc
+from googleapiclient.http import HttpRequest, build_http
 
+from .api_scheduler import MAX_CONCURRENT_REQUESTS, execute_request
+from .event_views import Event, as_events
 from .google_oauth import get_account_credentials
 
 logger = logging.getLogger(__name__)
 
 SCOPES = ["https://www.googleapis.com/auth/calendar.readonly"]
 
+_calendar_services = dict()
+_calendar_services_lock = threading.Lock()
+_thread_local = threading.local()
+
+
+@lru_cache(maxsize=None)
+def get_discovery_document(service_name: str, version: str) -> dict:
+    """
+    Parsed discovery document, loaded from the copy bundled with
+    google-api-python-client instead of the network
+    """
+    return json.loads(get_static_doc(service_name, version))
+
 
 def get_calendar_service(email: str):
+    """
+    Calendar service of the account, built once per process and shared across
+    threads. Each thread sends its requests through its own connection.
+    """
+    with _calendar_services_lock:
+        service = _calendar_services.get(email)
+    if service is not None:
+        return service
+
+    service = _build_calendar_service(email)
+    with _calendar_services_lock:
+        return _calendar_services.setdefault(email, service)
+
+
+def _build_calendar_service(email: str):
     creds = get_account_credentials(email)
-    return build("calendar", "v3", credentials=creds)
+
+    def build_request(_http, *args, **kwargs):
+        # httplib2.Http is not thread-safe, so it can't be shared by the service
+        return HttpRequest(_get_thread_http(email, creds), *args, **kwargs)
+
+    return build_from_document(
+        get_discovery_document("calendar", "v3"),
+        credentials=creds,
+        requestBuilder=build_request,
+    )
+
+
+def _get_thread_http(email: str, creds) -> AuthorizedHttp:
+    https = _thread_local.__dict__.setdefault("https", dict())
+    if email not in https:
+        https[email] = AuthorizedHttp(creds, http=build_http())
+    return https[email]
 
 
 def get_primary_timezone(selected_calendars: Dict[str, List[str]]):
+    from .calendar_list import get_calendar_lists
+
+    calendar_lists = get_calendar_lists(list(selected_calendars.keys()))
 
     time_zone_map = dict()
     for email, calendars in selected_calendars.items():
-        service = get_calendar_service(email)
+        time_zones = {x["id"]: x.get("timeZone") for x in calendar_lists[email]}
         for calendar in calendars:
-            cal_result = service.calendars().get(calendarId=calendar).execute()
+            if calendar in time_zones:
+                time_zone_map[calendar] = time_zones[calendar]
+                continue
+
+            # Not in the account's calendar list, ask for it directly
+            service = get_calendar_service(email)
+            cal_result = execute_request(
+                email, service.calendars().get(calendarId=calendar)
+            )
             time_zone_map[calendar] = cal_result.get("timeZone")
 
     timezones = list(time_zone_map.values())
@@ -59,17 +122,16 @@ def fetch_events(
     page_token = None
 
     while True:
-        events_result = (
-            service.events()
-            .list(
+        events_result = execute_request(
+            email,
+            service.events().list(
                 calendarId=calendar_id,
                 timeMin=from_datetime.isoformat(),
                 timeMax=to_datetime.isoformat(),
                 singleEvents=True,
                 orderBy="startTime",
                 pageToken=page_token,
-            )
-            .execute()
+            ),
         )
 
         events.extend(events_result.get("items", []))
@@ -91,41 +153,120 @@ def fetch_events(
 
 
 def fetch_events_parallel(
-    email_map: Dict[str, List[str]], from_datetime: datetime, to_datetime: datetime
+    email_map: Dict[str, List[str]],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
 ):
+    """
+    Syncs & fetches events of all the calendars in parallel.
+    See events_incremental.sync_events for `max_staleness` and `offline`.
+    """
     from concurrent.futures import ThreadPoolExecutor
-    from functools import partial
-    from .events_incremental import fetch_events as fetch_events_incremental
 
-    def fetch_calendar_events(email, calendar, from_datetime, to_datetime):
-        """Helper function to fetch events for a single calendar"""
-        return fetch_events_incremental(
+    fetched_events = []
+    # Requests are throttled by api_scheduler, this only bounds the threads
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = _submit_calendar_fetches(
+            executor, email_map, from_datetime, to_datetime, max_staleness, offline
+        )
+
+        # Flatten the results, in calendar order
+        for future in futures:
+            fetched_events.extend(future.result())
+    return fetched_events
+
+
+class EventChunk(list):
+    """
+    Events of one calendar, yielded by iter_events_parallel. `index` is the
+    position of the calendar in the email_map.
+    """
+
+    def __init__(self, events: List[dict], index: int):
+        super().__init__(events)
+        self.index = index
+
+
+def iter_events_parallel(
+    email_map: Dict[str, List[str]],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+) -> Iterator[EventChunk]:
+    """
+    Streaming version of fetch_events_parallel. Yields the events of each calendar
+    as soon as it is synced, in completion order, so they can be processed while
+    slower calendars are still syncing. See process_event_stream.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_REQUESTS) as executor:
+        futures = _submit_calendar_fetches(
+            executor, email_map, from_datetime, to_datetime, max_staleness, offline
+        )
+        indexes = {future: i for i, future in enumerate(futures)}
+        for future in as_completed(futures):
+            yield EventChunk(future.result(), indexes[future])
+
+
+def _submit_calendar_fetches(
+    executor,
+    email_map: Dict[str, List[str]],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta,
+    offline: bool,
+) -> list:
+    return [
+        executor.submit(
+            _fetch_calendar_events,
             email=email,
             calendar_id=calendar,
             from_datetime=from_datetime,
             to_datetime=to_datetime,
+            max_staleness=max_staleness,
+            offline=offline,
         )
+        for email, calendars in email_map.items()
+        for calendar in calendars
+    ]
 
-    # Replace the sequential fetching with parallel fetching
-    fetched_events = []
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        # Create a list of tasks to execute
-        tasks = []
-        for email, calendars in email_map.items():
-            for calendar in calendars:
-                # Create a partial function with the fixed arguments
-                task = partial(
-                    fetch_calendar_events, email, calendar, from_datetime, to_datetime
-                )
-                tasks.append(task)
-
-        # Execute all tasks in parallel and gather results
-        results = list(executor.map(lambda x: x(), tasks))
-
-        # Flatten the results
-        for result in results:
-            fetched_events.extend(result)
-    return fetched_events
+
+def _fetch_calendar_events(
+    email: str,
+    calendar_id: str,
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta,
+    offline: bool,
+) -> List[dict]:
+    from .api_scheduler import is_retryable_error
+    from .events_incremental import fetch_events as fetch_events_incremental
+
+    try:
+        return fetch_events_incremental(
+            email=email,
+            calendar_id=calendar_id,
+            from_datetime=from_datetime,
+            to_datetime=to_datetime,
+            max_staleness=max_staleness,
+            offline=offline,
+        )
+    except Exception as e:
+        # Still throttled after every retry, don't fail the other calendars
+        if not is_retryable_error(e):
+            raise e
+        logger.error(f"Serving cached events of {email}/{calendar_id}: {e}")
+        return fetch_events_incremental(
+            email=email,
+            calendar_id=calendar_id,
+            from_datetime=from_datetime,
+            to_datetime=to_datetime,
+            offline=True,
+        )
 
 
 def filter_out_all_day_events(events: List[dict]):
@@ -133,13 +274,15 @@ def filter_out_all_day_events(events: List[dict]):
     Filters out all-day events from the list of events.
     All-day events are identified by the presence of "date" in the start dictionary.
     """
-    filtered_events = [
-        event for event in events if "date" not in event.get("start", {})
-    ]
+    filtered_events = [event for event in events if not is_all_day_event(event)]
     logger.debug(f"Filtered out {len(events) - len(filtered_events)} all-day events")
     return filtered_events
 
 
+def is_all_day_event(event: dict) -> bool:
+    return "date" in event.get("start", {})
+
+
 def filter_out_event_types(events: List[dict], event_types: List[str]):
     """
     Filters out events based on their event types.
@@ -165,49 +308,50 @@ def filter_out_event_types(events: List[dict], event_types: List[str]):
     return filtered_events
 
 
-def add_duration_minutes(events: List[dict]):
+def add_duration_minutes(events: List[Event]):
     """
     Adds duration in minutes to each event in the list.
     The duration is calculated as the difference between the end and start times.
     """
+    events = as_events(events)
     for event in events:
         event["duration_min"] = get_event_duration(event)
 
     return events
 
 
-def filter_out_future_events(events: List[dict], to_datetime: datetime):
+def filter_out_future_events(events: List[Event], to_datetime: datetime):
     """
     - Filters out events which has start date in the FUTURE
     - For events that has started and is still running, we will update it's duration to
       the current time
     """
 
-    # Outright remove events that have started in the future
-    now_datetime = datetime.now(pytz.UTC)
-    boundary_datetime = min(to_datetime, now_datetime)
+    boundary = get_future_boundary(to_datetime)
+    return [event for event in as_events(events) if clip_future_event(event, boundary)]
 
-    events = [
-        x
-        for x in events
-        if datetime.fromisoformat(x["start"]["dateTime"]) < boundary_datetime
-    ]
 
-    # Update events that have started and are still running
-    for event in events:
-        end_datetime = datetime.fromisoformat(event["end"]["dateTime"])
-        if end_datetime <= boundary_datetime:
-            continue
+def get_future_boundary(to_datetime: datetime) -> float:
+    now_datetime = datetime.now(pytz.UTC)
+    return min(to_datetime, now_datetime).timestamp()
 
-        start_datetime = datetime.fromisoformat(event["start"]["dateTime"])
-        event["duration_min"] = (
-            boundary_datetime - start_datetime
-        ).total_seconds() // 60
 
-    return events
+def clip_future_event(event: Event, boundary: float) -> bool:
+    """
+    Whether the event is kept by filter_out_future_events, clipping its
+    duration to `boundary` if it is still running
+    """
+    # Outright remove events that have started in the future
+    if event.start_ts >= boundary:
+        return False
+
+    # Update events that have started and are still running
+    if event.end_ts > boundary:
+        event["duration_min"] = (boundary - event.start_ts) // 60
+    return True
 
 
-def filter_out_past_events(from_datetime: datetime, events: List[dict]):
+def filter_out_past_events(from_datetime: datetime, events: List[Event]):
     """
     Filters out past events and updates ongoing events:
     - Removes events that have ended before `from_datetime`.
@@ -215,133 +359,142 @@ def filter_out_past_events(from_datetime: datetime, events: List[dict]):
 
     Args:
         from_datetime (datetime): The reference datetime.
-        events (List[dict]): List of event dictionaries.
+        events (List[Event]): List of events.
 
     Returns:
-        List[dict]: Filtered and updated list of events.
+        List[Event]: Filtered and updated list of events.
     """
-    filtered_events = []
+    return [
+        event for event in as_events(events) if clip_past_event(event, from_datetime)
+    ]
 
-    for event in events:
-        try:
-            start_datetime = datetime.fromisoformat(event["start"]["dateTime"])
-            end_datetime = datetime.fromisoformat(event["end"]["dateTime"])
-        except (KeyError, ValueError) as e:
-            filtered_events.append(event)
-            logger.debug(f"Skipping non dateTime event: {event}. Error: {e}")
-            continue
 
-        # Remove events that have ended in the past
-        if end_datetime < from_datetime:
-            logger.debug(f"Removing past event: {event}")
-            continue
+def clip_past_event(event: Event, from_datetime: datetime) -> bool:
+    """
+    Whether the event is kept by filter_out_past_events, clipping its start to
+    `from_datetime` if it started before
+    """
+    if event.start_ts is None or event.end_ts is None:
+        logger.debug(f"Skipping non dateTime event: {event}")
+        return True
 
-        # Update start time of events that have started in the past
-        if start_datetime < from_datetime:
-            logger.debug(f"Updating ongoing event: {event}")
-            event["start"]["dateTime"] = from_datetime.isoformat()
-            event["duration_min"] = (end_datetime - from_datetime).total_seconds() // 60
+    from_ts = from_datetime.timestamp()
 
-        filtered_events.append(event)
+    # Remove events that have ended in the past
+    if event.end_ts < from_ts:
+        logger.debug(f"Removing past event: {event}")
+        return False
 
-    return filtered_events
+    # Update start time of events that have started in the past
+    if event.start_ts < from_ts:
+        logger.debug(f"Updating ongoing event: {event}")
+        event["start"] = {**event["start"], "dateTime": from_datetime.isoformat()}
+        event["duration_min"] = (event.end_ts - from_ts) // 60
 
+    return True
 
-def breakdown_overnight_events(events: List[dict]):
+
+def breakdown_overnight_events(events: List[Event]):
     """
     Breaks down overnight events into two separate events:
     - One for the part before midnight
     - One for the part after midnight
     """
-    if not events:
-        return events
+    return [
+        part for event in as_events(events) for part in split_overnight_event(event)
+    ]
 
-    new_events = []
-    for event in events:
-        start_datetime = datetime.fromisoformat(event["start"]["dateTime"])
-        midnight = (start_datetime + timedelta(days=1)).replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
-        end_datetime = datetime.fromisoformat(event["end"]["dateTime"])
 
-        # We check if the event spans overnight also we check if the end time is after midnight  # noqa: E501
-        # to avoid splitting events that end at midnight
-        if start_datetime.date() != end_datetime.date() and end_datetime > midnight:
-            # Split the event into two parts
-            new_events.append(
-                {
-                    **event,
-                    "end": {"dateTime": midnight.isoformat(), "timeZone": "UTC"},
-                    "duration_min": (midnight - start_datetime).total_seconds() // 60,
-                }
-            )
-            new_events.append(
-                {
-                    **event,
-                    "start": {"dateTime": midnight.isoformat(), "timeZone": "UTC"},
-                    "duration_min": (end_datetime - midnight).total_seconds() // 60,
-                }
-            )
-        else:
-            new_events.append(event)
-
-    return new_events
+def split_overnight_event(event: Event) -> List[Event]:
+    """
+    The parts of the event before & after midnight, or just the event if it
+    does not span midnight
+    """
+    start_datetime = event.start
+    midnight = (start_datetime + timedelta(days=1)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    end_datetime = event.end
+
+    # We check if the event spans overnight also we check if the end time is after midnight  # noqa: E501
+    # to avoid splitting events that end at midnight
+    if start_datetime.date() == end_datetime.date() or end_datetime <= midnight:
+        return [event]
+
+    # Split the event into two parts
+    return [
+        event.replace(
+            end={"dateTime": midnight.isoformat(), "timeZone": "UTC"},
+            duration_min=(midnight - start_datetime).total_seconds() // 60,
+        ),
+        event.replace(
+            start={"dateTime": midnight.isoformat(), "timeZone": "UTC"},
+            duration_min=(end_datetime - midnight).total_seconds() // 60,
+        ),
+    ]
 
 
-def handle_overlapping_event_durations(events: List[dict]):
+def handle_overlapping_event_durations(events: List[Event]):
     """
     Handles overlapping events using a time-slice approach:
     - Identifies all unique time boundaries
     - For each time slice, splits duration equally among overlapping events
+
+    The slices are swept in time order while keeping the set of events active
+    in the current slice, so each event is only visited in the slices it spans.
     """
     if not events:
         return events
 
+    events = as_events(events)
     # Get all unique time boundaries
     boundaries = set()
     for event in events:
-        start = datetime.fromisoformat(event["start"]["dateTime"])
-        end = datetime.fromisoformat(event["end"]["dateTime"])
-        boundaries.add(start)
-        boundaries.add(end)
+        boundaries.add(event.start_ts)
+        boundaries.add(event.end_ts)
 
-    boundaries = sorted(list(boundaries))
+    boundaries = sorted(boundaries)
 
-    # Reset all event durations to 0
-    for event in events:
-        event["duration_min"] = 0
+    by_start = sorted(range(len(events)), key=lambda i: events[i].start_ts)
+    by_end = sorted(range(len(events)), key=lambda i: events[i].end_ts)
+    next_start = next_end = 0
+    durations = [0] * len(events)
+    # Events that started at or before the current slice and end after it,
+    # in order of their start
+    active = dict()
 
     # Process each time slice
     for i in range(len(boundaries) - 1):
         slice_start = boundaries[i]
         slice_end = boundaries[i + 1]
-        slice_duration = (slice_end - slice_start).total_seconds() / 60
-
-        # Find events active during this slice
-        active_events = []
-        for event in events:
-            event_start = datetime.fromisoformat(event["start"]["dateTime"])
-            event_end = datetime.fromisoformat(event["end"]["dateTime"])
-            if event_start <= slice_start and event_end >= slice_end:
-                active_events.append(event)
+        slice_duration = (slice_end - slice_start) / 60
+
+        # Every end is a boundary, so an event that started and ends after
+        # slice_start is active until slice_end
+        while next_start < len(events) and (
+            events[by_start[next_start]].start_ts <= slice_start
+        ):
+            if events[by_start[next_start]].end_ts > slice_start:
+                active[by_start[next_start]] = None
+            next_start += 1
+        while next_end < len(events) and events[by_end[next_end]].end_ts <= slice_start:
+            active.pop(by_end[next_end], None)
+            next_end += 1
 
         # Split this slice's duration among active events
-        if active_events:
-            duration_per_event = slice_duration / len(active_events)
-            for event in active_events:
-                event["duration_min"] += duration_per_event
+        if active:
+            duration_per_event = slice_duration / len(active)
+            for index in active:
+                durations[index] += duration_per_event
+
+    for event, duration in zip(events, durations):
+        event["duration_min"] = duration
 
     return events
 
 
-def sort_events(events):
-    return sorted(
-        events,
-        key=lambda x: (
-            datetime.fromisoformat(x["start"]["dateTime"]),
-            -x["duration_min"],
-        ),
-    )
+def sort_events(events: List[Event]):
+    return sorted(as_events(events), key=lambda x: (x.start_ts, -x["duration_min"]))
 
 
 def insert_time_left_for_today(events: List[dict], timezone: ZoneInfo):
@@ -388,7 +541,7 @@ def insert_time_left_for_today(events: List[dict], timezone: ZoneInfo):
     return [*events, new_event]
 
 
-def insert_untracked_times(events: List[dict]):
+def insert_untracked_times(events: List[Event]):
     """
     Inserts a New Google Calendar Event with duration set to
     untracked time (excluding sleep time).
@@ -396,12 +549,13 @@ def insert_untracked_times(events: List[dict]):
     We could improve this function by sprinkling the untracked events
     in the actual gaps between tracked events.
     """
+    events = as_events(events)
     daily_tracked = dict()
     for event in events:
         if event["duration_min"] <= 0:
             continue
 
-        date_key = datetime.fromisoformat(event["start"]["dateTime"]).date().isoformat()
+        date_key = event.start.date().isoformat()
         if date_key not in daily_tracked:
             daily_tracked[date_key] = 0
 
@@ -428,37 +582,36 @@ def insert_untracked_times(events: List[dict]):
         end_datetime = start_datetime + timedelta(minutes=untracked_duration_min)
 
         events.append(
-            {
-                "summary": f"{untracked_duration_min} min | Untracked",
-                "start": {
-                    "dateTime": start_datetime.isoformat(),
-                    "timeZone": "UTC",
-                },
-                "end": {
-                    "dateTime": end_datetime.isoformat(),
-                    "timeZone": "UTC",
-                },
-                "visibility": "default",
-                "status": "confirmed",
-                # Custom
-                "duration_min": untracked_duration_min,
-            }
+            Event(
+                {
+                    "summary": f"{untracked_duration_min} min | Untracked",
+                    "start": {
+                        "dateTime": start_datetime.isoformat(),
+                        "timeZone": "UTC",
+                    },
+                    "end": {
+                        "dateTime": end_datetime.isoformat(),
+                        "timeZone": "UTC",
+                    },
+                    "visibility": "default",
+                    "status": "confirmed",
+                    # Custom
+                    "duration_min": untracked_duration_min,
+                }
+            )
         )
 
     return sort_events(events)
 
 
-def get_event_duration(event):
-    start_datetime = datetime.fromisoformat(event["start"]["dateTime"])
-    end_datetime = datetime.fromisoformat(event["end"]["dateTime"])
-    return (end_datetime - start_datetime).total_seconds() // 60
+def get_event_duration(event: Event):
+    return (event.end_ts - event.start_ts) // 60
 
 
 def fetch_calendars(email: str):
-    service = get_calendar_service(email)
-    calendars_result = service.calendarList().list().execute()
-    calendars = calendars_result.get("items", [])
-    return calendars
+    from .calendar_list import get_calendar_lists
+
+    return get_calendar_lists([email])[email]
 
 
 def pretty_print_timedelta(td: timedelta) -> str:
@@ -480,16 +633,11 @@ def pretty_print_timedelta(td: timedelta) -> str:
     return " ".join(parts)
 
 
-def delete_and_duplicate_recurring_event_instance(
-    email: str,
-    calendar_id: str,
-    instance: dict,
-):
-    service = get_calendar_service(email)
-    logger.info(
-        "Deleting and duplicating event instance: %s", instance.get("summary", "")
-    )  # noqa: E501
-    new_event = {
+def get_standalone_event_copy(instance: dict) -> dict:
+    """
+    Body of a new, non-recurring event with the same details as the instance
+    """
+    return {
         "summary": instance.get("summary", ""),
         "description": instance.get("description", ""),
         "location": instance.get("location", ""),
@@ -503,17 +651,37 @@ def delete_and_duplicate_recurring_event_instance(
         "eventType": instance.get("eventType", "default"),
     }
 
+
+def delete_and_duplicate_recurring_event_instance(
+    email: str,
+    calendar_id: str,
+    instance: dict,
+):
+    service = get_calendar_service(email)
+    logger.info(
+        "Deleting and duplicating event instance: %s", instance.get("summary", "")
+    )  # noqa: E501
+
+    # Synced events only carry events_incremental.SYNC_EVENT_FIELDS
+    instance = execute_request(
+        email, service.events().get(calendarId=calendar_id, eventId=instance["id"])
+    )
+    new_event = get_standalone_event_copy(instance)
+
     # Create a new event with the same details as the instance
-    created_event = (
-        service.events().insert(calendarId=calendar_id, body=new_event).execute()
+    created_event = execute_request(
+        email, service.events().insert(calendarId=calendar_id, body=new_event)
     )
     logger.info(f"Created new event: {created_event.get('htmlLink')}")
 
     # Delete the original instance
     instance["status"] = "cancelled"
-    service.events().update(
-        calendarId=calendar_id, eventId=instance["id"], body=instance
-    ).execute()
+    execute_request(
+        email,
+        service.events().update(
+            calendarId=calendar_id, eventId=instance["id"], body=instance
+        ),
+    )
     logger.info(f"Deleted original instance: {instance.get('htmlLink')}")
     return created_event
 
@@ -523,25 +691,93 @@ def process_events_and_classify(
     from_datetime: datetime,
     to_datetime: datetime,
     event_types: List[str] = None,
+    engine: str = "dict",
+    day_cache: bool = None,
+    parallel: bool = False,
 ):
-    # Process Events
-    # Make a deep copy of the fetched events to avoid modifying the original list
-    from copy import deepcopy
+    """
+    `engine` picks how the pipeline runs, both give the same events:
+    - "dict": event by event, see process_event_stream
+    - "numpy": on NumPy columns, see events_columnar.py
+    `day_cache` & `parallel` only apply to the "dict" engine, see
+    process_event_stream.
+    """
+    if engine == "numpy":
+        from .events_columnar import process_events_columnar
+
+        print("Total Events Fetched:", len(events))
+        return process_events_columnar(
+            events,
+            from_datetime=from_datetime,
+            to_datetime=to_datetime,
+            event_types=event_types or ["default", "fromGmail"],
+        )
+    if engine != "dict":
+        raise ValueError(f"Unknown engine {engine}. Available: ['dict', 'numpy']")
+
+    return process_event_stream(
+        [events],
+        from_datetime=from_datetime,
+        to_datetime=to_datetime,
+        event_types=event_types,
+        day_cache=day_cache,
+        parallel=parallel,
+    )
+
+
+def process_event_stream(
+    event_chunks: Iterable[List[dict]],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    event_types: List[str] = None,
+    day_cache: bool = None,
+    parallel: bool = False,
+):
+    """
+    process_events_and_classify over events arriving in chunks, e.g. from
+    iter_events_parallel. Each chunk goes through the per-event stages as soon as
+    it arrives, and only the events that survive them are held until the rest
+    of the pipeline runs. The chunks are then put back in calendar order (see
+    EventChunk), so events that tie in sort_events keep the same order whichever
+    calendar synced first.
+    With `day_cache` (events_day_cache.DAY_CACHE by default, off) the rest of
+    the pipeline only runs on the days that changed since the last run.
+    With `parallel` the days are processed by a pool of processes, for analyses
+    over years of events, see events_parallel.py.
+    """
+    from .events_day_cache import DAY_CACHE, process_days
     from .meta import classify_events
     from .sleep_events import insert_sleep_events
 
+    if day_cache is None:
+        day_cache = DAY_CACHE
     if not event_types:
         event_types = ["default", "fromGmail"]
 
-    events = deepcopy(events)
+    total_events = 0
+    ingested = []
+    for i, chunk in enumerate(event_chunks):
+        total_events += len(chunk)
+        ingested.append(
+            (
+                getattr(chunk, "index", i),
+                ingest_events(
+                    chunk,
+                    from_datetime=from_datetime,
+                    to_datetime=to_datetime,
+                    event_types=event_types,
+                ),
+            )
+        )
+    ingested.sort(key=lambda x: x[0])
+    events = [event for _, chunk in ingested for event in chunk]
+
+    print("Total Events Fetched:", total_events)
+    if day_cache or parallel:
+        return process_days(
+            events, to_datetime=to_datetime, day_cache=day_cache, parallel=parallel
+        )
 
-    print("Total Events Fetched:", len(events))
-    events = filter_out_all_day_events(events)
-    events = filter_out_event_types(events, event_types=event_types)
-    events = add_duration_minutes(events)
-    events = breakdown_overnight_events(events)
-    events = filter_out_past_events(from_datetime=from_datetime, events=events)
-    events = filter_out_future_events(events, to_datetime=to_datetime)
     events = sort_events(events)
     events = insert_sleep_events(events)
     events = handle_overlapping_event_durations(events)
@@ -551,4 +787,39 @@ def process_events_and_classify(
     events = insert_untracked_times(events)
     events = classify_events(events)
 
-    return events
+    # Widgets get plain dicts
+    return [event.to_dict() for event in events]
+
+
+def ingest_events(
+    events: List[dict],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    event_types: List[str],
+):
+    """
+    The stages of process_events_and_classify that only look at one event at a
+    time, so they can be applied to any subset of the fetched events.
+    Same as filter_out_all_day_events, filter_out_event_types,
+    add_duration_minutes, breakdown_overnight_events, filter_out_past_events and
+    filter_out_future_events in turn, fused into a single pass that parses each
+    event once.
+    """
+    boundary = get_future_boundary(to_datetime)
+
+    ingested = []
+    for fetched in events:
+        if is_all_day_event(fetched) or fetched.get("eventType") not in event_types:
+            continue
+
+        # Later stages write to Events over the fetched events, never to the events
+        event = Event(fetched)
+        event["duration_min"] = get_event_duration(event)
+        for part in split_overnight_event(event):
+            if clip_past_event(part, from_datetime) and clip_future_event(
+                part, boundary
+            ):
+                ingested.append(part)
+
+    logger.debug(f"Ingested {len(ingested)} of {len(events)} events")
+    return ingested
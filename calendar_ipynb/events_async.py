@@ -0,0 +1,736 @@
+"""
+asyncio counterpart of events.fetch_events_parallel.
+Pages are fetched from the Calendar v3 REST endpoints with httpx, and every calendar
+is synced by its own coroutine on a single event loop, first syncs & history
+backfills included. The cache is shared with events_incremental, so both engines
+can be used interchangeably.
+
+In a notebook, await it on the running loop:
+    events = await fetch_events_parallel_async(email_map, from_datetime, to_datetime)
+"""
+
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote
+
+import httpx
+from google.auth.transport.requests import Request
+
+from . import events_incremental
+from .api_scheduler import (
+    MAX_RETRIES,
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    get_backoff_delay,
+    get_scheduler,
+    is_rate_limit_status,
+    is_retryable_error,
+    is_retryable_status,
+)
+from .event_store import CalendarDataCache
+from .events_incremental import (
+    _checkpoint_sync,
+    _complete_sync,
+    _delete_data_cache,
+    _discard_data_cache,
+    _get_calendar_lock,
+    _get_data_cache,
+    _get_events_in_range,
+    _merge_events,
+    _update_data_cache,
+    get_backfill_windows,
+    get_first_event_start,
+    get_sync_fields,
+    is_data_cache_fresh,
+    is_expired_page_token_error,
+    is_history_missing,
+)
+from .google_oauth import get_account_credentials
+from .sync_daemon import is_synced_in_background
+
+logger = logging.getLogger(__name__)
+
+CALENDAR_API_URL = "https://www.googleapis.com/calendar/v3"
+MAX_CONCURRENT_REQUESTS = 20
+
+# Google only compresses responses when the user agent mentions gzip
+REQUEST_HEADERS = {
+    "Accept-Encoding": "gzip",
+    "User-Agent": "calendar-ipynb (gzip)",
+}
+
+
+class AsyncCalendarApi:
+    """
+    Authorised GET requests against the Calendar API for any number of accounts.
+    Credentials are loaded & refreshed in a worker thread, once per account.
+    """
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.credentials = dict()
+        self.credentials_lock = asyncio.Lock()
+        # Serialises the syncs of each calendar, see sync_events_async
+        self.calendar_locks = defaultdict(asyncio.Lock)
+
+    def get_calendar_lock(self, email: str, calendarId: str) -> asyncio.Lock:
+        return self.calendar_locks[(email, calendarId)]
+
+    async def get_headers(self, email: str, refresh: bool = False) -> dict:
+        async with self.credentials_lock:
+            creds = self.credentials.get(email)
+            if creds is None:
+                creds = await asyncio.to_thread(get_account_credentials, email)
+                self.credentials[email] = creds
+            elif refresh or not creds.valid:
+                await asyncio.to_thread(creds.refresh, Request())
+
+        return {"Authorization": f"Bearer {creds.token}"}
+
+    async def get(
+        self,
+        email: str,
+        path: str,
+        params: dict,
+        priority: int = PRIORITY_INTERACTIVE,
+    ) -> dict:
+        """
+        Shares the per-account quota & the concurrency limit of api_scheduler
+        with the threaded engine, and retries throttled requests & transport
+        errors with the same backoff.
+        """
+        url = f"{CALENDAR_API_URL}/{path}"
+        scheduler = get_scheduler()
+        bucket = scheduler.get_bucket(email)
+        for attempt in range(MAX_RETRIES + 1):
+            await asyncio.sleep(bucket.reserve())
+            await scheduler.limiter.acquire_async(priority)
+            throttled = False
+            try:
+                response = await self._get(email, url, params)
+                throttled = is_rate_limit_status(response.status_code, response.text)
+                retryable = is_retryable_status(response.status_code, response.text)
+                error = response.status_code
+            except httpx.TransportError as e:
+                if attempt == MAX_RETRIES:
+                    raise e
+                retryable = True
+                error = repr(e)
+            finally:
+                scheduler.limiter.release(throttled)
+
+            if attempt == MAX_RETRIES or not retryable:
+                break
+
+            delay = get_backoff_delay(attempt + 1)
+            logger.warning(
+                f"Request of {email} failed with {error}, retrying in {delay:.1f}s"
+            )
+            bucket.pause(delay)
+            await asyncio.sleep(delay)
+
+        response.raise_for_status()
+        return response.json()
+
+    async def _get(self, email: str, url: str, params: dict) -> httpx.Response:
+        response = await self.client.get(
+            url, params=params, headers=await self.get_headers(email)
+        )
+        if response.status_code == 401:
+            # The access token expired mid-run
+            response = await self.client.get(
+                url, params=params, headers=await self.get_headers(email, True)
+            )
+        return response
+
+
+async def iter_pages(
+    api: AsyncCalendarApi,
+    email: str,
+    calendarId: str,
+    params: dict,
+    page_token: str = None,
+    priority: int = PRIORITY_INTERACTIVE,
+) -> AsyncIterator[dict]:
+    """
+    Pages of an events.list with `params`, following nextPageToken
+    """
+    path = f"calendars/{quote(calendarId, safe='')}/events"
+    while True:
+        page_params = dict(params)
+        if page_token:
+            page_params["pageToken"] = page_token
+
+        result = await api.get(email, path, page_params, priority)
+        yield result
+
+        page_token = result.get("nextPageToken")
+        if not page_token:
+            return
+
+
+async def iter_event_pages(
+    api: AsyncCalendarApi,
+    email: str,
+    calendarId: str,
+    sync_token: str,
+    page_token: str = None,
+) -> AsyncIterator[dict]:
+    params = {
+        "maxResults": 500,
+        "singleEvents": "true",
+        "showDeleted": "true",
+    }
+    if sync_token:
+        params["syncToken"] = sync_token
+    if events_incremental.SYNC_EVENT_FIELDS:
+        params["fields"] = get_sync_fields()
+
+    async for result in iter_pages(api, email, calendarId, params, page_token):
+        logger.debug(
+            f"Fetched {len(result.get('items', []))} events from calendar "
+            f"{email}/{calendarId}"
+        )
+        yield result
+
+
+async def sync_events_async(
+    api: AsyncCalendarApi,
+    email: str,
+    calendarId: str,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+) -> CalendarDataCache:
+    """
+    See events_incremental.sync_events. Syncs of a calendar are serialised by
+    an asyncio lock. Store I/O & merges run on worker threads, under the
+    calendar lock of the threaded engine, so the event loop never waits on it.
+
+    Incremental & resumed syncs walk the page chain with httpx, full syncs are
+    checkpointed every SYNC_CHECKPOINT_PAGES pages. The first sync of a calendar
+    is the windowed backfill of the threaded engine when BACKFILL_WINDOW is set,
+    with the windows fetched by coroutines.
+    """
+    if max_staleness is None:
+        max_staleness = events_incremental.MAX_STALENESS
+    if offline is None:
+        offline = events_incremental.OFFLINE
+
+    async with api.get_calendar_lock(email, calendarId):
+        return await _sync_events_async(api, email, calendarId, max_staleness, offline)
+
+
+async def _sync_events_async(
+    api: AsyncCalendarApi,
+    email: str,
+    calendarId: str,
+    max_staleness: timedelta,
+    offline: bool,
+) -> CalendarDataCache:
+    data = await asyncio.to_thread(
+        _run_locked, email, calendarId, _get_data_cache, email, calendarId
+    )
+    if offline or is_data_cache_fresh(data, max_staleness):
+        return data
+
+    if (
+        not data.sync_token
+        and not data.page_token
+        and events_incremental.BACKFILL_WINDOW
+    ):
+        return await _backfill_sync_async(api, data)
+
+    start_sync_token = sync_token = data.sync_token
+    # Resume an interrupted full sync from its last checkpoint
+    resumed_page_token = None if sync_token else data.page_token or None
+    page_token = resumed_page_token
+
+    pages = 0
+    added = 0
+    updated = 0
+    deleted = 0
+    try:
+        async for page in iter_event_pages(
+            api, email, calendarId, sync_token, resumed_page_token
+        ):
+            page_token = page.get("nextPageToken")
+            if page_token:
+                pages += 1
+            counts = await asyncio.to_thread(_merge_page, data, sync_token, page, pages)
+            if counts is None:
+                logger.debug(
+                    f"{email}/{calendarId} was synced by another engine meanwhile"
+                )
+                return await asyncio.to_thread(
+                    _run_locked, email, calendarId, _get_data_cache, email, calendarId
+                )
+
+            added += counts[0]
+            updated += counts[1]
+            deleted += counts[2]
+            if not page_token:
+                sync_token = page.get("nextSyncToken")
+                break
+    except Exception as e:
+        await asyncio.to_thread(
+            _run_locked, email, calendarId, _discard_data_cache, data
+        )
+
+        if is_expired_page_token_error(e, page_token, resumed_page_token):
+            logger.warning(
+                f"Checkpoint of {email}/{calendarId} has expired. "
+                "Restarting full sync."
+            )
+        elif (
+            # 410 Gone: The sync token is no longer valid, a full sync is required
+            isinstance(e, httpx.HTTPStatusError)
+            and e.response.status_code == 410
+            and sync_token
+        ):
+            logger.warning(
+                f"Sync token is no longer valid for {email}/{calendarId}. "
+                "Performing full sync."
+            )
+        else:
+            raise e
+
+        await asyncio.to_thread(
+            _run_locked, email, calendarId, _delete_data_cache, email, calendarId
+        )
+        return await _sync_events_async(api, email, calendarId, max_staleness, offline)
+
+    if not await asyncio.to_thread(
+        _complete_async_sync,
+        data,
+        start_sync_token,
+        sync_token,
+        (added, updated, deleted),
+    ):
+        return await asyncio.to_thread(
+            _run_locked, email, calendarId, _get_data_cache, email, calendarId
+        )
+    if data.history_start:
+        # An interrupted backfill, or a horizon that was extended since
+        await _continue_backfill_async(api, data)
+    return data
+
+
+async def _backfill_sync_async(
+    api: AsyncCalendarApi, data: CalendarDataCache
+) -> CalendarDataCache:
+    """
+    See events_incremental._backfill_sync
+    """
+    email, calendarId = data.email, data.calendarId
+    start_sync_token = data.sync_token
+    now = datetime.now(tz=timezone.utc)
+    try:
+        sync_token = await _get_initial_sync_token_async(api, email, calendarId)
+        events = await _list_window_events_async(
+            api, email, calendarId, now, None, PRIORITY_INTERACTIVE
+        )
+        completed = await asyncio.to_thread(
+            _complete_first_sync, data, start_sync_token, sync_token, events, now
+        )
+    except Exception as e:
+        await asyncio.to_thread(
+            _run_locked, email, calendarId, _discard_data_cache, data
+        )
+        raise e
+
+    if not completed:
+        logger.debug(f"{email}/{calendarId} was synced by another engine meanwhile")
+        return await asyncio.to_thread(
+            _run_locked, email, calendarId, _get_data_cache, email, calendarId
+        )
+
+    await _continue_backfill_async(api, data)
+    return data
+
+
+async def _continue_backfill_async(api: AsyncCalendarApi, data: CalendarDataCache):
+    """
+    See events_incremental._continue_backfill
+    """
+    try:
+        if events_incremental.HISTORY_HORIZON:
+            await _backfill_history_async(
+                api,
+                data,
+                datetime.now(tz=timezone.utc) - events_incremental.HISTORY_HORIZON,
+                PRIORITY_BACKFILL,
+            )
+            return
+
+        first_event_start = await _get_first_event_start_async(
+            api, data.email, data.calendarId
+        )
+        if first_event_start is not None:
+            await _backfill_history_async(
+                api, data, first_event_start, PRIORITY_BACKFILL
+            )
+    except Exception as e:
+        # The cache is already usable, queries & later syncs pick up from here
+        logger.warning(
+            f"Backfill of {data.email}/{data.calendarId} interrupted at "
+            f"{data.history_start}: {e}"
+        )
+        return
+
+    await asyncio.to_thread(_complete_backfill, data)
+
+
+async def load_history_async(
+    api: AsyncCalendarApi, data: CalendarDataCache, from_datetime: datetime
+):
+    """
+    See events_incremental.load_history
+    """
+    async with api.get_calendar_lock(data.email, data.calendarId):
+        if is_history_missing(data, from_datetime):
+            # Pad by a day for all-day events & events in other timezones
+            await _backfill_history_async(
+                api, data, from_datetime - timedelta(days=1), PRIORITY_INTERACTIVE
+            )
+
+
+async def _backfill_history_async(
+    api: AsyncCalendarApi, data: CalendarDataCache, until: datetime, priority: int
+):
+    """
+    See events_incremental._backfill_history. At most BACKFILL_MAX_WORKERS
+    windows of a calendar are fetched at once, each window is merged under the
+    calendar lock of the threaded engine, which is never held across a request.
+    """
+    windows = get_backfill_windows(data, until)
+    if not windows:
+        return
+
+    logger.info(
+        f"Backfilling {data.email}/{data.calendarId} from {until.date()} "
+        f"in {len(windows)} windows"
+    )
+    semaphore = asyncio.Semaphore(events_incremental.BACKFILL_MAX_WORKERS)
+
+    async def list_window_events(time_min: datetime, time_max: datetime):
+        async with semaphore:
+            return await _list_window_events_async(
+                api, data.email, data.calendarId, time_min, time_max, priority
+            )
+
+    tasks = [
+        asyncio.ensure_future(list_window_events(time_min, time_max))
+        for time_min, time_max in windows
+    ]
+    try:
+        for (time_min, _), task in zip(windows, tasks):
+            if not await asyncio.to_thread(_merge_window, data, await task, time_min):
+                logger.debug(
+                    f"{data.email}/{data.calendarId} was dropped by another "
+                    "engine meanwhile"
+                )
+                return
+    except Exception as e:
+        await asyncio.to_thread(
+            _run_locked, data.email, data.calendarId, _discard_data_cache, data
+        )
+        raise e
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Collects the errors of the windows left behind
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def _list_window_events_async(
+    api: AsyncCalendarApi,
+    email: str,
+    calendarId: str,
+    time_min: datetime,
+    time_max: Optional[datetime],
+    priority: int,
+) -> List[dict]:
+    """
+    See events_incremental._list_window_events
+    """
+    params = {
+        "maxResults": 2500,
+        "singleEvents": "true",
+        "timeMin": time_min.isoformat(),
+    }
+    if time_max is not None:
+        params["timeMax"] = time_max.isoformat()
+    if events_incremental.SYNC_EVENT_FIELDS:
+        params["fields"] = get_sync_fields()
+
+    events = []
+    async for page in iter_pages(api, email, calendarId, params, priority=priority):
+        events.extend(page.get("items", []))
+    return events
+
+
+async def _get_initial_sync_token_async(
+    api: AsyncCalendarApi, email: str, calendarId: str
+) -> str:
+    """
+    See events_incremental._get_initial_sync_token
+    """
+    params = {
+        "maxResults": 2500,
+        "singleEvents": "true",
+        "showDeleted": "true",
+        "fields": "nextPageToken,nextSyncToken",
+    }
+    async for page in iter_pages(api, email, calendarId, params):
+        if not page.get("nextPageToken"):
+            return page.get("nextSyncToken")
+
+
+async def _get_first_event_start_async(
+    api: AsyncCalendarApi, email: str, calendarId: str
+) -> Optional[datetime]:
+    params = {
+        "maxResults": 1,
+        "singleEvents": "true",
+        "orderBy": "startTime",
+        "fields": "items(start)",
+    }
+    events_result = await api.get(
+        email,
+        f"calendars/{quote(calendarId, safe='')}/events",
+        params,
+        PRIORITY_BACKFILL,
+    )
+    return get_first_event_start(events_result)
+
+
+def _run_locked(email: str, calendarId: str, function: Callable, *args):
+    """
+    function(*args) under the calendar lock, on a worker thread
+    """
+    with _get_calendar_lock(email, calendarId):
+        return function(*args)
+
+
+def _is_current(data: CalendarDataCache, sync_token: str) -> bool:
+    """
+    Whether `data` is still the cache a sync from `sync_token` started on,
+    no other sync completed or dropped it meanwhile
+    """
+    return data.sync_token == sync_token and data is _get_data_cache(
+        data.email, data.calendarId
+    )
+
+
+def _merge_page(
+    data: CalendarDataCache, sync_token: str, page: dict, pages: int
+) -> Optional[Tuple[int, int, int]]:
+    """
+    Merges a page of a sync that started from `sync_token`, on a worker thread.
+    Returns the (added, updated, deleted) counts, None if the sync is stale.
+    """
+    with _get_calendar_lock(data.email, data.calendarId):
+        if not _is_current(data, sync_token):
+            return None
+
+        counts = _merge_events(data.events, page.get("items", []))
+        page_token = page.get("nextPageToken")
+        if (
+            page_token
+            and not sync_token
+            and pages % events_incremental.SYNC_CHECKPOINT_PAGES == 0
+        ):
+            _checkpoint_sync(data, page_token)
+        return counts
+
+
+def _complete_async_sync(
+    data: CalendarDataCache,
+    start_sync_token: str,
+    sync_token: str,
+    counts: Tuple[int, int, int],
+) -> bool:
+    """
+    Completes a sync that started from `start_sync_token`, on a worker thread.
+    False if the sync is stale.
+    """
+    with _get_calendar_lock(data.email, data.calendarId):
+        if not _is_current(data, start_sync_token):
+            return False
+
+        _complete_sync(data, sync_token, *counts)
+        return True
+
+
+def _complete_first_sync(
+    data: CalendarDataCache,
+    start_sync_token: str,
+    sync_token: str,
+    events: List[dict],
+    history_start: datetime,
+) -> bool:
+    """
+    Merges the upcoming events of a first sync & completes it, on a worker
+    thread. False if the sync is stale.
+    """
+    with _get_calendar_lock(data.email, data.calendarId):
+        if not _is_current(data, start_sync_token):
+            return False
+
+        counts = _merge_events(data.events, events)
+        data.history_start = history_start.isoformat()
+        _complete_sync(data, sync_token, *counts)
+        return True
+
+
+def _merge_window(
+    data: CalendarDataCache, events: List[dict], time_min: datetime
+) -> bool:
+    """
+    Merges a backfill window & saves its progress, on a worker thread.
+    False if another sync dropped the cache meanwhile.
+    """
+    with _get_calendar_lock(data.email, data.calendarId):
+        if data is not _get_data_cache(data.email, data.calendarId):
+            return False
+
+        _merge_events(data.events, events)
+        data.history_start = time_min.isoformat()
+        _update_data_cache(data)
+        return True
+
+
+def _complete_backfill(data: CalendarDataCache):
+    with _get_calendar_lock(data.email, data.calendarId):
+        if data is not _get_data_cache(data.email, data.calendarId):
+            return
+
+        # Nothing is older than the first event, the whole history is cached
+        data.history_start = ""
+        _update_data_cache(data)
+
+
+async def fetch_events_async(
+    api: AsyncCalendarApi,
+    email: str,
+    calendar_id: str,
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+) -> List[dict]:
+    """
+    See events_incremental.fetch_events
+    """
+    if offline is None:
+        offline = events_incremental.OFFLINE
+
+    if max_staleness is None and await asyncio.to_thread(
+        is_synced_in_background, email, calendar_id
+    ):
+        # The sync daemon keeps the cache fresh, don't wait on the network
+        data = await asyncio.to_thread(
+            _run_locked, email, calendar_id, _get_data_cache, email, calendar_id
+        )
+    else:
+        data = await sync_events_async(api, email, calendar_id, max_staleness, offline)
+    if not offline:
+        # Older history is fetched in windows
+        await load_history_async(api, data, from_datetime)
+
+    return await asyncio.to_thread(
+        _run_locked,
+        email,
+        calendar_id,
+        _get_events_in_range,
+        data,
+        from_datetime,
+        to_datetime,
+    )
+
+
+async def fetch_events_parallel_async(
+    email_map: Dict[str, List[str]],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+    max_concurrent_requests: int = MAX_CONCURRENT_REQUESTS,
+) -> List[dict]:
+    """
+    Same contract as events.fetch_events_parallel, without a thread per calendar.
+    Requests in flight are bounded by the concurrency limit of api_scheduler,
+    shared with the threaded engine, and by the `max_concurrent_requests`
+    connections of the client.
+    """
+    limits = httpx.Limits(max_connections=max_concurrent_requests)
+    # Requests already waited their turn in the limiter, not for a connection
+    timeout = httpx.Timeout(60, pool=None)
+    async with httpx.AsyncClient(
+        limits=limits, timeout=timeout, headers=REQUEST_HEADERS
+    ) as client:
+        api = AsyncCalendarApi(client)
+        results = await asyncio.gather(
+            *[
+                _fetch_calendar_events_async(
+                    api,
+                    email,
+                    calendar,
+                    from_datetime,
+                    to_datetime,
+                    max_staleness=max_staleness,
+                    offline=offline,
+                )
+                for email, calendars in email_map.items()
+                for calendar in calendars
+            ]
+        )
+
+    fetched_events = []
+    for result in results:
+        fetched_events.extend(result)
+    return fetched_events
+
+
+async def _fetch_calendar_events_async(
+    api: AsyncCalendarApi,
+    email: str,
+    calendar_id: str,
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+) -> List[dict]:
+    """
+    See events._fetch_calendar_events
+    """
+    try:
+        return await fetch_events_async(
+            api,
+            email,
+            calendar_id,
+            from_datetime,
+            to_datetime,
+            max_staleness=max_staleness,
+            offline=offline,
+        )
+    except Exception as e:
+        if not is_retryable_async_error(e):
+            raise e
+        # Still failing after every retry, don't fail the other calendars
+        logger.error(f"Serving cached events of {email}/{calendar_id}: {e}")
+        return await fetch_events_async(
+            api, email, calendar_id, from_datetime, to_datetime, offline=True
+        )
+
+
+def is_retryable_async_error(e: Exception) -> bool:
+    """
+    is_retryable_error for the httpx errors of AsyncCalendarApi as well
+    """
+    if isinstance(e, httpx.HTTPStatusError):
+        return is_retryable_status(e.response.status_code, e.response.text)
+    return isinstance(e, httpx.TransportError) or is_retryable_error(e)
@@ -0,0 +1,479 @@
+"""
+Columnar engine of process_events_and_classify, selected with engine="numpy".
+Events are loaded once into NumPy columns, and the per-event stages of events.py
+run as array operations over them:
+- all-day & event type filters, as masks over categorical codes
+- durations, overnight split, past & future clipping
+- sort, as a stable lexsort on (start, -duration)
+- overlap attribution, on the sorted unique boundaries
+- untracked time, as per-day sums
+
+Sleep inference & classification stay per event (see sleep_events.py, meta.py),
+classification is done once per distinct (summary, calendar_id).
+The output is the same as the dict engine's, down to the order of events and
+their keys, so the widgets cannot tell them apart.
+"""
+
+import logging
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+import pytz
+
+from .event_views import Event, get_event_tz, get_zoneinfo
+
+logger = logging.getLogger(__name__)
+
+SECONDS_PER_DAY = 86400
+
+
+class Interner:
+    """
+    Categorical codes, in order of first appearance
+    """
+
+    def __init__(self):
+        self.codes = dict()
+        self.values = []
+
+    def code(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class EventColumns:
+    """
+    One row per event. `src` points into `bases`, the fetched (or generated)
+    event the row was derived from. The rest says how the row differs from it.
+    """
+
+    COLUMNS = {
+        "src": np.int64,
+        # Epoch seconds, as in event_views.Event
+        "start": np.float64,
+        "end": np.float64,
+        # UTC offsets (seconds) the start & end are written with
+        "start_offset": np.int64,
+        "end_offset": np.int64,
+        # Code of the start's timeZone, see zones
+        "zone": np.int64,
+        # Code of the (summary, calendar_id), see labels
+        "label": np.int64,
+        "duration": np.float64,
+        # The duration is the integer 0 the dict engine resets durations to
+        "zero": bool,
+        # Second half of an overnight split, starting at midnight in UTC
+        "split_start": bool,
+        # First half of an overnight split, ending at midnight in UTC
+        "split_end": bool,
+        # Started before from_datetime and was clipped to it
+        "clipped": bool,
+    }
+
+    def __init__(self, bases: list, zones: Interner, labels: Interner, **columns):
+        self.bases = bases
+        self.zones = zones
+        self.labels = labels
+        for name, dtype in self.COLUMNS.items():
+            setattr(self, name, np.asarray(columns[name], dtype=dtype))
+
+    def __len__(self) -> int:
+        return len(self.src)
+
+    def take(self, index: np.ndarray) -> "EventColumns":
+        return EventColumns(
+            self.bases,
+            self.zones,
+            self.labels,
+            **{name: getattr(self, name)[index] for name in self.COLUMNS},
+        )
+
+    def append_events(self, events: List[Event]) -> "EventColumns":
+        """
+        Rows for events created by the pipeline, after the existing ones
+        """
+        rows = {name: [] for name in self.COLUMNS}
+        for event in events:
+            rows["src"].append(len(self.bases))
+            self.bases.append(event.event)
+            rows["start"].append(event.start_ts)
+            rows["end"].append(event.end_ts)
+            rows["start_offset"].append(_get_offset(event.start))
+            rows["end_offset"].append(_get_offset(event.end))
+            rows["zone"].append(self.zones.code(event.tz))
+            rows["label"].append(self.labels.code(_get_label(event)))
+            rows["duration"].append(event["duration_min"])
+            rows["zero"].append(False)
+            rows["split_start"].append(False)
+            rows["split_end"].append(False)
+            rows["clipped"].append(False)
+
+        return EventColumns(
+            self.bases,
+            self.zones,
+            self.labels,
+            **{
+                name: np.concatenate(
+                    [getattr(self, name), np.asarray(rows[name], dtype=dtype)]
+                )
+                for name, dtype in self.COLUMNS.items()
+            },
+        )
+
+    def get_days(self) -> np.ndarray:
+        """
+        ISO date of each row's start, as written in the event
+        """
+        local = np.floor(self.start + self.start_offset).astype(np.int64)
+        return local.astype("datetime64[s]").astype("datetime64[D]").astype(str)
+
+
+def process_events_columnar(
+    events: List[dict],
+    from_datetime: datetime,
+    to_datetime: datetime,
+    event_types: List[str],
+) -> List[dict]:
+    from .meta import classify_event, load_preferences
+    from .sleep_events import SleepEventsHandler
+
+    columns = load_event_columns(events, event_types)
+    columns = add_duration_minutes(columns)
+    columns = breakdown_overnight_events(columns)
+    columns = filter_out_past_events(columns, from_datetime)
+    columns = filter_out_future_events(columns, to_datetime)
+
+    columns = sort_events(columns)
+    columns = insert_sleep_events(columns, SleepEventsHandler([]))
+    columns = handle_overlapping_event_durations(columns)
+    # Redo filter future events since duration_min is reset in the previous step
+    columns = filter_out_future_events(columns, to_datetime)
+    columns = insert_untracked_times(columns)
+
+    categories = classify_labels(
+        columns, classify_event, load_preferences().get("categories", {})
+    )
+    return to_dicts(columns, from_datetime, categories)
+
+
+def load_event_columns(events: List[dict], event_types: List[str]) -> EventColumns:
+    types = Interner()
+    all_day = np.fromiter(
+        ("date" in event.get("start", {}) for event in events),
+        dtype=bool,
+        count=len(events),
+    )
+    type_codes = np.fromiter(
+        (types.code(event.get("eventType")) for event in events),
+        dtype=np.int64,
+        count=len(events),
+    )
+    wanted_types = [types.codes[t] for t in event_types if t in types.codes]
+    keep = ~all_day & np.isin(type_codes, wanted_types)
+    logger.debug(f"Filtered out {np.count_nonzero(all_day)} all-day events")
+
+    zones = Interner()
+    labels = Interner()
+    bases = [events[i] for i in np.flatnonzero(keep)]
+    parsed = ("src", "start", "end", "start_offset", "end_offset", "zone", "label")
+    rows = {name: [] for name in parsed}
+    for i, event in enumerate(bases):
+        start = datetime.fromisoformat(event["start"]["dateTime"])
+        end = datetime.fromisoformat(event["end"]["dateTime"])
+        rows["src"].append(i)
+        rows["start"].append(start.timestamp())
+        rows["end"].append(end.timestamp())
+        rows["start_offset"].append(_get_offset(start))
+        rows["end_offset"].append(_get_offset(end))
+        rows["zone"].append(zones.code(get_event_tz(event["start"], start.tzinfo)))
+        rows["label"].append(labels.code(_get_label(event)))
+
+    count = len(bases)
+    return EventColumns(
+        bases,
+        zones,
+        labels,
+        **rows,
+        duration=np.zeros(count),
+        zero=np.zeros(count, dtype=bool),
+        split_start=np.zeros(count, dtype=bool),
+        split_end=np.zeros(count, dtype=bool),
+        clipped=np.zeros(count, dtype=bool),
+    )
+
+
+def add_duration_minutes(columns: EventColumns) -> EventColumns:
+    columns.duration = (columns.end - columns.start) // 60
+    return columns
+
+
+def breakdown_overnight_events(columns: EventColumns) -> EventColumns:
+    start_day = np.floor((columns.start + columns.start_offset) / SECONDS_PER_DAY)
+    end_day = np.floor((columns.end + columns.end_offset) / SECONDS_PER_DAY)
+    # Next midnight after the start, in the offset the start is written with
+    midnight = (start_day + 1) * SECONDS_PER_DAY - columns.start_offset
+
+    # Events ending at midnight are not split
+    overnight = (start_day != end_day) & (columns.end > midnight)
+    if not overnight.any():
+        return columns
+
+    # Both halves take the place of the event
+    index = np.repeat(np.arange(len(columns)), np.where(overnight, 2, 1))
+    second = np.zeros(len(index), dtype=bool)
+    second[1:] = index[1:] == index[:-1]
+    first = overnight[index] & ~second
+    midnight = midnight[index]
+
+    columns = columns.take(index)
+    columns.duration = np.where(
+        first,
+        (midnight - columns.start) // 60,
+        np.where(second, (columns.end - midnight) // 60, columns.duration),
+    )
+    columns.end = np.where(first, midnight, columns.end)
+    columns.end_offset = np.where(first, columns.start_offset, columns.end_offset)
+    columns.split_end = first
+    columns.start = np.where(second, midnight, columns.start)
+    columns.zone = np.where(
+        second, columns.zones.code(get_zoneinfo("UTC")), columns.zone
+    )
+    columns.split_start = second
+    return columns
+
+
+def filter_out_past_events(
+    columns: EventColumns, from_datetime: datetime
+) -> EventColumns:
+    from_ts = from_datetime.timestamp()
+
+    # Remove events that have ended in the past
+    columns = columns.take(np.flatnonzero(columns.end >= from_ts))
+
+    # Update start time of events that have started in the past
+    ongoing = columns.start < from_ts
+    columns.start = np.where(ongoing, from_ts, columns.start)
+    columns.start_offset = np.where(
+        ongoing, _get_offset(from_datetime), columns.start_offset
+    )
+    columns.duration = np.where(
+        ongoing, (columns.end - from_ts) // 60, columns.duration
+    )
+    columns.clipped |= ongoing
+    return columns
+
+
+def filter_out_future_events(
+    columns: EventColumns, to_datetime: datetime
+) -> EventColumns:
+    now_datetime = datetime.now(pytz.UTC)
+    boundary = min(to_datetime, now_datetime).timestamp()
+
+    # Outright remove events that have started in the future
+    columns = columns.take(np.flatnonzero(columns.start < boundary))
+
+    # Update events that have started and are still running
+    running = columns.end > boundary
+    columns.duration = np.where(
+        running, (boundary - columns.start) // 60, columns.duration
+    )
+    columns.zero &= ~running
+    return columns
+
+
+def sort_events(columns: EventColumns) -> EventColumns:
+    # lexsort is stable, ties keep their order like sorted() does
+    return columns.take(np.lexsort((-columns.duration, columns.start)))
+
+
+def insert_sleep_events(columns: EventColumns, handler) -> EventColumns:
+    """
+    Feeds the rows to a SleepEventsHandler, which infers the sleep events
+    """
+    days = columns.get_days()
+    labels = columns.labels.values
+    zones = columns.zones.values
+    for day, label, zone, start_ts, end_ts in zip(
+        days.tolist(),
+        columns.label.tolist(),
+        columns.zone.tolist(),
+        columns.start.tolist(),
+        columns.end.tolist(),
+    ):
+        handler.add_event(labels[label][0], day, zones[zone], start_ts, end_ts)
+    handler.set_primary_timezones()
+    handler.set_prev_day_sleep_markers()
+
+    return sort_events(columns.append_events(handler.get_sleep_events()))
+
+
+def handle_overlapping_event_durations(columns: EventColumns) -> EventColumns:
+    """
+    Same fair share attribution as events.handle_overlapping_event_durations.
+    Each event's share of every slice is added in slice order, vectorised over
+    the events, so the sums come out bit for bit the same.
+    """
+    if not len(columns):
+        return columns
+
+    boundaries = np.unique(np.concatenate([columns.start, columns.end]))
+    first_slice = np.searchsorted(boundaries, columns.start)
+    end_slice = np.searchsorted(boundaries, columns.end)
+    spans = np.maximum(end_slice - first_slice, 0)
+
+    # Events active in each slice
+    changes = np.zeros(len(boundaries), dtype=np.int64)
+    active = spans > 0
+    np.add.at(changes, first_slice[active], 1)
+    np.add.at(changes, end_slice[active], -1)
+    active_counts = np.cumsum(changes)[:-1]
+
+    slice_durations = (boundaries[1:] - boundaries[:-1]) / 60
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = slice_durations / active_counts
+
+    # Longest spans first, so the events still accumulating are a prefix
+    order = np.argsort(-spans, kind="stable")
+    ordered_spans = spans[order]
+    ordered_first_slice = first_slice[order]
+    durations = np.zeros(len(columns))
+    ordered_durations = np.zeros(len(columns))
+    for offset in range(int(ordered_spans[0]) if len(ordered_spans) else 0):
+        count = np.count_nonzero(ordered_spans > offset)
+        ordered_durations[:count] += shares[ordered_first_slice[:count] + offset]
+    durations[order] = ordered_durations
+
+    columns.duration = durations
+    # Never active, left at the integer 0 by the dict engine
+    columns.zero = spans == 0
+    return columns
+
+
+def insert_untracked_times(columns: EventColumns) -> EventColumns:
+    tracked = columns.duration > 0
+    days, first_seen, day_index = np.unique(
+        columns.get_days()[tracked], return_index=True, return_inverse=True
+    )
+    totals = np.zeros(len(days))
+    # add.at adds in row order, like the dict engine's running sums
+    np.add.at(totals, day_index, columns.duration[tracked])
+
+    today = date.today().isoformat()
+    untracked_events = []
+    for i in np.argsort(first_seen, kind="stable"):
+        date_key = str(days[i])
+        if date_key == today:
+            continue
+
+        untracked_duration_min = (24 * 60) - float(totals[i])
+        if untracked_duration_min <= 0:
+            continue
+
+        start_datetime = datetime.fromisoformat(date_key).replace(tzinfo=pytz.UTC)
+        end_datetime = start_datetime + timedelta(minutes=untracked_duration_min)
+        untracked_events.append(
+            Event(
+                {
+                    "summary": f"{untracked_duration_min} min | Untracked",
+                    "start": {
+                        "dateTime": start_datetime.isoformat(),
+                        "timeZone": "UTC",
+                    },
+                    "end": {
+                        "dateTime": end_datetime.isoformat(),
+                        "timeZone": "UTC",
+                    },
+                    "visibility": "default",
+                    "status": "confirmed",
+                    # Custom
+                    "duration_min": untracked_duration_min,
+                }
+            )
+        )
+
+    return sort_events(columns.append_events(untracked_events))
+
+
+def classify_labels(columns: EventColumns, classify_event, preferences: dict) -> list:
+    """
+    Categories of every label, classified once per label
+    """
+    categories = [
+        classify_event({"summary": summary, "calendar_id": calendar_id}, preferences)
+        for summary, calendar_id in columns.labels.values
+    ]
+
+    unclassified = [
+        columns.bases[src]
+        for src, label in zip(columns.src.tolist(), columns.label.tolist())
+        if not categories[label]
+    ]
+    if unclassified:
+        logger.warning(f"\n\nUnclassified events: {len(unclassified)}")
+        for event in unclassified:
+            logger.warning(f"Event {event['summary']} not classified")
+    else:
+        logger.debug("✅ All events classified")
+
+    return categories
+
+
+def to_dicts(
+    columns: EventColumns, from_datetime: datetime, categories: list
+) -> List[dict]:
+    from_iso = from_datetime.isoformat()
+
+    events = []
+    for row in zip(
+        columns.src.tolist(),
+        columns.start.tolist(),
+        columns.end.tolist(),
+        columns.start_offset.tolist(),
+        columns.end_offset.tolist(),
+        columns.label.tolist(),
+        columns.duration.tolist(),
+        columns.zero.tolist(),
+        columns.split_start.tolist(),
+        columns.split_end.tolist(),
+        columns.clipped.tolist(),
+    ):
+        src, start, end, start_offset, end_offset, label, duration = row[:7]
+        zero, split_start, split_end, clipped = row[7:]
+        event = dict(columns.bases[src])
+
+        if split_start:
+            start_time = _get_iso(start, start_offset)
+            event["start"] = {"dateTime": start_time, "timeZone": "UTC"}
+        if clipped:
+            event["start"] = {**event["start"], "dateTime": from_iso}
+        if split_end:
+            end_time = _get_iso(end, end_offset)
+            event["end"] = {"dateTime": end_time, "timeZone": "UTC"}
+
+        event["duration_min"] = 0 if zero else duration
+        event["categories"] = list(categories[label])
+        events.append(event)
+
+    return events
+
+
+def _get_label(event) -> tuple:
+    return (event.get("summary", "").strip(), event.get("calendar_id", ""))
+
+
+def _get_offset(value: datetime) -> int:
+    return int(value.utcoffset().total_seconds())
+
+
+@lru_cache(maxsize=None)
+def _get_fixed_timezone(offset: int) -> timezone:
+    return timezone(timedelta(seconds=offset))
+
+
+def _get_iso(timestamp: float, offset: int) -> str:
+    return datetime.fromtimestamp(timestamp, _get_fixed_timezone(offset)).isoformat()
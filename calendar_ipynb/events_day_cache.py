@@ -0,0 +1,395 @@
+"""
+Per-day cache of the processed events, see events.process_event_stream.
+A refresh usually only changes today's events, but every stage after
+events.ingest_events ran over the whole range again. Those stages only ever
+look at a day, or a night, at a time:
+- sleep inference summarises each day (SleepEventsHandler.add_event), then pairs
+  neighbouring days into nights
+- overlap attribution, untracked time & classification run on the events & sleep
+  events of one day
+
+So both are cached per local day (the date of the event's start, as written),
+keyed by a content hash of the day's ingested events and of the preferences.
+The key of a day's processed events also covers the sleep events inferred for
+it, so a changed day is processed again along with the days on either side of
+its nights, and cached results are spliced in for the rest.
+
+Days whose events overlap one another, e.g. across time zones, are processed
+together. Days clipped by `now` change on every refresh and are never cached.
+The cache is kept in memory and in temp/processed_days.bin, always in the binary
+codec since the processed events hold tuples. The datetimes & time zones of the
+day summaries are stored as plain values, see encode_summary. Keys also cover
+the source of the pipeline's modules, so a change to the pipeline never serves
+stale results.
+
+Off by default, turn it on with DAY_CACHE or `day_cache`.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import importlib
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone, tzinfo
+from functools import lru_cache
+from typing import Dict, List
+from zoneinfo import ZoneInfo
+
+from .cache_codecs import CorruptCacheError, get_cache_codec, remove_cache_file
+from .event_views import Event, get_zoneinfo
+from .utils import get_temp_path
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+DAY_CACHE = False
+# Modules whose code decides the processed events
+PIPELINE_MODULES = [
+    "events",
+    "event_views",
+    "events_day_cache",
+    "events_parallel",
+    "meta",
+    "sleep_events",
+]
+# Entries kept, the least recently used are dropped first
+MAX_DAY_CACHE_ENTRIES = 5000
+
+_day_cache = None
+_day_cache_lock = threading.Lock()
+
+
+def get_day_cache_stem() -> str:
+    stem = get_temp_path("processed_days")
+    os.makedirs(os.path.dirname(stem), exist_ok=True)
+    return stem
+
+
+def clear_day_cache():
+    global _day_cache
+
+    with _day_cache_lock:
+        _day_cache = None
+        remove_cache_file(get_day_cache_stem())
+
+
+def _load_day_cache() -> dict:
+    global _day_cache
+
+    with _day_cache_lock:
+        if _day_cache is None:
+            try:
+                _day_cache = get_cache_codec("binary").read(get_day_cache_stem())
+            except (FileNotFoundError, CorruptCacheError) as e:
+                logger.debug(f"Starting an empty day cache: {e}")
+                _day_cache = dict()
+        return _day_cache
+
+
+def _save_day_cache(cache: dict):
+    with _day_cache_lock:
+        for key in list(cache)[: max(0, len(cache) - MAX_DAY_CACHE_ENTRIES)]:
+            del cache[key]
+        get_cache_codec("binary").write(get_day_cache_stem(), cache)
+
+
+def _get_cached(cache: dict, key: tuple):
+    if key is None:
+        return None
+
+    value = cache.pop(key, None)
+    if value is not None:
+        # Most recently used last
+        cache[key] = value
+    return value
+
+
+@lru_cache(maxsize=None)
+def get_pipeline_key() -> bytes:
+    """
+    Hash of the source of PIPELINE_MODULES
+    """
+    sources = []
+    for name in PIPELINE_MODULES:
+        module = importlib.import_module(f"{__package__}.{name}")
+        with open(module.__file__, "rb") as f:
+            sources.append(f.read())
+    return get_content_key(sources)
+
+
+def get_content_key(*parts) -> bytes:
+    # pickle is twice as fast as json here. Equal events pickled differently,
+    # e.g. sharing strings differently, only cost a cache miss.
+    return hashlib.blake2b(
+        pickle.dumps(parts, protocol=pickle.HIGHEST_PROTOCOL), digest_size=16
+    ).digest()
+
+
+def encode_summary(summary: dict) -> dict:
+    """
+    A day's SleepEventsHandler.daily_data in the types the binary codec takes:
+    datetimes as (microseconds since EPOCH, zone), zones as their key or UTC
+    offset in seconds, time_zones as a tuple of (zone, count)
+    """
+    encoded = dict()
+    for key, value in summary.items():
+        if isinstance(value, datetime):
+            value = (
+                (value - EPOCH) // timedelta(microseconds=1),
+                _encode_tz(value.tzinfo),
+            )
+        elif isinstance(value, tzinfo):
+            value = _encode_tz(value)
+        elif key == "time_zones":
+            value = tuple((_encode_tz(tz), count) for tz, count in value.items())
+        encoded[key] = value
+    return encoded
+
+
+def decode_summary(encoded: dict) -> dict:
+    summary = dict()
+    for key, value in encoded.items():
+        if key == "time_zones":
+            value = {_decode_tz(tz): count for tz, count in value}
+        elif key == "primary_tz":
+            value = _decode_tz(value)
+        elif isinstance(value, tuple):
+            microseconds, tz = value
+            value = (EPOCH + timedelta(microseconds=microseconds)).astimezone(
+                _decode_tz(tz)
+            )
+        summary[key] = value
+    return summary
+
+
+def _encode_tz(tz: tzinfo):
+    if tz is None or isinstance(tz, ZoneInfo):
+        return tz and tz.key
+    return tz.utcoffset(None) // timedelta(seconds=1)
+
+
+def _decode_tz(value) -> tzinfo:
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return get_zoneinfo(value)
+    return timezone(timedelta(seconds=value))
+
+
+def get_event_day(event: Event) -> str:
+    return event.start.date().isoformat()
+
+
+def group_by_day(events: List[Event]) -> Dict[str, List[Event]]:
+    days = dict()
+    for event in events:
+        days.setdefault(get_event_day(event), []).append(event)
+    return days
+
+
+def process_days(
+    events: List[Event],
+    to_datetime: datetime,
+    day_cache: bool = True,
+    parallel: bool = False,
+) -> List[dict]:
+    """
+    The stages of process_event_stream after ingest_events, on `events`.
+    With `day_cache`, reuses the results of the days that did not change since
+    the last run. With `parallel`, the other days are processed by a pool of
+    processes, see events_parallel.py.
+    """
+    from .events import get_future_boundary, sort_events
+    from .meta import load_preferences, warn_unclassified_events
+    from .sleep_events import SleepEventsHandler
+
+    cache = _load_day_cache() if day_cache else None
+    changed = False
+    preferences = load_preferences()
+    preferences_key = json.dumps(preferences, sort_keys=True)
+
+    # Summarise each day for sleep inference
+    handler = SleepEventsHandler([])
+    days = dict()
+    day_keys = dict()
+    summaries = dict()
+    for day, day_events in group_by_day(events).items():
+        days[day] = sort_events(day_events)
+        summary_key = None
+        if day_cache:
+            day_keys[day] = get_content_key(
+                get_pipeline_key(),
+                preferences_key,
+                [[event.event, event.overlay] for event in days[day]],
+            )
+            summary_key = ("summary", day_keys[day])
+
+        summary = _get_cached(cache, summary_key)
+        if summary is None:
+            handler.events = days[day]
+            handler.daily_data = dict()
+            handler.populate_daily_data()
+            summary = handler.daily_data[day]
+            if summary_key is not None:
+                cache[summary_key] = encode_summary(summary)
+                changed = True
+        else:
+            summary = decode_summary(summary)
+        summaries[day] = summary
+
+    # Pair the days into nights
+    handler.daily_data = summaries
+    handler.set_prev_day_sleep_markers()
+    sleep_days = group_by_day(handler.get_sleep_events())
+
+    boundary = get_future_boundary(to_datetime)
+    today = date.today().isoformat()
+    results = []
+    # Index in results & cache key of the partitions to process
+    missing = []
+    missing_partitions = []
+    for partition in get_day_partitions(days, sleep_days):
+        partition_events = [x for day in partition for x in days.get(day, [])]
+        sleep_events = [x for day in partition for x in sleep_days.get(day, [])]
+        clipped = any(
+            event.end_ts > boundary for event in [*partition_events, *sleep_events]
+        )
+        key = None
+        if day_cache and not clipped:
+            key = (
+                "days",
+                get_content_key(
+                    get_pipeline_key(),
+                    preferences_key,
+                    [day_keys.get(day) for day in partition],
+                    [[event["start"], event["end"]] for event in sleep_events],
+                    today in partition,
+                ),
+            )
+
+        result = _get_cached(cache, key)
+        if result is None:
+            logger.debug(f"Processing {partition}")
+            missing.append((len(results), key))
+            missing_partitions.append((partition_events, sleep_events))
+        results.append(result)
+
+    processed = process_partitions(
+        missing_partitions,
+        to_datetime=to_datetime,
+        preferences=preferences,
+        parallel=parallel,
+    )
+    for (i, key), result in zip(missing, processed):
+        results[i] = result
+        if key is not None:
+            cache[key] = result
+            changed = True
+
+    if changed:
+        _save_day_cache(cache)
+
+    tracked = [x for result in results for x in result[0]]
+    untracked = [x for result in results for x in result[1]]
+
+    # Same order as insert_untracked_times, untracked events go after the tracked
+    # ones they tie with. Copies, so callers can't change the cached events.
+    events = sorted([*tracked, *untracked], key=lambda x: x[0])
+    events = [dict(event) for _, event in events]
+    warn_unclassified_events(events)
+    return events
+
+
+def get_day_partitions(
+    days: Dict[str, List[Event]], sleep_days: Dict[str, List[Event]]
+) -> List[List[str]]:
+    """
+    The days, in order, grouped with the days their events overlap
+    """
+    spans = dict()
+    for day in {*days, *sleep_days}:
+        day_events = [*days.get(day, []), *sleep_days.get(day, [])]
+        spans[day] = (
+            min(event.start_ts for event in day_events),
+            max(event.end_ts for event in day_events),
+        )
+
+    partitions = []
+    partition_end = None
+    for day in sorted(spans, key=spans.get):
+        start_ts, end_ts = spans[day]
+        if partitions and start_ts < partition_end:
+            partitions[-1].append(day)
+            partition_end = max(partition_end, end_ts)
+        else:
+            partitions.append([day])
+            partition_end = end_ts
+    return partitions
+
+
+def process_partitions(
+    partitions: List[tuple],
+    to_datetime: datetime,
+    preferences: dict,
+    parallel: bool = False,
+) -> List[tuple]:
+    """
+    process_partition on each (events, sleep_events) of `partitions`, as
+    (tracked, untracked) lists of (sort key, event dict)
+    """
+    from .events_parallel import PARALLEL_MIN_EVENTS, process_partitions_parallel
+
+    event_count = sum(len(events) + len(sleep) for events, sleep in partitions)
+    if parallel and event_count >= PARALLEL_MIN_EVENTS:
+        return process_partitions_parallel(
+            partitions, to_datetime=to_datetime, preferences=preferences
+        )
+
+    results = []
+    for events, sleep_events in partitions:
+        tracked, untracked = process_partition(
+            events, sleep_events, to_datetime, preferences
+        )
+        results.append(
+            (
+                [(sort_key, event.to_dict()) for sort_key, event in tracked],
+                [(sort_key, event.to_dict()) for sort_key, event in untracked],
+            )
+        )
+    return results
+
+
+def process_partition(
+    events: List[Event],
+    sleep_events: List[Event],
+    to_datetime: datetime,
+    preferences: dict,
+) -> tuple:
+    """
+    (tracked, untracked) processed events of days that overlap no other day, as
+    (sort key, Event). Only duration_min & categories of `events` are changed.
+    """
+    from .events import (
+        filter_out_future_events,
+        handle_overlapping_event_durations,
+        insert_untracked_times,
+        sort_events,
+    )
+    from .meta import classify_events
+
+    events = sort_events(events + sleep_events)
+    events = handle_overlapping_event_durations(events)
+    events = filter_out_future_events(events, to_datetime=to_datetime)
+    tracked = {id(event) for event in events}
+    events = classify_events(
+        insert_untracked_times(list(events)), preferences, warn=False
+    )
+
+    result = ([], [])
+    for event in events:
+        sort_key = (event.start_ts, -event["duration_min"])
+        result[id(event) not in tracked].append((sort_key, event))
+    return result
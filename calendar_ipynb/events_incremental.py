@@ -1,32 +1,152 @@
-import os
 import pytz
-import json
 import logging
-from copy import deepcopy
-from datetime import datetime, date
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-from .utils import get_temp_path
+from googleapiclient.errors import HttpError
+
+from .api_scheduler import PRIORITY_BACKFILL, PRIORITY_INTERACTIVE, execute_request
 from .events import get_calendar_service
+from .cache_codecs import CorruptCacheError
+from .event_store import CalendarDataCache, get_event_store
 
 logger = logging.getLogger(__name__)
 
-
-class CalendarDataCache:
-    calendarId: str
-    email: str
-    sync_token: str
-    events: list
-    last_sync: datetime
-
-
-def sync_events(email: str, calendarId: str) -> CalendarDataCache:
+# One of event_store.EVENT_STORES. Caches of the "json" backend are imported
+# into SQLite the first time a calendar is opened.
+CACHE_BACKEND = "sqlite"
+
+# Caches synced more recently than this are served without contacting Google
+MAX_STALENESS = timedelta(seconds=60)
+
+# Serve purely from the cache, never contacting Google
+OFFLINE = False
+
+# Partial response requested while syncing, only the fields read by the pipeline
+# and the notebooks are fetched & cached. event_mutations.fetch_full_events loads
+# complete events for the tools that need them. Set to None to cache full events.
+# A change only applies to events synced afterwards.
+SYNC_EVENT_FIELDS = [
+    "id",
+    "status",
+    "summary",
+    "start",
+    "end",
+    "eventType",
+    "recurringEventId",
+    "originalStartTime",
+    "creator/email",
+    "visibility",
+    "colorId",
+    "htmlLink",
+]
+
+# A full sync persists the events merged so far every this many pages, so an
+# interrupted backfill resumes from the last checkpoint instead of from scratch.
+# Only full syncs that walk the page chain are checkpointed this way, i.e. with
+# BACKFILL_WINDOW = None. The windowed backfill saves its progress after every
+# window instead, see _backfill_history.
+SYNC_CHECKPOINT_PAGES = 10
+
+# The first sync of a calendar fetches its history in windows of this size,
+# concurrently, instead of walking a single page chain. None walks the chain.
+BACKFILL_WINDOW = timedelta(days=90)
+BACKFILL_MAX_WORKERS = 8
+
+# Only history within this horizon is fetched up front, older events are fetched
+# when a query first reaches past them. None backfills the whole history.
+HISTORY_HORIZON = None
+
+# Loaded caches are kept in memory across notebook cell runs. An entry is reused
+# while the files behind it are unchanged on disk and its generation is current.
+_warm_data_caches: Dict[Tuple[str, str, str], Tuple[tuple, CalendarDataCache]] = {}
+_warm_data_caches_lock = threading.Lock()
+_cache_generation = 0
+
+# Serialises syncs & queries of the same calendar across worker threads
+_calendar_locks = defaultdict(threading.RLock)
+
+
+def invalidate_data_caches():
+    """
+    Drops every in-memory cache, the next access reloads them from disk.
+    """
+    global _cache_generation
+
+    with _warm_data_caches_lock:
+        _cache_generation += 1
+        _warm_data_caches.clear()
+
+
+def _get_calendar_lock(email: str, calendarId: str) -> threading.RLock:
+    with _warm_data_caches_lock:
+        return _calendar_locks[(email, calendarId)]
+
+
+def sync_events(
+    email: str,
+    calendarId: str,
+    max_staleness: timedelta = None,
+    offline: bool = None,
+) -> CalendarDataCache:
+    """
+    Brings the cache of the calendar up to date and returns it.
+    - max_staleness: Skip the sync if the last one is more recent than this.
+      Defaults to MAX_STALENESS, pass timedelta(0) to always sync.
+    - offline: Return the cache as is. Defaults to OFFLINE.
+    """
+    if max_staleness is None:
+        max_staleness = MAX_STALENESS
+    if offline is None:
+        offline = OFFLINE
+
+    with _get_calendar_lock(email, calendarId):
+        data = _get_data_cache(email, calendarId)
+        if offline:
+            if not data.sync_token:
+                logger.warning(
+                    f"Offline: No complete cache found for {email}/{calendarId}"
+                )
+            return data
+
+        if is_data_cache_fresh(data, max_staleness):
+            logger.debug(f"Cache of {email}/{calendarId} is fresh, skipping sync")
+            return data
+
+        return _sync_events(email, calendarId)
+
+
+def is_data_cache_fresh(data: CalendarDataCache, max_staleness: timedelta) -> bool:
+    # A cache that never completed a sync is never fresh
+    if not data.sync_token or not max_staleness:
+        return False
+
+    # Older caches may have stored a naive local timestamp
+    last_sync = data.last_sync.astimezone(pytz.UTC)
+    return datetime.now(tz=pytz.UTC) - last_sync < max_staleness
+
+
+def _sync_events(email: str, calendarId: str) -> CalendarDataCache:
     data = _get_data_cache(email, calendarId)
     service = get_calendar_service(email)
 
-    sync_token = data.sync_token
-    page_token = None
-    all_events = [*data.events]
+    if not data.sync_token and not data.page_token and BACKFILL_WINDOW:
+        return _backfill_sync(data, service)
 
+    sync_token = data.sync_token
+    # Resume an interrupted full sync from its last checkpoint
+    resumed_page_token = None if sync_token else data.page_token or None
+    page_token = resumed_page_token
+    if resumed_page_token:
+        logger.info(
+            f"Resuming full sync of {email}/{calendarId} "
+            f"with {len(data.events)} events cached"
+        )
+
+    pages = 0
     deleted = 0
     updated = 0
     added = 0
@@ -46,31 +166,21 @@ def sync_events(email: str, calendarId: str) -> CalendarDataCache:
             if sync_token:
                 request_params["syncToken"] = sync_token
 
-            events_result = service.events().list(**request_params).execute()
+            if SYNC_EVENT_FIELDS:
+                request_params["fields"] = get_sync_fields()
+
+            events_result = execute_request(
+                email, service.events().list(**request_params)
+            )
             events = events_result.get("items", [])
             logger.debug(
                 f"Fetched {len(events)} events from calendar {email}/{calendarId}"
             )
 
-            for event in events:
-                if event.get("status") == "cancelled":
-                    # Remove cancelled events from our cache
-                    prev_len = len(all_events)
-                    all_events = [e for e in all_events if e["id"] != event["id"]]
-                    if len(all_events) < prev_len:
-                        deleted += 1
-                else:
-                    # Update or add new events
-                    existing_idx = next(
-                        (i for i, e in enumerate(all_events) if e["id"] == event["id"]),
-                        None,
-                    )
-                    if existing_idx is not None:
-                        updated += 1
-                        all_events[existing_idx] = event
-                    else:
-                        added += 1
-                        all_events.append(event)
+            page_added, page_updated, page_deleted = _merge_events(data.events, events)
+            added += page_added
+            updated += page_updated
+            deleted += page_deleted
 
             # Get the next page token
             page_token = events_result.get("nextPageToken")
@@ -79,10 +189,27 @@ def sync_events(email: str, calendarId: str) -> CalendarDataCache:
                 sync_token = events_result.get("nextSyncToken")
                 break
 
+            pages += 1
+            if not sync_token and pages % SYNC_CHECKPOINT_PAGES == 0:
+                _checkpoint_sync(data, page_token)
+
     except Exception as e:
-        if "Sync token is no longer valid" in str(
-            e
-        ) or "Invalid sync token value" in str(e):
+        _discard_data_cache(data)
+        if is_expired_page_token_error(e, page_token, resumed_page_token):
+            logger.warning(
+                f"Checkpoint of {email}/{calendarId} has expired. "
+                "Restarting full sync."
+            )
+            _delete_data_cache(email, calendarId)
+            return sync_events(email, calendarId)
+        if isinstance(e, CorruptCacheError):
+            logger.warning(
+                f"Cache of {email}/{calendarId} is corrupt, performing full sync: {e}"
+            )
+            _delete_data_cache(email, calendarId)
+            return sync_events(email, calendarId)
+        if isinstance(e, HttpError) and e.resp.status == 410 and sync_token:
+            # 410 Gone: The sync token is no longer valid, a full sync is required
             logger.warning(
                 f"Sync token is no longer valid for {email}/{calendarId}. "
                 "Performing full sync."
@@ -92,94 +219,401 @@ def sync_events(email: str, calendarId: str) -> CalendarDataCache:
             return sync_events(email, calendarId)
         raise e
 
+    _complete_sync(data, sync_token, added, updated, deleted)
+    if data.history_start:
+        # An interrupted backfill, or a horizon that was extended since
+        _continue_backfill(data, service)
+    return data
+
+
+def _backfill_sync(data: CalendarDataCache, service) -> CalendarDataCache:
+    """
+    First sync of a calendar. A sync token is taken before any event is fetched,
+    so every change made while the windows are being fetched is replayed by the
+    next incremental sync. Upcoming events are fetched first and the cache is
+    usable from then on, history is then backfilled window by window.
+    """
+    now = datetime.now(tz=pytz.UTC)
+    try:
+        sync_token = _get_initial_sync_token(service, data.email, data.calendarId)
+        added, updated, deleted = _merge_events(
+            data.events,
+            _list_window_events(
+                data.email, data.calendarId, now, None, PRIORITY_INTERACTIVE
+            ),
+        )
+    except Exception as e:
+        _discard_data_cache(data)
+        raise e
+
+    data.history_start = now.isoformat()
+    _complete_sync(data, sync_token, added, updated, deleted)
+    _continue_backfill(data, service)
+    return data
+
+
+def _continue_backfill(data: CalendarDataCache, service):
+    try:
+        if HISTORY_HORIZON:
+            _backfill_history(
+                data, datetime.now(tz=pytz.UTC) - HISTORY_HORIZON, PRIORITY_BACKFILL
+            )
+            return
+
+        first_event_start = _get_first_event_start(service, data.email, data.calendarId)
+        if first_event_start is not None:
+            _backfill_history(data, first_event_start, PRIORITY_BACKFILL)
+    except Exception as e:
+        # The cache is already usable, queries & later syncs pick up from here
+        logger.warning(
+            f"Backfill of {data.email}/{data.calendarId} interrupted at "
+            f"{data.history_start}: {e}"
+        )
+        return
+
+    # Nothing is older than the first event, the whole history is cached
+    data.history_start = ""
+    _update_data_cache(data)
+
+
+def load_history(data: CalendarDataCache, from_datetime: datetime):
+    """
+    Fetches the history a query from `from_datetime` needs, if it is older than
+    what the cache holds.
+    """
+    with _get_calendar_lock(data.email, data.calendarId):
+        if is_history_missing(data, from_datetime):
+            # Pad by a day for all-day events & events in other timezones
+            _backfill_history(
+                data, from_datetime - timedelta(days=1), PRIORITY_INTERACTIVE
+            )
+
+
+def is_history_missing(data: CalendarDataCache, from_datetime: datetime) -> bool:
+    return bool(data.history_start) and from_datetime < datetime.fromisoformat(
+        data.history_start
+    )
+
+
+def _backfill_history(data: CalendarDataCache, until: datetime, priority: int):
+    """
+    Fetches the events between `until` and data.history_start, in windows of
+    BACKFILL_WINDOW fetched concurrently. Windows are merged newest first and
+    history_start is saved after each one, so an interruption keeps the
+    progress made so far.
+    """
+    windows = get_backfill_windows(data, until)
+    if not windows:
+        return
+
+    logger.info(
+        f"Backfilling {data.email}/{data.calendarId} from {until.date()} "
+        f"in {len(windows)} windows"
+    )
+    with ThreadPoolExecutor(max_workers=BACKFILL_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                _list_window_events,
+                data.email,
+                data.calendarId,
+                time_min,
+                time_max,
+                priority,
+            )
+            for time_min, time_max in windows
+        ]
+        try:
+            for (time_min, _), future in zip(windows, futures):
+                _merge_events(data.events, future.result())
+                data.history_start = time_min.isoformat()
+                _update_data_cache(data)
+        except Exception as e:
+            for future in futures:
+                future.cancel()
+            _discard_data_cache(data)
+            raise e
+
+
+def get_backfill_windows(
+    data: CalendarDataCache, until: datetime
+) -> List[Tuple[datetime, datetime]]:
+    """
+    The (time_min, time_max) windows between `until` and data.history_start,
+    newest first
+    """
+    history_start = datetime.fromisoformat(data.history_start)
+    window = BACKFILL_WINDOW or history_start - until
+    windows = []
+    while history_start > until:
+        windows.append((max(history_start - window, until), history_start))
+        history_start = windows[-1][0]
+    return windows
+
+
+def _list_window_events(
+    email: str,
+    calendarId: str,
+    time_min: datetime,
+    time_max: Optional[datetime],
+    priority: int,
+) -> List[dict]:
+    """
+    Events overlapping [time_min, time_max), all of them from time_min on when
+    time_max is None. Cancelled events are left out.
+    """
+    service = get_calendar_service(email)
+
+    events = []
+    page_token = None
+    while True:
+        request_params = {
+            "calendarId": calendarId,
+            "pageToken": page_token,
+            "maxResults": 2500,
+            "singleEvents": True,
+            "timeMin": time_min.isoformat(),
+        }
+        if time_max is not None:
+            request_params["timeMax"] = time_max.isoformat()
+        if SYNC_EVENT_FIELDS:
+            request_params["fields"] = get_sync_fields()
+
+        events_result = execute_request(
+            email, service.events().list(**request_params), priority
+        )
+        events.extend(events_result.get("items", []))
+
+        page_token = events_result.get("nextPageToken")
+        if not page_token:
+            return events
+
+
+def _get_initial_sync_token(service, email: str, calendarId: str) -> str:
+    """
+    Walks the page chain of a full sync without any events in the responses,
+    only to obtain its sync token
+    """
+    page_token = None
+    while True:
+        events_result = execute_request(
+            email,
+            service.events().list(
+                calendarId=calendarId,
+                pageToken=page_token,
+                maxResults=2500,
+                singleEvents=True,
+                showDeleted=True,
+                fields="nextPageToken,nextSyncToken",
+            ),
+        )
+
+        page_token = events_result.get("nextPageToken")
+        if not page_token:
+            return events_result.get("nextSyncToken")
+
+
+def _get_first_event_start(service, email: str, calendarId: str) -> Optional[datetime]:
+    events_result = execute_request(
+        email,
+        service.events().list(
+            calendarId=calendarId,
+            maxResults=1,
+            singleEvents=True,
+            orderBy="startTime",
+            fields="items(start)",
+        ),
+        PRIORITY_BACKFILL,
+    )
+    return get_first_event_start(events_result)
+
+
+def get_first_event_start(events_result: dict) -> Optional[datetime]:
+    """
+    Start of the first event of an events.list ordered by startTime, padded by
+    a day for all-day events & events in other timezones
+    """
+    items = events_result.get("items", [])
+    if not items:
+        return None
+
+    start = items[0]["start"]
+    if "dateTime" in start:
+        return datetime.fromisoformat(start["dateTime"]) - timedelta(days=1)
+    return datetime.fromisoformat(f"{start['date']}T00:00:00+00:00") - timedelta(days=1)
+
+
+def _checkpoint_sync(data: CalendarDataCache, page_token: str):
+    data.page_token = page_token
+    _update_data_cache(data)
+    logger.info(
+        f"Checkpointed full sync of {data.email}/{data.calendarId} "
+        f"at {len(data.events)} events"
+    )
+
+
+def is_expired_page_token_error(
+    e: Exception, page_token: str, resumed_page_token: str
+) -> bool:
+    """
+    Page tokens are not meant to outlive a sync, Google rejects old ones with a
+    400 or 410. Only the first request of a resumed sync can hit this.
+    """
+    if not resumed_page_token or page_token != resumed_page_token:
+        return False
+
+    if isinstance(e, HttpError):
+        status = e.resp.status
+    else:
+        # httpx.HTTPStatusError, from events_async
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status in (400, 410)
+
+
+def _complete_sync(
+    data: CalendarDataCache, sync_token: str, added: int, updated: int, deleted: int
+):
     data.sync_token = sync_token
-    data.events = all_events
+    data.page_token = ""
     data.last_sync = datetime.now(tz=pytz.UTC)
+    data.last_change_count = added + updated + deleted
     _update_data_cache(data)
 
     logger.info(
-        f"Sync completed for {email}/{calendarId}: "
+        f"Sync completed for {data.email}/{data.calendarId}: "
         f"Added {added}, Updated {updated}, Deleted {deleted}"
     )
 
-    return data
+
+def get_sync_fields() -> str:
+    return f"nextPageToken,nextSyncToken,items({','.join(SYNC_EVENT_FIELDS)})"
+
+
+def _merge_events(
+    all_events: Dict[str, dict], events: List[dict]
+) -> Tuple[int, int, int]:
+    """
+    Merges a page of changed events into the id-keyed cache, in place.
+    Returns the (added, updated, deleted) counts for the page.
+    """
+    added = 0
+    updated = 0
+    deleted = 0
+    for event in events:
+        if event.get("status") == "cancelled":
+            # Remove cancelled events from our cache
+            if event["id"] in all_events:
+                del all_events[event["id"]]
+                deleted += 1
+        elif event["id"] in all_events:
+            updated += 1
+            all_events[event["id"]] = event
+        else:
+            added += 1
+            all_events[event["id"]] = event
+
+    return added, updated, deleted
 
 
 def _get_data_cache(email: str, calendarId: str) -> CalendarDataCache:
-    try:
-        with open(_get_data_cache_path(email, calendarId), "r") as f:
-            data = json.load(f)
-            cache = CalendarDataCache()
-            cache.sync_token = data.get("sync_token", "")
-            cache.events = data.get("events", [])
-            cache.calendarId = data.get("calendarId", calendarId)
-            cache.email = data.get("email", email)
-            cache.last_sync = datetime.fromisoformat(
-                data.get("last_sync", datetime.now().isoformat())
-            )
-            return cache
-    except (FileNotFoundError, json.JSONDecodeError):
-        # Return empty cache if file doesn't exist or is invalid
-        cache = CalendarDataCache()
-        cache.sync_token = ""
-        cache.events = []
-        cache.calendarId = calendarId
-        cache.email = email
-        cache.last_sync = datetime.now()
-        return cache
+    store = get_event_store(CACHE_BACKEND)
+    key = (CACHE_BACKEND, email, calendarId)
+    generation = _cache_generation
+
+    with _warm_data_caches_lock:
+        cached = _warm_data_caches.get(key)
+    if cached and cached[0] == (generation, store.get_stamp(email, calendarId)):
+        return cached[1]
+
+    data = store.load(email, calendarId)
+    _set_warm_data_cache(data, generation)
+    return data
+
+
+def _set_warm_data_cache(data: CalendarDataCache, generation: int):
+    store = get_event_store(CACHE_BACKEND)
+    # Stamp after loading/saving, a load may have migrated the cache on disk
+    stamp = (generation, store.get_stamp(data.email, data.calendarId))
+    with _warm_data_caches_lock:
+        _warm_data_caches[(CACHE_BACKEND, data.email, data.calendarId)] = (stamp, data)
+
+
+def _evict_warm_data_cache(email: str, calendarId: str):
+    with _warm_data_caches_lock:
+        _warm_data_caches.pop((CACHE_BACKEND, email, calendarId), None)
 
 
 def _update_data_cache(data: CalendarDataCache):
-    cache_data = {
-        "sync_token": data.sync_token,
-        "events": data.events,
-        "calendarId": data.calendarId,
-        "email": data.email,
-        "last_sync": data.last_sync.isoformat(),
-    }
-    with open(_get_data_cache_path(data.email, data.calendarId), "w") as f:
-        json.dump(cache_data, f, indent=2)
+    generation = _cache_generation
+    get_event_store(CACHE_BACKEND).save(data)
+    _set_warm_data_cache(data, generation)
 
 
-def _delete_data_cache(email: str, calendarId: str):
-    try:
-        os.remove(_get_data_cache_path(email, calendarId))
-    except FileNotFoundError:
-        pass
+def _discard_data_cache(data: CalendarDataCache):
+    # The in-memory events may hold half of a failed merge
+    _evict_warm_data_cache(data.email, data.calendarId)
+    get_event_store(CACHE_BACKEND).discard(data)
 
 
-def _get_data_cache_path(email: str, calendarId: str) -> str:
-    os.makedirs(get_temp_path("all_events"), exist_ok=True)
+def _delete_data_cache(email: str, calendarId: str):
+    _evict_warm_data_cache(email, calendarId)
+    get_event_store(CACHE_BACKEND).delete(email, calendarId)
 
-    return get_temp_path(f"all_events/{email}_{calendarId}.json")
+
+def _query_data_cache(
+    data: CalendarDataCache, from_datetime: datetime, to_datetime: datetime
+):
+    return get_event_store(CACHE_BACKEND).query(data, from_datetime, to_datetime)
 
 
 def fetch_events(
-    email: str, calendar_id: str, from_datetime: datetime, to_datetime: datetime
+    email: str,
+    calendar_id: str,
+    from_datetime: datetime,
+    to_datetime: datetime,
+    max_staleness: timedelta = None,
+    offline: bool = None,
 ):
-    data = sync_events(email, calendar_id)
-    events = data.events
-
-    filtered_events = []
-    for event in events:
-        if "start" in event and "dateTime" in event["start"]:
-            start_time = datetime.fromisoformat(event["start"]["dateTime"])
-            if from_datetime <= start_time <= to_datetime:
-                filtered_events.append(event)
-        elif "start" in event and "date" in event["start"]:
-            # Handle all-day events
-            start_date = date.fromisoformat(event["start"]["date"])
-            end_date = date.fromisoformat(event["end"]["date"])
-
-            if from_datetime.date() <= start_date <= to_datetime.date():
-                filtered_events.append(event)
-
-            if from_datetime.date() <= end_date <= to_datetime.date():
-                filtered_events.append(event)
-
-    filtered_events = deepcopy(filtered_events)
+    from .sync_daemon import is_synced_in_background
+
+    if offline is None:
+        offline = OFFLINE
+
+    with _get_calendar_lock(email, calendar_id):
+        if max_staleness is None and is_synced_in_background(email, calendar_id):
+            # The sync daemon keeps the cache fresh, don't wait on the network
+            data = _get_data_cache(email, calendar_id)
+        else:
+            data = sync_events(
+                email, calendar_id, max_staleness=max_staleness, offline=offline
+            )
+        try:
+            if not offline:
+                load_history(data, from_datetime)
+            return _get_events_in_range(data, from_datetime, to_datetime)
+        except CorruptCacheError as e:
+            # Segments are only read by queries, see event_store.SegmentedEventIndex
+            logger.warning(f"Cache of {email}/{calendar_id} is corrupt, resyncing: {e}")
+            _delete_data_cache(email, calendar_id)
+
+        # Sync right away, even if the daemon keeps the calendar in sync
+        return fetch_events(
+            email,
+            calendar_id,
+            from_datetime,
+            to_datetime,
+            max_staleness=timedelta(0),
+            offline=offline,
+        )
+
+
+def _get_events_in_range(
+    data: CalendarDataCache, from_datetime: datetime, to_datetime: datetime
+) -> List[dict]:
+    # Stores expand fresh dicts, so the cache is not touched. calendar_id & email
+    # are only recorded once per cache and added here.
+    filtered_events = _query_data_cache(data, from_datetime, to_datetime)
     for event in filtered_events:
-        event["calendar_id"] = calendar_id
-        event["email"] = email
+        event["calendar_id"] = data.calendarId
+        event["email"] = data.email
 
     return filtered_events
@@ -0,0 +1,118 @@
+"""
+Parallel processing of the days of events, see events_day_cache.process_days.
+Once sleep events are inferred, overlap attribution, untracked time &
+classification only look at one day (or a few overlapping days, see
+get_day_partitions) at a time. A pool of processes runs them on about a week of
+days per task, the results are merged back in order.
+
+Sleep is inferred before the days are split up, from the summaries of all the
+days, so nights across task boundaries are the same as in a single process.
+
+Only what those stages read is sent to the workers: start, end, summary,
+calendar_id & duration_min of each event. Only what they write comes back: the
+duration_min & categories of each event, and the untracked time events. The
+processed events are then put together from the events in this process.
+"""
+
+import logging
+from datetime import datetime
+from typing import List
+
+from .event_views import Event
+
+logger = logging.getLogger(__name__)
+
+# Below this, starting the workers costs more than it saves
+PARALLEL_MIN_EVENTS = 5000
+DAYS_PER_TASK = 7
+# Defaults to the number of CPUs
+PARALLEL_MAX_WORKERS = None
+
+# What process_partition reads from an event
+PARTITION_EVENT_KEYS = ["start", "end", "summary", "calendar_id", "duration_min"]
+
+
+def process_partitions_parallel(
+    partitions: List[tuple], to_datetime: datetime, preferences: dict
+) -> List[tuple]:
+    """
+    events_day_cache.process_partitions in a pool of processes
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    tasks = [
+        partitions[i : i + DAYS_PER_TASK]
+        for i in range(0, len(partitions), DAYS_PER_TASK)
+    ]
+    with ProcessPoolExecutor(max_workers=PARALLEL_MAX_WORKERS) as executor:
+        futures = [
+            executor.submit(
+                _process_partitions_task,
+                [_get_partition_rows(*partition) for partition in task],
+                to_datetime,
+                preferences,
+            )
+            for task in tasks
+        ]
+
+        # Merged in order, whichever task completes first
+        results = []
+        for task, future in zip(tasks, futures):
+            for partition, result in zip(task, future.result()):
+                results.append(_merge_partition_result(*partition, result))
+        return results
+
+
+def _get_partition_rows(events: List[Event], sleep_events: List[Event]) -> tuple:
+    rows = [
+        {key: event[key] for key in PARTITION_EVENT_KEYS if key in event}
+        for event in [*events, *sleep_events]
+    ]
+    return rows, len(events)
+
+
+def _process_partitions_task(
+    partitions: List[tuple], to_datetime: datetime, preferences: dict
+) -> list:
+    """
+    Runs in the worker processes. The tracked events come back as their index in
+    the partition, their duration_min & categories.
+    """
+    from .events_day_cache import process_partition
+
+    results = []
+    for rows, event_count in partitions:
+        events = [Event(row) for row in rows]
+        tracked, untracked = process_partition(
+            events[:event_count], events[event_count:], to_datetime, preferences
+        )
+
+        indexes = {id(event): i for i, event in enumerate(events)}
+        results.append(
+            (
+                [
+                    (
+                        sort_key,
+                        indexes[id(event)],
+                        event["duration_min"],
+                        event["categories"],
+                    )
+                    for sort_key, event in tracked
+                ],
+                [(sort_key, event.to_dict()) for sort_key, event in untracked],
+            )
+        )
+    return results
+
+
+def _merge_partition_result(
+    events: List[Event], sleep_events: List[Event], result: tuple
+) -> tuple:
+    partition_events = [*events, *sleep_events]
+    tracked = []
+    for sort_key, i, duration_min, categories in result[0]:
+        event = partition_events[i]
+        event["duration_min"] = duration_min
+        event["categories"] = categories
+        tracked.append((sort_key, event.to_dict()))
+    return tracked, result[1]
@@ -7,7 +7,7 @@ from IPython.display import display
 
 from calendar_ipynb.utils import get_temp_path
 
-from ..events import fetch_calendars
+from ..calendar_list import get_calendar_lists
 
 
 class Calendar(TypedDict):
@@ -29,9 +29,11 @@ def select_calendars(EMAIL_IDS: List[str]):
     global _calendar_selection_widget, _calendar_map
 
     calendar_map = []
+    calendar_lists = get_calendar_lists(EMAIL_IDS)
     for email in EMAIL_IDS:
-        calendars = fetch_calendars(email)
-        calendar_map.append(EmailCalendarMap(email=email, calendars=calendars))
+        calendar_map.append(
+            EmailCalendarMap(email=email, calendars=calendar_lists[email])
+        )
 
     _selection = get_selection_from_cache()
 
@@ -12,9 +12,15 @@ For now, we assume that the user's preference is stored at temp/user_preferences
 logger = logging.getLogger(__name__)
 
 
-def classify_events(events):
-    preferences = load_preferences()
-    unclassified_events = []
+def classify_events(events, preferences: dict = None, warn: bool = True):
+    """
+    Sets the categories of the events. `preferences` are loaded from the file
+    if not given. Without `warn`, call warn_unclassified_events() once all the
+    events are classified.
+    """
+    if preferences is None:
+        preferences = load_preferences()
+
     for event in events:
         event["categories"] = classify_event(event, preferences.get("categories", {}))
         if event["categories"]:
@@ -23,8 +29,14 @@ def classify_events(events):
             )
         else:
             logger.debug(f"Event {event['summary']} not classified")
-            unclassified_events.append(event)
 
+    if warn:
+        warn_unclassified_events(events)
+    return events
+
+
+def warn_unclassified_events(events):
+    unclassified_events = [event for event in events if not event["categories"]]
     if len(unclassified_events) > 0:
         logger.warning(f"\n\nUnclassified events: {len(unclassified_events)}")
         for event in unclassified_events:
@@ -32,8 +44,6 @@ def classify_events(events):
     else:
         logger.debug("✅ All events classified")
 
-    return events
-
 
 def load_preferences():
     file_path = get_temp_path("user_preferences.json")
@@ -3,8 +3,10 @@ import re
 from datetime import datetime, date, timedelta
 from zoneinfo import ZoneInfo
 
+from .event_views import Event
 
-def insert_sleep_events(events: List[dict]):
+
+def insert_sleep_events(events: List[Event]):
     """
     Insert a Sleep Event for all the days we have events.
     - Every night, we make two sleep events. 1st on D0 till Midnight, 2nd from D1 Midnight till Daybreak
@@ -32,7 +34,7 @@ def insert_sleep_events(events: List[dict]):
 
 class SleepEventsHandler:
 
-    def __init__(self, events: List[dict]):
+    def __init__(self, events: List[Event]):
         from .meta import get_sleep_preferences, get_daily_sleep_minutes
 
         self.events = events
@@ -50,6 +52,9 @@ class SleepEventsHandler:
     def insert_sleep_events(self):
         from .events import sort_events
 
+        return sort_events(self.events + self.get_sleep_events())
+
+    def get_sleep_events(self) -> List[Event]:
         sleep_events = []
         days = self.get_sleep_days()
         for i in range(len(days) - 1):
@@ -80,7 +85,7 @@ class SleepEventsHandler:
         sleep_events.extend(self.get_first_day_sleep_event())
         sleep_events.extend(self.get_last_day_sleep_event())
 
-        return sort_events(self.events + sleep_events)
+        return sleep_events
 
     def get_first_day_sleep_event(self):
         """
@@ -135,64 +140,86 @@ class SleepEventsHandler:
         return []
 
     def populate_daily_data(self):
+        for event in self.events:
+            self.add_event(
+                event.get("summary", "").strip(),
+                event.start.date().isoformat(),
+                event.tz,
+                event.start_ts,
+                event.end_ts,
+            )
+        self.set_primary_timezones()
+        self.set_prev_day_sleep_markers()
+
+    def add_event(
+        self, summary: str, day: str, event_tz: ZoneInfo, start_ts: float, end_ts: float
+    ):
+        """
+        Adds an event to the data of `day`, the date of its start as written in
+        the event. Only the data of `day` is changed, call set_primary_timezones()
+        & set_prev_day_sleep_markers() once every event is added.
+        """
         start_marker = self.sleep_preferences.get("start_marker")
         end_marker = self.sleep_preferences.get("end_marker")
 
-        for event in self.events:
-            day = datetime.fromisoformat(event["start"]["dateTime"]).date().isoformat()
-            data = self.daily_data.setdefault(
-                day,
-                dict(
-                    prev_day_sleep_marker=None,
-                    wakeup_marker=None,
-                    sleep_marker=None,
-                    first_event=None,
-                    last_event=None,
-                    primary_tz=None,
-                    time_zones=dict(),
-                ),
-            )
+        data = self.daily_data.setdefault(
+            day,
+            dict(
+                prev_day_sleep_marker=None,
+                prev_day=None,
+                wakeup_marker=None,
+                sleep_marker=None,
+                first_event=None,
+                last_event=None,
+                primary_tz=None,
+                time_zones=dict(),
+            ),
+        )
 
-            summary = event.get("summary", "").strip()
-            event_tz = ZoneInfo(event["start"]["timeZone"])
-            start_time = datetime.fromisoformat(event["start"]["dateTime"]).astimezone(
-                event_tz
-            )
-            end_time = datetime.fromisoformat(event["end"]["dateTime"]).astimezone(
-                event_tz
-            )
-            data["time_zones"][event_tz] = data["time_zones"].get(event_tz, 0) + 1
-
-            # Check for Sleep Start & End Markers
-            if re.match(end_marker, summary):
-                data["wakeup_marker"] = start_time
-            elif re.match(start_marker, summary):
-                # Handle the case of post midnight sleeping.
-                # We check if the end time is before 7am
-                if start_time.hour < 10:
-                    # This belongs to the previous day
-                    data["prev_day_sleep_marker"] = end_time
-                    prev_day = (start_time.date() - timedelta(days=1)).isoformat()
-                    if self.daily_data.get(prev_day):
-                        self.daily_data[prev_day]["sleep_marker"] = end_time
-                else:
-                    data["sleep_marker"] = end_time
-
-            # Check for First & Last Events
-            if data["first_event"] is None:
-                data["first_event"] = start_time
-            elif start_time < data["first_event"]:
-                data["first_event"] = start_time
-
-            if data["last_event"] is None:
-                data["last_event"] = end_time
-            elif end_time > data["last_event"]:
-                data["last_event"] = end_time
+        start_time = datetime.fromtimestamp(start_ts, event_tz)
+        end_time = datetime.fromtimestamp(end_ts, event_tz)
+        data["time_zones"][event_tz] = data["time_zones"].get(event_tz, 0) + 1
+
+        # Check for Sleep Start & End Markers
+        if re.match(end_marker, summary):
+            data["wakeup_marker"] = start_time
+        elif re.match(start_marker, summary):
+            # Handle the case of post midnight sleeping.
+            # We check if the end time is before 7am
+            if start_time.hour < 10:
+                # This belongs to the previous day, see set_prev_day_sleep_markers
+                data["prev_day_sleep_marker"] = end_time
+                data["prev_day"] = (start_time.date() - timedelta(days=1)).isoformat()
+            else:
+                data["sleep_marker"] = end_time
+
+        # Check for First & Last Events
+        if data["first_event"] is None:
+            data["first_event"] = start_time
+        elif start_time < data["first_event"]:
+            data["first_event"] = start_time
 
+        if data["last_event"] is None:
+            data["last_event"] = end_time
+        elif end_time > data["last_event"]:
+            data["last_event"] = end_time
+
+    def set_primary_timezones(self):
         for d in self.get_sleep_days():
             data = self.daily_data[d]
             data["primary_tz"] = max(data["time_zones"], key=data["time_zones"].get)
 
+    def set_prev_day_sleep_markers(self):
+        """
+        Post midnight sleep markers are the sleep marker of the previous day
+        """
+        for d in self.get_sleep_days():
+            data = self.daily_data[d]
+            if data["prev_day"] in self.daily_data:
+                self.daily_data[data["prev_day"]]["sleep_marker"] = data[
+                    "prev_day_sleep_marker"
+                ]
+
     def get_sleep_days(self):
         return sorted(list(set(self.daily_data.keys())))
 
@@ -204,21 +231,17 @@ class SleepEventsHandler:
         - If both start and end are on the same day, we don't split
         """
 
-        def create_event(start: datetime, end: datetime) -> dict:
-            return {
-                "summary": "Sleeping",
-                "start": {
-                    "dateTime": start.isoformat(),
-                    "timeZone": start.tzinfo.key,
-                },
-                "end": {
-                    "dateTime": end.isoformat(),
-                    "timeZone": end.tzinfo.key,
-                },
-                "duration_min": (end - start).total_seconds() // 60,
-                "visibility": "default",
-                "status": "confirmed",
-            }
+        def create_event(start: datetime, end: datetime) -> Event:
+            return Event(
+                {
+                    "summary": "Sleeping",
+                    "start": get_event_time(start),
+                    "end": get_event_time(end),
+                    "duration_min": (end - start).total_seconds() // 60,
+                    "visibility": "default",
+                    "status": "confirmed",
+                }
+            )
 
         if start.tzinfo != end.tzinfo:
             raise ValueError("Start and End times must be in the same timezone")
@@ -283,3 +306,14 @@ class SleepEventsHandler:
         )
 
         return self.create_base_sleep_events(sleep_start, sleep_end)
+
+
+def get_event_time(value: datetime) -> dict:
+    """
+    Start / end of an event at `value`. Fixed UTC offsets, of events without a
+    timeZone, have no zone name.
+    """
+    time = {"dateTime": value.isoformat()}
+    if isinstance(value.tzinfo, ZoneInfo):
+        time["timeZone"] = value.tzinfo.key
+    return time
@@ -0,0 +1,99 @@
+"""
+Compact in-memory form of cached events.
+Recurring event instances repeat the same summary, timeZone, creator etc., so
+every string is stored once per cache and events are kept as tuples of values
+that share their tuple of keys. Events are expanded back to plain dicts on access.
+"""
+
+from collections.abc import MutableMapping
+from typing import Callable, Iterable, List
+
+
+class _Record:
+    """
+    A dict, stored as a shared tuple of keys and a tuple of compacted values
+    """
+
+    __slots__ = ("keys", "values")
+
+    def __init__(self, keys: tuple, values: tuple):
+        self.keys = keys
+        self.values = values
+
+    def get(self, key: str):
+        try:
+            return self.values[self.keys.index(key)]
+        except ValueError:
+            return None
+
+
+def expand(value):
+    if type(value) is _Record:
+        return {k: expand(v) for k, v in zip(value.keys, value.values)}
+    if type(value) is tuple:
+        return [expand(v) for v in value]
+    return value
+
+
+class SlimEventIndex(MutableMapping):
+    """
+    Id-keyed events, kept in insertion order like a dict.
+    Every read returns a freshly expanded dict, so callers may mutate it without
+    touching the cache.
+    """
+
+    def __init__(self, events: Iterable[dict] = ()):
+        self.records = dict()
+        self.strings = dict()
+        self.shapes = dict()
+        for event in events:
+            self[event["id"]] = event
+
+    def compact(self, value):
+        if isinstance(value, str):
+            return self.strings.setdefault(value, value)
+        if isinstance(value, dict):
+            keys = tuple(self.compact(k) for k in value.keys())
+            return _Record(
+                self.shapes.setdefault(keys, keys),
+                tuple(self.compact(v) for v in value.values()),
+            )
+        if isinstance(value, list):
+            return tuple(self.compact(v) for v in value)
+        return value
+
+    def __getitem__(self, event_id: str) -> dict:
+        return expand(self.records[event_id])
+
+    def __setitem__(self, event_id: str, event: dict):
+        self.records[event_id] = self.compact(event)
+
+    def __delitem__(self, event_id: str):
+        del self.records[event_id]
+
+    def __contains__(self, event_id) -> bool:
+        return event_id in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def values(self):
+        return [expand(record) for record in self.records.values()]
+
+    def select(self, predicate: Callable[[dict], bool]) -> List[dict]:
+        """
+        Events for which predicate({"start": ..., "end": ...}) is true. Only the
+        start & end of the other events are expanded.
+        """
+        selected = []
+        for record in self.records.values():
+            times = {
+                "start": expand(record.get("start")) or {},
+                "end": expand(record.get("end")) or {},
+            }
+            if predicate(times):
+                selected.append(expand(record))
+        return selected
@@ -0,0 +1,283 @@
+"""
+Keeps the caches of the selected calendars warm by syncing them in the background,
+so notebook cells read from the cache instead of waiting on the network.
+
+Either as a thread in the notebook kernel:
+    start_sync_daemon(get_selected_calendars())
+or as a separate process, for the calendars picked in calendar_selection:
+    python -m calendar_ipynb.sync_daemon
+
+Each calendar is polled on its own interval, which halves after a sync that found
+changes and grows by half after one that found none. While the daemon is alive
+and keeps syncing a calendar successfully, events_incremental.fetch_events serves
+that calendar from the cache.
+
+Each daemon writes a heartbeat file of its own, named after its pid, holding the
+time of the last successful sync of every calendar.
+"""
+
+import os
+import glob
+import json
+import heapq
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import pytz
+
+from .api_scheduler import PRIORITY_BACKGROUND, request_priority
+from .utils import get_temp_path
+
+logger = logging.getLogger(__name__)
+
+MIN_POLL_INTERVAL = timedelta(seconds=30)
+MAX_POLL_INTERVAL = timedelta(minutes=15)
+
+# The daemon rewrites its heartbeat this often, from a thread of its own so a long
+# sync doesn't stall it. A heartbeat older than twice this is from a daemon that
+# is gone.
+HEARTBEAT_INTERVAL = timedelta(seconds=30)
+
+_daemon = None
+_daemon_lock = threading.Lock()
+
+# Heartbeat path -> (mtime_ns, heartbeat) of the last read
+_heartbeat_cache: Dict[str, tuple] = dict()
+
+
+class SyncDaemon(threading.Thread):
+    def __init__(
+        self,
+        email_map: Dict[str, List[str]],
+        min_interval: timedelta = MIN_POLL_INTERVAL,
+        max_interval: timedelta = MAX_POLL_INTERVAL,
+    ):
+        super().__init__(name="calendar-sync-daemon", daemon=True)
+        self.min_interval = min_interval.total_seconds()
+        self.max_interval = max_interval.total_seconds()
+        self.stopped = threading.Event()
+
+        calendars = [
+            (email, calendar)
+            for email, calendar_ids in email_map.items()
+            for calendar in calendar_ids
+        ]
+        self.intervals = {calendar: self.min_interval for calendar in calendars}
+        # (due, email, calendarId), all due right away
+        self.queue = [(0, email, calendar) for email, calendar in calendars]
+        # Calendar -> epoch seconds of its last successful sync
+        self.synced = dict()
+        self.synced_lock = threading.Lock()
+        self.heartbeat = threading.Thread(
+            target=self.run_heartbeat, name="calendar-sync-heartbeat", daemon=True
+        )
+
+    def run(self):
+        from .events_incremental import sync_events
+
+        logger.info(f"Sync daemon started for {len(self.intervals)} calendars")
+        _remove_stale_heartbeats()
+        self.heartbeat.start()
+        try:
+            with request_priority(PRIORITY_BACKGROUND):
+                while not self.stopped.is_set():
+                    if not self.queue:
+                        self.stopped.wait()
+                        continue
+
+                    wait = self.queue[0][0] - time.monotonic()
+                    if wait > 0:
+                        self.stopped.wait(wait)
+                        continue
+
+                    _, email, calendar = heapq.heappop(self.queue)
+                    interval = self.sync_calendar(sync_events, email, calendar)
+                    heapq.heappush(
+                        self.queue, (time.monotonic() + interval, email, calendar)
+                    )
+        finally:
+            self.stopped.set()
+            self.heartbeat.join()
+            _remove_heartbeat()
+            logger.info("Sync daemon stopped")
+
+    def run_heartbeat(self):
+        while not self.stopped.is_set():
+            self.write_heartbeat()
+            self.stopped.wait(HEARTBEAT_INTERVAL.total_seconds())
+
+    def sync_calendar(self, sync_events, email: str, calendar: str) -> float:
+        """
+        Syncs the calendar and returns the seconds until its next sync
+        """
+        key = (email, calendar)
+        try:
+            data = sync_events(email, calendar, max_staleness=timedelta(0))
+        except Exception as e:
+            logger.warning(f"Background sync of {email}/{calendar} failed: {e}")
+            self.intervals[key] = min(self.max_interval, self.intervals[key] * 2)
+            return self.intervals[key]
+
+        if data.last_change_count:
+            self.intervals[key] = max(self.min_interval, self.intervals[key] / 2)
+        else:
+            self.intervals[key] = min(self.max_interval, self.intervals[key] * 1.5)
+        with self.synced_lock:
+            self.synced[key] = time.time()
+        logger.debug(
+            f"{email}/{calendar}: {data.last_change_count} changes, "
+            f"next sync in {self.intervals[key]:.0f}s"
+        )
+        return self.intervals[key]
+
+    def write_heartbeat(self):
+        with self.synced_lock:
+            calendars = [
+                [*key, last_success] for key, last_success in self.synced.items()
+            ]
+        heartbeat = {
+            "pid": os.getpid(),
+            "heartbeat": datetime.now(tz=pytz.UTC).isoformat(),
+            "max_interval": self.max_interval,
+            "calendars": calendars,
+        }
+        path = _get_heartbeat_path(os.getpid())
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(heartbeat, f)
+        os.replace(f"{path}.tmp", path)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def start_sync_daemon(
+    email_map: Dict[str, List[str]],
+    min_interval: timedelta = MIN_POLL_INTERVAL,
+    max_interval: timedelta = MAX_POLL_INTERVAL,
+) -> SyncDaemon:
+    """
+    Starts syncing the calendars in a background thread of this process,
+    replacing the daemon started before, if any.
+    """
+    global _daemon
+
+    with _daemon_lock:
+        if _daemon is not None:
+            _daemon.stop()
+        _daemon = SyncDaemon(email_map, min_interval, max_interval)
+        _daemon.start()
+        return _daemon
+
+
+def stop_sync_daemon():
+    global _daemon
+
+    with _daemon_lock:
+        if _daemon is not None:
+            _daemon.stop()
+            _daemon = None
+
+
+def is_synced_in_background(email: str, calendarId: str) -> bool:
+    """
+    Whether a live daemon, in this process or another one, synced the calendar
+    successfully within its longest poll interval
+    """
+    now = time.time()
+    for path in glob.glob(_get_heartbeat_path("*")):
+        heartbeat = _read_heartbeat(path)
+        if heartbeat is None:
+            continue
+
+        mtime, max_interval, calendars = heartbeat
+        if now - mtime > 2 * HEARTBEAT_INTERVAL.total_seconds():
+            continue
+        last_success = calendars.get((email, calendarId))
+        # A sync may be running when the interval is up, allow for a heartbeat
+        if last_success is not None and now - last_success < (
+            max_interval + 2 * HEARTBEAT_INTERVAL.total_seconds()
+        ):
+            return True
+    return False
+
+
+def _read_heartbeat(path: str):
+    """
+    (mtime, max_interval, calendar -> last success) of a heartbeat, None if it is
+    gone or half written
+    """
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+
+    # Heartbeats are rewritten every few seconds, only parse the ones we missed
+    cached = _heartbeat_cache.get(path)
+    if cached is None or cached[0] != stat.st_mtime_ns:
+        try:
+            with open(path, "r") as f:
+                heartbeat = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        cached = (
+            stat.st_mtime_ns,
+            heartbeat.get("max_interval", MAX_POLL_INTERVAL.total_seconds()),
+            {
+                (email, calendar): last_success
+                for email, calendar, last_success in heartbeat["calendars"]
+            },
+        )
+        _heartbeat_cache[path] = cached
+
+    return (stat.st_mtime, *cached[1:])
+
+
+def _get_heartbeat_path(pid) -> str:
+    os.makedirs(get_temp_path("all_events"), exist_ok=True)
+
+    return get_temp_path(f"all_events/sync_daemon.{pid}.json")
+
+
+def _remove_stale_heartbeats():
+    """
+    Heartbeats left behind by daemons that were killed
+    """
+    for path in glob.glob(_get_heartbeat_path("*")):
+        try:
+            if time.time() - os.stat(path).st_mtime > 2 * (
+                HEARTBEAT_INTERVAL.total_seconds()
+            ):
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _remove_heartbeat():
+    try:
+        os.remove(_get_heartbeat_path(os.getpid()))
+    except FileNotFoundError:
+        pass
+
+
+def main():
+    from .ipywidgets.calendar_selection import get_selection_from_cache
+
+    email_map = get_selection_from_cache()
+    if not email_map:
+        raise SystemExit("No calendars selected, pick them in main.ipynb first")
+
+    daemon = SyncDaemon(email_map)
+    daemon.start()
+    try:
+        while daemon.is_alive():
+            daemon.join(timeout=1)
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+The adaptive concurrency limit of api_scheduler, with fake requests
+"""
+
+import asyncio
+import socket
+import threading
+import time
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from calendar_ipynb import api_scheduler
+from calendar_ipynb.api_scheduler import (
+    PRIORITY_BACKFILL,
+    PRIORITY_INTERACTIVE,
+    ApiScheduler,
+    ConcurrencyLimiter,
+    is_retryable_error,
+)
+
+
+class FakeRequest:
+    def __init__(self, latency: float, errors: list = ()):
+        self.latency = latency
+        self.errors = list(errors)
+
+    def execute(self):
+        time.sleep(self.latency)
+        if self.errors:
+            raise self.errors.pop(0)
+        return {}
+
+
+def http_error(status: int, reason: str = "") -> HttpError:
+    content = f'{{"error": {{"errors": [{{"reason": "{reason}"}}]}}}}'
+    return HttpError(httplib2.Response({"status": status}), content.encode())
+
+
+@mock.patch.object(api_scheduler, "ACCOUNT_REQUESTS_PER_SECOND", 10000)
+@mock.patch.object(api_scheduler, "ACCOUNT_BURST", 1000)
+@mock.patch.object(api_scheduler, "get_backoff_delay", lambda attempt: 0)
+class ConcurrencyLimiterTest(unittest.TestCase):
+    def test_mixed_latencies(self):
+        # Cheap lookups next to full pages & batches are not congestion
+        scheduler = ApiScheduler()
+        initial = scheduler.limiter.limit
+        for i in range(40):
+            scheduler.execute("me", FakeRequest(0.001 if i % 3 else 0.03))
+        self.assertGreater(scheduler.limiter.limit, initial)
+
+    def test_rate_limited(self):
+        scheduler = ApiScheduler()
+        initial = scheduler.limiter.limit
+        request = FakeRequest(0, [http_error(403, "rateLimitExceeded")])
+        scheduler.execute("me", request)
+        # Halved, then grown back a little by the retry
+        self.assertLess(scheduler.limiter.limit, initial / 2 + 1)
+
+        # Recovers once requests succeed again
+        for _ in range(100):
+            scheduler.execute("me", FakeRequest(0))
+        self.assertGreater(scheduler.limiter.limit, initial)
+
+    def test_server_errors_keep_the_limit(self):
+        scheduler = ApiScheduler()
+        initial = scheduler.limiter.limit
+        scheduler.execute("me", FakeRequest(0, [http_error(503)]))
+        self.assertGreaterEqual(scheduler.limiter.limit, initial)
+
+    def test_batch_cost_per_account(self):
+        scheduler = ApiScheduler()
+        scheduler.execute("a", FakeRequest(0), cost={"a": 1, "b": 2})
+        self.assertEqual(scheduler.get_bucket("a").tokens, 999)
+        self.assertEqual(scheduler.get_bucket("b").tokens, 998)
+
+    def test_permanent_errors_raise(self):
+        scheduler = ApiScheduler()
+        request = FakeRequest(0, [http_error(403, "forbidden")])
+        with self.assertRaises(HttpError):
+            scheduler.execute("me", request)
+        self.assertEqual(request.errors, [])
+
+    def test_coroutines_share_the_queue(self):
+        limiter = ConcurrencyLimiter(1, 1, 1)
+        served = []
+
+        async def request(name: str, priority: int):
+            await limiter.acquire_async(priority)
+            served.append(name)
+            await asyncio.sleep(0.01)
+            limiter.release(False)
+
+        async def main():
+            limiter.acquire(PRIORITY_INTERACTIVE)
+            tasks = [
+                asyncio.create_task(request("backfill", PRIORITY_BACKFILL)),
+                asyncio.create_task(request("interactive", PRIORITY_INTERACTIVE)),
+            ]
+            await asyncio.sleep(0.01)
+            self.assertEqual(served, [])
+
+            # Released by a thread of the threaded engine
+            thread = threading.Thread(target=limiter.release, args=(False,))
+            thread.start()
+            await asyncio.gather(*tasks)
+            thread.join()
+
+        asyncio.run(main())
+        self.assertEqual(served, ["interactive", "backfill"])
+        self.assertEqual(limiter.in_flight, 0)
+
+
+class RetryableErrorTest(unittest.TestCase):
+    def test_transport_errors(self):
+        for error in [
+            ConnectionResetError(),
+            TimeoutError(),
+            socket.gaierror(),
+            httplib2.ServerNotFoundError(),
+        ]:
+            with self.subTest(error=type(error).__name__):
+                self.assertTrue(is_retryable_error(error))
+
+    def test_local_errors(self):
+        for error in [FileNotFoundError(), PermissionError(), ValueError()]:
+            with self.subTest(error=type(error).__name__):
+                self.assertFalse(is_retryable_error(error))
@@ -0,0 +1,64 @@
+"""
+Cache files written with another codec, or damaged, see cache_codecs.py
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from calendar_ipynb import cache_codecs
+from calendar_ipynb.cache_codecs import (
+    CACHE_CODECS,
+    CorruptCacheError,
+    get_cache_codec,
+    read_cache_file,
+    remove_cache_file,
+)
+
+DATA = {
+    "sync_token": "token",
+    "events": [{"id": "a", "start": {"date": "2025-01-01"}}, {"id": "b"}],
+}
+
+
+class CacheCodecsTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.stem = os.path.join(temp_dir.name, "cache")
+
+    def test_round_trip(self):
+        for name, codec in CACHE_CODECS.items():
+            with self.subTest(codec=name):
+                codec.write(self.stem, DATA)
+                self.assertEqual(codec.read(self.stem), DATA)
+
+    def test_migration(self):
+        for name, codec in CACHE_CODECS.items():
+            for current in CACHE_CODECS:
+                if current == name:
+                    continue
+                with self.subTest(written=name, current=current), mock.patch.object(
+                    cache_codecs, "CACHE_CODEC", current
+                ):
+                    codec.write(self.stem, DATA)
+                    self.assertEqual(read_cache_file(self.stem), DATA)
+                    # Rewritten with the current codec, the old file is gone
+                    self.assertFalse(os.path.exists(codec.get_path(self.stem)))
+                    self.assertEqual(get_cache_codec().read(self.stem), DATA)
+                    remove_cache_file(self.stem)
+
+    def test_corrupt(self):
+        for name, codec in CACHE_CODECS.items():
+            for content in [b"", b"\x00garbage", pickle.dumps(DATA)]:
+                with self.subTest(codec=name, content=content[:8]):
+                    with open(codec.get_path(self.stem), "wb") as f:
+                        f.write(content)
+                    with self.assertRaises(CorruptCacheError):
+                        codec.read(self.stem)
+
+    def test_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            read_cache_file(self.stem)
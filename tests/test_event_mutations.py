@@ -0,0 +1,139 @@
+"""
+Retries of event_mutations, against a fake batch API
+"""
+
+import unittest
+from unittest import mock
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from calendar_ipynb import event_mutations
+from calendar_ipynb.event_mutations import EventMutation, execute_mutations
+
+
+def http_error(status: int) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+class FakeRequest:
+    def __init__(self, op: str, event_id: str = None, body: dict = None):
+        self.op = op
+        self.event_id = event_id
+        self.body = body
+
+
+class FakeEvents:
+    def insert(self, calendarId, body):
+        return FakeRequest("insert", body=body)
+
+    def patch(self, calendarId, eventId, body):
+        return FakeRequest("patch", eventId, body)
+
+
+class FakeCalendarApi:
+    """
+    Stores inserted events by id. `batch_errors` are raised by the batches in
+    turn, after their sub-requests were applied, as if the response was lost.
+    `errors` fail the sub-requests of the given event ids.
+    """
+
+    def __init__(self, batch_errors: list = (), errors: dict = None):
+        self.events = dict()
+        self.batch_errors = list(batch_errors)
+        self.errors = errors or dict()
+        self.batches = 0
+
+    def execute(self, request: FakeRequest):
+        if request.op == "insert":
+            if request.body["id"] in self.events:
+                return None, http_error(409)
+            self.events[request.body["id"]] = request.body
+            return request.body, None
+
+        if request.event_id in self.errors:
+            return None, self.errors[request.event_id]
+        return {"id": request.event_id, **request.body}, None
+
+    def events_service(self):
+        return FakeEvents()
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+class FakeBatch:
+    def __init__(self, api: FakeCalendarApi, callback):
+        self.api = api
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str):
+        self.requests.append((request, request_id))
+
+    def execute(self):
+        self.api.batches += 1
+        responses = [
+            (request_id, *self.api.execute(request))
+            for request, request_id in self.requests
+        ]
+        if self.api.batch_errors:
+            raise self.api.batch_errors.pop(0)
+        for response in responses:
+            self.callback(*response)
+
+
+class ExecuteMutationsTest(unittest.TestCase):
+    def execute(self, api: FakeCalendarApi, mutations: list) -> list:
+        service = mock.Mock()
+        service.events = api.events_service
+        service.new_batch_http_request = api.new_batch_http_request
+        with mock.patch.object(
+            event_mutations, "get_calendar_service", lambda email: service
+        ), mock.patch.object(
+            event_mutations,
+            "execute_request",
+            lambda email, request, **kwargs: request.execute(),
+        ), mock.patch.object(
+            event_mutations, "get_backoff_delay", lambda attempt: 0
+        ):
+            return execute_mutations(mutations)
+
+    def insert(self, summary: str) -> EventMutation:
+        return EventMutation(
+            op="insert", email="me", calendar_id="c", body={"summary": summary}
+        )
+
+    def test_lost_insert_response_is_not_duplicated(self):
+        api = FakeCalendarApi(batch_errors=[TimeoutError("lost")])
+        results = self.execute(api, [self.insert("A"), self.insert("B")])
+
+        self.assertEqual(len(api.events), 2)
+        self.assertEqual(api.batches, 2)
+        for result in results:
+            self.assertIsNone(result["error"])
+            self.assertEqual(result["response"]["id"], result["mutation"]["body"]["id"])
+
+    def test_conflict_on_first_attempt_is_an_error(self):
+        api = FakeCalendarApi()
+        mutation = self.insert("A")
+        mutation["body"]["id"] = "taken"
+        api.events["taken"] = {"id": "taken"}
+
+        (result,) = self.execute(api, [mutation])
+        self.assertEqual(result["error"].resp.status, 409)
+
+    def test_retryable_sub_request(self):
+        api = FakeCalendarApi(errors={"x": http_error(503)})
+        patch = EventMutation(
+            op="patch", email="me", calendar_id="c", event_id="x", body={}
+        )
+        (result,) = self.execute(api, [patch])
+        self.assertEqual(result["error"].resp.status, 503)
+        self.assertEqual(api.batches, event_mutations.MAX_RETRIES + 1)
+
+    def test_permanent_batch_error_is_not_retried(self):
+        api = FakeCalendarApi(batch_errors=[http_error(401)])
+        (result,) = self.execute(api, [self.insert("A")])
+        self.assertEqual(result["error"].resp.status, 401)
+        self.assertEqual(api.batches, 1)
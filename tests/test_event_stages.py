@@ -0,0 +1,79 @@
+"""
+The public stages of events.py, called with plain event dicts like the callers
+from before event_views
+"""
+
+import copy
+import unittest
+from datetime import datetime, timezone
+
+from calendar_ipynb import events
+
+
+def make_event(summary: str, start: str, end: str, **fields) -> dict:
+    return {
+        "summary": summary,
+        "start": {"dateTime": start, "timeZone": "UTC"},
+        "end": {"dateTime": end, "timeZone": "UTC"},
+        **fields,
+    }
+
+
+class PlainDictStagesTest(unittest.TestCase):
+    def setUp(self):
+        self.events = [
+            make_event("B", "2025-01-01T10:00:00+00:00", "2025-01-01T11:00:00+00:00"),
+            make_event("A", "2025-01-01T09:00:00+00:00", "2025-01-01T10:30:00+00:00"),
+            make_event(
+                "Overnight", "2025-01-01T23:00:00+00:00", "2025-01-02T01:00:00+00:00"
+            ),
+        ]
+        self.original = copy.deepcopy(self.events)
+
+    def tearDown(self):
+        # The fetched dicts are never modified
+        self.assertEqual(self.events, self.original)
+
+    def with_durations(self) -> list:
+        return [
+            {**event, "duration_min": duration}
+            for event, duration in zip(self.events, [60, 90, 120])
+        ]
+
+    def test_add_duration_minutes(self):
+        result = events.add_duration_minutes(self.events)
+        self.assertEqual([x["duration_min"] for x in result], [60, 90, 120])
+
+    def test_filter_out_future_events(self):
+        to_datetime = datetime(2025, 1, 1, 10, 15, tzinfo=timezone.utc)
+        result = events.filter_out_future_events(self.with_durations(), to_datetime)
+        self.assertEqual(
+            [(x["summary"], x["duration_min"]) for x in result], [("B", 15), ("A", 75)]
+        )
+
+    def test_filter_out_past_events(self):
+        from_datetime = datetime(2025, 1, 1, 10, 45, tzinfo=timezone.utc)
+        result = events.filter_out_past_events(from_datetime, self.with_durations())
+        self.assertEqual([x["summary"] for x in result], ["B", "Overnight"])
+        self.assertEqual(result[0]["start"]["dateTime"], from_datetime.isoformat())
+        self.assertEqual(result[0]["duration_min"], 15)
+
+    def test_breakdown_overnight_events(self):
+        result = events.breakdown_overnight_events(self.with_durations())
+        self.assertEqual(
+            [(x["summary"], x["duration_min"]) for x in result],
+            [("B", 60), ("A", 90), ("Overnight", 60), ("Overnight", 60)],
+        )
+
+    def test_handle_overlapping_event_durations(self):
+        result = events.handle_overlapping_event_durations(self.with_durations())
+        # A & B share 10:00-10:30
+        self.assertEqual([x["duration_min"] for x in result], [45, 75, 120])
+
+    def test_sort_events(self):
+        result = events.sort_events(self.with_durations())
+        self.assertEqual([x["summary"] for x in result], ["A", "B", "Overnight"])
+
+    def test_insert_untracked_times(self):
+        result = events.insert_untracked_times(self.with_durations()[:2])
+        self.assertEqual(result[0]["summary"], "1290 min | Untracked")
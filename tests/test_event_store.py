@@ -0,0 +1,199 @@
+"""
+Recovery paths of the event stores, on caches in a temporary directory
+"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from calendar_ipynb import event_store, events_incremental
+from calendar_ipynb.cache_codecs import get_cache_file_path
+
+
+def make_event(event_id: str, day: str, summary: str = "Meeting") -> dict:
+    return {
+        "id": event_id,
+        "status": "confirmed",
+        "summary": summary,
+        "start": {"dateTime": f"{day}T10:00:00+00:00"},
+        "end": {"dateTime": f"{day}T11:00:00+00:00"},
+    }
+
+
+class EventStoreTestCase(unittest.TestCase):
+    backend = None
+
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        self.temp_dir = temp_dir.name
+
+        def get_temp_path(filename: str):
+            return f"{temp_dir.name}/{filename}"
+
+        for module in ["event_store", "sync_daemon"]:
+            patcher = mock.patch(
+                f"calendar_ipynb.{module}.get_temp_path", get_temp_path
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch.object(events_incremental, "CACHE_BACKEND", self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        events_incremental.invalidate_data_caches()
+        self.addCleanup(events_incremental.invalidate_data_caches)
+
+    @property
+    def store(self):
+        return event_store.get_event_store(self.backend)
+
+    def save(self, events: list, sync_token: str = "token"):
+        data = self.store.load("me", "cal")
+        for event in events:
+            data.events[event["id"]] = event
+        data.sync_token = sync_token
+        data.last_sync = datetime.now(tz=timezone.utc)
+        self.store.save(data)
+        return data
+
+
+class JournalEventStoreTest(EventStoreTestCase):
+    backend = "journal"
+
+    def setUp(self):
+        super().setUp()
+        self.journal_store = event_store.JournalEventStore(checkpoint_every=3)
+
+    @property
+    def store(self):
+        return self.journal_store
+
+    def get_journal_path(self) -> str:
+        return event_store.get_data_cache_path("me", "cal", "journal")
+
+    def test_torn_line(self):
+        self.save([make_event(x, "2025-01-10") for x in "abc"], "t1")
+        self.save([make_event("d", "2025-01-11")], "t2")
+        with open(self.get_journal_path(), "a") as f:
+            f.write('{"sync_token": "t3", "upserts": [{"id": "e"')
+
+        data = self.store.load("me", "cal")
+        self.assertEqual(data.sync_token, "t2")
+        self.assertEqual(sorted(data.events), ["a", "b", "c", "d"])
+
+        # The next save checkpoints, dropping the torn line
+        data.sync_token = "t3"
+        self.store.save(data)
+        self.assertFalse(os.path.exists(self.get_journal_path()))
+        data = self.store.load("me", "cal")
+        self.assertEqual(data.sync_token, "t3")
+        self.assertEqual(sorted(data.events), ["a", "b", "c", "d"])
+
+    def test_checkpoint_interrupted_before_removing_the_journal(self):
+        data = self.save([make_event(x, "2025-01-10") for x in "abc"], "t1")
+        del data.events["a"]
+        data.sync_token = "t2"
+        self.store.save(data)
+        with open(self.get_journal_path(), "r") as f:
+            journal = f.read()
+
+        data.events["e"] = make_event("e", "2025-01-12")
+        data.sync_token = "t3"
+        self.store.checkpoint(data)
+        # Crash before the journal was removed
+        with open(self.get_journal_path(), "w") as f:
+            f.write(journal)
+
+        data = self.store.load("me", "cal")
+        self.assertEqual(sorted(data.events), ["b", "c", "e"])
+        # Rolled back to a token the next sync catches up from
+        self.assertEqual(data.sync_token, "t2")
+
+    def test_checkpoint_every(self):
+        self.save([make_event(x, "2025-01-10") for x in "abcdefgh"], "t0")
+        for i in range(1, 5):
+            self.save([make_event("a", "2025-01-10", f"Edit {i}")], f"t{i}")
+
+        # 3 entries, then folded into the base by the 4th save
+        self.assertFalse(os.path.exists(self.get_journal_path()))
+        data = self.store.load("me", "cal")
+        self.assertEqual(data.events["a"]["summary"], "Edit 4")
+        self.assertEqual(data.sync_token, "t4")
+
+
+class SegmentedEventStoreTest(EventStoreTestCase):
+    backend = "segments"
+
+    def corrupt(self, name: str):
+        segments_dir = event_store.get_data_cache_path("me", "cal", "segments")
+        with open(get_cache_file_path(f"{segments_dir}/{name}"), "wb") as f:
+            f.write(b"\x00 not a cache")
+
+    def query(self, data, from_day: str, to_day: str) -> list:
+        return self.store.query(
+            data,
+            datetime.fromisoformat(f"{from_day}T00:00:00+00:00"),
+            datetime.fromisoformat(f"{to_day}T00:00:00+00:00"),
+        )
+
+    def test_month_move(self):
+        self.save([make_event("a", "2025-01-10"), make_event("b", "2025-01-20")])
+        self.save([make_event("a", "2025-03-05", "Moved")])
+
+        data = self.store.load("me", "cal")
+        self.assertEqual(sorted(data.events.segment_ends), ["2025-01", "2025-03"])
+        self.assertEqual(data.events["a"]["summary"], "Moved")
+        self.assertEqual(
+            [x["id"] for x in self.query(data, "2025-01-01", "2025-01-31")], ["b"]
+        )
+        self.assertEqual(
+            [x["id"] for x in self.query(data, "2025-03-01", "2025-03-31")], ["a"]
+        )
+
+        # The emptied segment is removed along with its month
+        del data.events["b"]
+        self.store.save(data)
+        data = self.store.load("me", "cal")
+        self.assertEqual(list(data.events.segment_ends), ["2025-03"])
+        self.assertEqual(list(data.events), ["a"])
+
+    def test_corrupt_segment_resyncs(self):
+        server = [make_event("a", "2025-01-10"), make_event("b", "2025-02-10")]
+        self.save(server)
+        self.corrupt("2025-02")
+        events_incremental.invalidate_data_caches()
+
+        def sync_events(email, calendarId, max_staleness=None, offline=None):
+            data = events_incremental._get_data_cache(email, calendarId)
+            if data.sync_token:
+                # Fresh, the corrupt segment is only read by the query
+                return data
+            for event in server:
+                data.events[event["id"]] = event
+            data.sync_token = "new token"
+            data.last_sync = datetime.now(tz=timezone.utc)
+            events_incremental._update_data_cache(data)
+            return data
+
+        with mock.patch.object(events_incremental, "sync_events", sync_events):
+            fetched = events_incremental.fetch_events(
+                "me",
+                "cal",
+                datetime(2025, 1, 1, tzinfo=timezone.utc),
+                datetime(2025, 3, 1, tzinfo=timezone.utc),
+                offline=False,
+            )
+        self.assertEqual(sorted(event["id"] for event in fetched), ["a", "b"])
+
+    def test_corrupt_manifest_starts_over(self):
+        self.save([make_event("a", "2025-01-10")])
+        segments_dir = event_store.get_data_cache_path("me", "cal", "segments")
+        with open(f"{segments_dir}/manifest.json", "w") as f:
+            f.write('{"sync_token": "tok')
+
+        data = self.store.load("me", "cal")
+        self.assertEqual(data.sync_token, "")
+        self.assertEqual(len(data.events), 0)
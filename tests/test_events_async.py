@@ -0,0 +1,173 @@
+"""
+The asyncio engine of events_async, against a fake Calendar API
+"""
+
+import asyncio
+import functools
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import httpx
+
+from calendar_ipynb import api_scheduler, events_async, events_incremental
+from calendar_ipynb.events_async import AsyncCalendarApi, fetch_events_async
+from tests.test_event_store import EventStoreTestCase
+
+
+def make_event(event_id: str, start: datetime) -> dict:
+    return {
+        "id": event_id,
+        "status": "confirmed",
+        "summary": event_id,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+    }
+
+
+class FakeCalendarApi:
+    """
+    events.list of calendars holding `events`, failing every request of the
+    calendars in `broken` with `broken_status`
+    """
+
+    def __init__(self, events: list, broken: tuple = (), broken_status: int = 503):
+        self.events = events
+        self.broken = broken
+        self.broken_status = broken_status
+        self.transport_errors = 0
+        self.requests = []
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        params = dict(request.url.params)
+        self.requests.append(params)
+        if self.transport_errors:
+            self.transport_errors -= 1
+            raise httpx.ConnectError("Connection reset", request=request)
+        if any(f"/{calendar}/" in request.url.path for calendar in self.broken):
+            return httpx.Response(self.broken_status, json={"error": {}})
+
+        if params.get("fields") == "nextPageToken,nextSyncToken":
+            return httpx.Response(200, json={"nextSyncToken": "initial"})
+        if params.get("orderBy") == "startTime":
+            first = min(self.events, key=lambda x: x["start"]["dateTime"])
+            return httpx.Response(200, json={"items": [{"start": first["start"]}]})
+        if "syncToken" in params:
+            return httpx.Response(200, json={"items": [], "nextSyncToken": "next"})
+
+        time_min = datetime.fromisoformat(params["timeMin"])
+        time_max = datetime.fromisoformat(
+            params.get("timeMax", "9999-01-01T00:00:00+00:00")
+        )
+        items = [
+            event
+            for event in self.events
+            if datetime.fromisoformat(event["end"]["dateTime"]) > time_min
+            and datetime.fromisoformat(event["start"]["dateTime"]) < time_max
+        ]
+        return httpx.Response(200, json={"items": items})
+
+
+async def get_headers(self, email: str, refresh: bool = False) -> dict:
+    return {}
+
+
+@mock.patch.object(api_scheduler, "ACCOUNT_REQUESTS_PER_SECOND", 10000)
+@mock.patch.object(api_scheduler, "ACCOUNT_BURST", 1000)
+@mock.patch.object(events_async, "get_backoff_delay", lambda attempt: 0)
+@mock.patch.object(AsyncCalendarApi, "get_headers", get_headers)
+# The threaded engine is not used
+@mock.patch.object(events_incremental, "_list_window_events", None)
+@mock.patch.object(events_incremental, "sync_events", None)
+class EventsAsyncTest(EventStoreTestCase):
+    backend = "sqlite"
+
+    def setUp(self):
+        super().setUp()
+        self.now = datetime.now(tz=timezone.utc).replace(microsecond=0)
+        self.events = [
+            make_event("upcoming", self.now + timedelta(days=5)),
+            make_event("recent", self.now - timedelta(days=10)),
+            make_event("older", self.now - timedelta(days=200)),
+            make_event("oldest", self.now - timedelta(days=400)),
+        ]
+        patcher = mock.patch.object(api_scheduler, "_scheduler", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch(self, server: FakeCalendarApi, calendar_id: str = "cal") -> list:
+        async def fetch():
+            transport = httpx.MockTransport(server)
+            async with httpx.AsyncClient(transport=transport) as client:
+                return await fetch_events_async(
+                    AsyncCalendarApi(client),
+                    "me",
+                    calendar_id,
+                    self.now - timedelta(days=500),
+                    self.now + timedelta(days=30),
+                )
+
+        return asyncio.run(fetch())
+
+    def fetch_parallel(self, server: FakeCalendarApi, calendars: list) -> list:
+        client = functools.partial(
+            httpx.AsyncClient, transport=httpx.MockTransport(server)
+        )
+        with mock.patch.object(events_async.httpx, "AsyncClient", client):
+            return asyncio.run(
+                events_async.fetch_events_parallel_async(
+                    {"me": calendars},
+                    self.now - timedelta(days=500),
+                    self.now + timedelta(days=30),
+                )
+            )
+
+    def test_first_sync_backfills_in_windows(self):
+        server = FakeCalendarApi(self.events)
+        fetched = self.fetch(server)
+        self.assertEqual(
+            sorted(x["id"] for x in fetched), ["older", "oldest", "recent", "upcoming"]
+        )
+        windows = [x for x in server.requests if "timeMax" in x]
+        self.assertEqual(len(windows), 5)
+
+        data = events_incremental._get_data_cache("me", "cal")
+        self.assertEqual(data.sync_token, "initial")
+        self.assertEqual(data.history_start, "")
+
+        # Incremental from then on
+        server.requests.clear()
+        events_incremental.invalidate_data_caches()
+        with mock.patch.object(events_incremental, "MAX_STALENESS", timedelta(0)):
+            self.assertEqual(len(self.fetch(server)), 4)
+        self.assertEqual([x.get("syncToken") for x in server.requests], ["initial"])
+
+    def test_history_horizon(self):
+        server = FakeCalendarApi(self.events)
+        with mock.patch.object(
+            events_incremental, "HISTORY_HORIZON", timedelta(days=100)
+        ):
+            self.assertEqual(len(self.fetch(server)), 4)
+
+        # The query reached past the horizon, its history was loaded on demand
+        data = events_incremental._get_data_cache("me", "cal")
+        self.assertEqual(
+            data.history_start, (self.now - timedelta(days=501)).isoformat()
+        )
+
+    def test_transport_errors_are_retried(self):
+        server = FakeCalendarApi(self.events)
+        server.transport_errors = 2
+        self.assertEqual(len(self.fetch(server)), 4)
+
+    def test_failing_calendar_serves_its_cache(self):
+        self.save([make_event("cached", self.now - timedelta(days=1))])
+        server = FakeCalendarApi(self.events, broken=["cal"])
+        with mock.patch.object(events_incremental, "MAX_STALENESS", timedelta(0)):
+            fetched = self.fetch_parallel(server, ["cal", "other"])
+        self.assertEqual(len([x for x in fetched if x["id"] == "cached"]), 1)
+        self.assertEqual(len(fetched), 5)
+
+    def test_permanent_errors_raise(self):
+        server = FakeCalendarApi(self.events, broken=["cal"], broken_status=404)
+        with self.assertRaises(httpx.HTTPStatusError):
+            self.fetch_parallel(server, ["cal", "other"])
@@ -0,0 +1,219 @@
+"""
+The engines & modes of events.process_events_and_classify (numpy engine, day
+cache, process pool) must give the same events as the plain "dict" pipeline, on
+a few weeks of made up events.
+"""
+
+import io
+import json
+import random
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta
+from unittest import mock
+from zoneinfo import ZoneInfo
+
+from calendar_ipynb import events
+
+PREFERENCES = {
+    "sleep": {"start_marker": "^Sleep", "end_marker": "^Wake", "daily_sleep_hours": 8},
+    "categories": {
+        "work": {
+            "title": "Work",
+            "is_productive": True,
+            "patterns": [{"regex": "^Meeting"}],
+            "children": {"deep": {"title": "Deep", "patterns": [{"regex": "^Focus"}]}},
+        },
+        "life": {
+            "title": "Life",
+            "patterns": [{"regex": "^(Lunch|Gym)"}, {"calendarId": ["personal"]}],
+        },
+    },
+}
+
+TIME_ZONES = ["UTC", "Asia/Kolkata", "America/New_York"]
+SEEDS = [1, 2, 3]
+DAYS = 40
+END = datetime(2025, 6, 30)
+
+
+def make_events(seed: int, time_zone: str) -> list:
+    """
+    Events of a busy calendar, with all-day & overnight events, and sleep
+    markers both before and after midnight
+    """
+    rng = random.Random(seed)
+    tz = ZoneInfo(time_zone)
+    made = []
+
+    def add(summary, start, end, calendar="work", event_type="default"):
+        made.append(
+            {
+                "id": f"event{len(made)}",
+                "status": "confirmed",
+                "summary": summary,
+                "eventType": event_type,
+                "calendar_id": calendar,
+                "email": "me@example.com",
+                "start": {"dateTime": start.isoformat(), "timeZone": time_zone},
+                "end": {"dateTime": end.isoformat(), "timeZone": time_zone},
+            }
+        )
+
+    for d in range(DAYS):
+        day = END - timedelta(days=DAYS - d)
+        midnight = datetime(day.year, day.month, day.day, tzinfo=tz)
+        if rng.random() < 0.7:
+            start = midnight + timedelta(hours=6, minutes=rng.randrange(0, 120, 15))
+            add("Wake up", start, start + timedelta(minutes=15), "personal")
+        for _ in range(12):
+            start = midnight + timedelta(
+                hours=rng.randrange(7, 22), minutes=rng.choice([0, 15, 30, 45])
+            )
+            add(
+                rng.choice(["Meeting X", "Focus", "Lunch", "Gym", "Random"]),
+                start,
+                start + timedelta(minutes=rng.choice([15, 30, 45, 60, 90, 120])),
+                rng.choice(["work", "personal"]),
+                rng.choice(["default"] * 8 + ["fromGmail", "focusTime"]),
+            )
+        if rng.random() < 0.3:
+            made.append(
+                {
+                    "id": f"event{len(made)}",
+                    "summary": "Holiday",
+                    "eventType": "default",
+                    "start": {"date": day.date().isoformat()},
+                    "end": {"date": (day.date() + timedelta(days=1)).isoformat()},
+                }
+            )
+        if rng.random() < 0.6:
+            # Before or after midnight
+            start = midnight + timedelta(hours=rng.choice([22, 23, 25, 26]))
+            add("Sleep", start, start + timedelta(minutes=30), "personal")
+        # Sleep inference fails on the UTC halves breakdown_overnight_events makes
+        # of overnight events in other time zones
+        if time_zone == "UTC" and rng.random() < 0.2:
+            start = midnight + timedelta(hours=23)
+            add("Late Meeting X", start, start + timedelta(hours=2))
+
+    rng.shuffle(made)
+    return made
+
+
+class PipelineEquivalenceTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+        with open(f"{temp_dir.name}/user_preferences.json", "w") as f:
+            json.dump(PREFERENCES, f)
+
+        def get_temp_path(filename: str):
+            return f"{temp_dir.name}/{filename}"
+
+        for module in ["meta", "events_day_cache"]:
+            patcher = mock.patch(
+                f"calendar_ipynb.{module}.get_temp_path", get_temp_path
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        patcher = mock.patch("calendar_ipynb.events_day_cache._day_cache", None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, fetched: list, time_zone: str, **kwargs) -> str:
+        tz = ZoneInfo(time_zone)
+        with redirect_stdout(io.StringIO()):
+            processed = events.process_events_and_classify(
+                fetched,
+                from_datetime=(END - timedelta(days=DAYS - 3)).replace(tzinfo=tz),
+                to_datetime=(END - timedelta(days=2)).replace(tzinfo=tz),
+                **kwargs,
+            )
+        return json.dumps(processed, sort_keys=True, default=str, indent=1)
+
+    def assert_same_as_dict(self, **kwargs):
+        for time_zone in TIME_ZONES:
+            for seed in SEEDS:
+                with self.subTest(time_zone=time_zone, seed=seed):
+                    fetched = make_events(seed, time_zone)
+                    expected = self.process(fetched, time_zone, day_cache=False)
+                    self.assertEqual(
+                        self.process(fetched, time_zone, **kwargs), expected
+                    )
+
+    def test_numpy_engine(self):
+        self.assert_same_as_dict(engine="numpy")
+
+    def test_day_cache(self):
+        # Cold, then served from the cache, then from its file
+        self.assert_same_as_dict(day_cache=True)
+        self.assert_same_as_dict(day_cache=True)
+        with mock.patch("calendar_ipynb.events_day_cache._day_cache", None):
+            self.assert_same_as_dict(day_cache=True)
+
+    def test_day_cache_after_change(self):
+        time_zone = "UTC"
+        fetched = make_events(1, time_zone)
+        self.process(fetched, time_zone, day_cache=True)
+
+        changed = [{**event, "summary": "Meeting Z"} for event in fetched[:5]]
+        changed += fetched[5:]
+        self.assertEqual(
+            self.process(changed, time_zone, day_cache=True),
+            self.process(changed, time_zone, day_cache=False),
+        )
+
+    @mock.patch("calendar_ipynb.events_parallel.DAYS_PER_TASK", 3)
+    @mock.patch("calendar_ipynb.events_parallel.PARALLEL_MIN_EVENTS", 1)
+    def test_parallel(self):
+        self.assert_same_as_dict(day_cache=False, parallel=True)
+        self.assert_same_as_dict(day_cache=True, parallel=True)
+
+    def test_stream_order(self):
+        # Calendars synced in any order give the same events as in calendar order
+        time_zone = "UTC"
+        tz = ZoneInfo(time_zone)
+        fetched = make_events(1, time_zone)
+        calendars = ["work", "personal", None]
+        chunks = [
+            events.EventChunk(
+                [x for x in fetched if x.get("calendar_id") == calendar], i
+            )
+            for i, calendar in enumerate(calendars)
+        ]
+
+        expected = self.process(
+            [x for chunk in chunks for x in chunk], time_zone, day_cache=True
+        )
+        with redirect_stdout(io.StringIO()):
+            processed = events.process_event_stream(
+                reversed(chunks),
+                from_datetime=(END - timedelta(days=DAYS - 3)).replace(tzinfo=tz),
+                to_datetime=(END - timedelta(days=2)).replace(tzinfo=tz),
+                day_cache=True,
+            )
+        self.assertEqual(
+            json.dumps(processed, sort_keys=True, default=str, indent=1), expected
+        )
+
+    def test_events_without_time_zone(self):
+        time_zone = "Asia/Kolkata"
+        fetched = [
+            {
+                **event,
+                "start": {"dateTime": event["start"]["dateTime"]},
+                "end": {"dateTime": event["end"]["dateTime"]},
+            }
+            for event in make_events(1, time_zone)
+            if "dateTime" in event["start"]
+        ]
+        expected = self.process(fetched, time_zone, day_cache=False)
+        for event in json.loads(expected):
+            with self.subTest(event=event["summary"]):
+                start = datetime.fromisoformat(event["start"]["dateTime"])
+                self.assertIsNotNone(start.utcoffset())
+
+        self.assertEqual(self.process(fetched, time_zone, engine="numpy"), expected)
@@ -0,0 +1,90 @@
+"""
+Heartbeats of sync_daemon, and when fetch_events trusts them
+"""
+
+import json
+import os
+import tempfile
+import time
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from calendar_ipynb import events_incremental, sync_daemon
+from calendar_ipynb.sync_daemon import SyncDaemon, is_synced_in_background
+
+
+class FakeData:
+    last_change_count = 0
+
+
+class SyncDaemonTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(temp_dir.cleanup)
+
+        def get_temp_path(filename: str):
+            return f"{temp_dir.name}/{filename}"
+
+        patcher = mock.patch.object(sync_daemon, "get_temp_path", get_temp_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_heartbeat(self, pid: int, calendars: list, max_interval: float = 60):
+        path = sync_daemon._get_heartbeat_path(pid)
+        with open(path, "w") as f:
+            json.dump({"max_interval": max_interval, "calendars": calendars}, f)
+        return path
+
+    def test_failing_syncs(self):
+        # Alive, but the last success is older than the longest poll interval
+        self.write_heartbeat(1, [["me", "cal", time.time() - 600]])
+        self.assertFalse(is_synced_in_background("me", "cal"))
+
+        self.write_heartbeat(1, [["me", "cal", time.time() - 30]])
+        self.assertTrue(is_synced_in_background("me", "cal"))
+
+    def test_daemons_of_other_processes(self):
+        self.write_heartbeat(1, [["me", "work", time.time()]])
+        self.write_heartbeat(2, [["me", "home", time.time()]])
+        self.assertTrue(is_synced_in_background("me", "work"))
+        self.assertTrue(is_synced_in_background("me", "home"))
+        self.assertFalse(is_synced_in_background("me", "other"))
+
+    def test_dead_daemon(self):
+        path = self.write_heartbeat(1, [["me", "cal", time.time()]])
+        old = time.time() - 3 * sync_daemon.HEARTBEAT_INTERVAL.total_seconds()
+        os.utime(path, (old, old))
+        self.assertFalse(is_synced_in_background("me", "cal"))
+
+    @mock.patch.object(sync_daemon, "HEARTBEAT_INTERVAL", timedelta(seconds=0.05))
+    def test_daemon(self):
+        other = self.write_heartbeat(1, [["me", "home", time.time()]])
+        synced = [True]
+
+        def sync_events(email, calendarId, max_staleness=None):
+            if not synced[0]:
+                raise OSError("offline")
+            return FakeData()
+
+        daemon = SyncDaemon(
+            {"me": ["cal"]},
+            min_interval=timedelta(seconds=0.05),
+            max_interval=timedelta(seconds=0.2),
+        )
+        with mock.patch.object(events_incremental, "sync_events", sync_events):
+            daemon.start()
+            time.sleep(0.3)
+            self.assertTrue(is_synced_in_background("me", "cal"))
+
+            synced[0] = False
+            time.sleep(0.5)
+            # The heartbeat is fresh, but the calendar no longer syncs
+            self.assertTrue(daemon.is_alive())
+            self.assertFalse(is_synced_in_background("me", "cal"))
+            daemon.stop()
+
+        # Only its own heartbeat is removed
+        own = sync_daemon._get_heartbeat_path(os.getpid())
+        self.assertFalse(os.path.exists(own))
+        self.assertTrue(os.path.exists(other))